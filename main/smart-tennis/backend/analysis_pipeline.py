@@ -0,0 +1,487 @@
+import os
+import re
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+# fcntl 僅限 POSIX；Windows 只以單一行程的開發伺服器執行，行程內的鎖已足夠
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from model_registry import ModelRegistry
+from session_pool import InferenceSessionPool, create_session_pool, configured_sessions, limit_threads
+from frame_bus import FrameBus
+from frame_index import FrameIndex, load_or_build
+from result_store import ResultStore
+from video_writer import ensure_h264_mp4_safe
+from upload_store import digest_path, write_digest
+from result_cache import create_result_cache, cache_key, file_sha256, cached_file_sha256, link_or_copy
+
+ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv'}
+
+# 片段分析的結果 ID：<file_id>_<起始幀>-<結束幀>（file_id 為 uuid，不含底線）
+RANGE_ID_PATTERN = re.compile(r'^(.+)_(\d+)-(\d+)$')
+
+
+def analysis_id(file_id, start_frame=0, end_frame=None):
+    """分析結果的 ID：整部影片即 file_id，片段為 <file_id>_<起始幀>-<結束幀>"""
+    if end_frame is None:
+        return file_id
+    return f"{file_id}_{start_frame}-{end_frame}"
+
+
+def parse_analysis_id(result_id):
+    """拆解分析結果 ID，回傳 (file_id, start_frame, end_frame)；整部影片時 end_frame 為 None"""
+    match = RANGE_ID_PATTERN.match(result_id)
+    if not match:
+        return result_id, 0, None
+    return match.group(1), int(match.group(2)), int(match.group(3))
+
+
+class ProgressReporter:
+    """
+    追蹤事件的 consumer：每 every 幀回報一次進度、處理速度（fps）與預估剩餘時間（秒）
+    callback(stage, frames_done, total_frames, fps, eta)
+    逐幀只做一次取餘數判斷，計時與回報只在每 every 幀進行，不拖慢追蹤迴圈
+    """
+    def __init__(self, callback, every=15, smoothing=0.3):
+        self.callback = callback
+        self.every = every
+        self.smoothing = smoothing
+        self.total_frames = 0
+        self.fps = None
+        self.last_time = None
+        self.last_done = 0
+
+    def _report(self, done):
+        now = time.monotonic()
+        elapsed = now - self.last_time
+        if elapsed > 0 and done > self.last_done:
+            current = (done - self.last_done) / elapsed
+            # 指數平滑，避免批次推論造成的速度跳動
+            self.fps = current if self.fps is None else self.fps + self.smoothing * (current - self.fps)
+        self.last_time = now
+        self.last_done = done
+        eta = max(0, self.total_frames - done) / self.fps if self.fps else None
+        self.callback('tracking', done, self.total_frames, self.fps, eta)
+
+    def consume(self, event):
+        kind = event['type']
+        if kind == 'frame':
+            done = event['frame_number'] + 1
+            if done % self.every == 0:
+                self._report(done)
+        elif kind == 'start':
+            self.total_frames = event['video_info']['total_frames']
+            self.last_time = time.monotonic()
+            self.last_done = 0
+            self.callback('tracking', 0, self.total_frames, None, None)
+        elif kind == 'end':
+            self._report(event['frames_processed'])
+
+
+class AnalysisPipeline:
+    """
+    單一影片的完整分析流程：網球追蹤、擊球檢測、速度分析與結果保存
+    由同步 API 與背景分析工作共用
+    分析器由 models（ModelRegistry）在第一次取用或背景預熱時才載入；直接傳入的分析器視為已就緒
+    追蹤器為工作階段池（trackers），每次分析借出一個，多個分析可同時進行而不共用同一個模型
+    """
+    def __init__(self, upload_folder, output_folder, tracker=None, shot_detector=None, speed_analyzer=None,
+                 pose_shot_detector=None, lazy_render=True, result_cache=None, models=None):
+        self.upload_folder = upload_folder
+        self.output_folder = output_folder
+        self.models = models or ModelRegistry()
+        if tracker is not None:
+            self.models.provide('trackers', InferenceSessionPool([tracker]))
+        for name, instance in (('shot_detector', shot_detector),
+                               ('speed_analyzer', speed_analyzer), ('pose_shot_detector', pose_shot_detector)):
+            if instance is not None:
+                self.models.provide(name, instance)
+        self.lazy_render = lazy_render
+        self.result_cache = result_cache
+        self.result_store = ResultStore(output_folder)
+
+        # 每部影片一把鎖，避免同時多個請求重複繪製同一部影片（跨行程另以鎖檔的 flock 互斥）
+        self.render_locks = {}
+        self.render_locks_guard = threading.Lock()
+
+    @property
+    def trackers(self):
+        return self.models.get('trackers')
+
+    @property
+    def tracker(self):
+        """讀取追蹤設定與繪製影片用的追蹤器；執行推論須以 trackers.checkout() 借出"""
+        return self.trackers.primary
+
+    @property
+    def shot_detector(self):
+        return self.models.get('shot_detector')
+
+    @property
+    def speed_analyzer(self):
+        return self.models.get('speed_analyzer')
+
+    @property
+    def pose_shot_detector(self):
+        # 未啟用姿態擊球檢測時不登記
+        return self.models.get('pose_shot_detector') if 'pose_shot_detector' in self.models else None
+
+    def find_video(self, file_id):
+        """尋找上傳的影片檔，找不到回傳 None"""
+        for ext in ALLOWED_EXTENSIONS:
+            potential_file = os.path.join(self.upload_folder, f"{file_id}.{ext}")
+            if os.path.exists(potential_file):
+                return potential_file
+        return None
+
+    def result_path(self, result_id):
+        return self.result_store.result_path(result_id)
+
+    def processed_video_path(self, result_id):
+        return os.path.join(self.output_folder, f"{result_id}_processed.mp4")
+
+    def detections_path(self, result_id):
+        return self.result_store.detections_path(result_id)
+
+    def video_digest(self, file_id):
+        """影片內容的 SHA-256（上傳時已邊寫邊算；舊的上傳則在此計算一次並保存）"""
+        digest_file = digest_path(self.upload_folder, file_id)
+        if os.path.exists(digest_file):
+            with open(digest_file, 'r', encoding='utf-8') as f:
+                return f.read().strip()
+        video_file = self.find_video(file_id)
+        if not video_file:
+            return None
+        digest = file_sha256(video_file)
+        write_digest(self.upload_folder, file_id, digest)
+        return digest
+
+    def resolve_range(self, file_id, start_time=None, end_time=None):
+        """
+        將時間範圍（秒）換算為幀範圍，回傳分析結果 ID；未指定範圍時回傳 file_id
+        以幀索引換算（可變幀率也正確），範圍不合法時拋出 ValueError
+        """
+        if start_time is None and end_time is None:
+            return file_id
+        video_file = self.find_video(file_id)
+        if not video_file:
+            raise FileNotFoundError(f"找不到影片檔案: {file_id}")
+        index = load_or_build(video_file)
+        start_frame = index.frame_at(float(start_time or 0))
+        end_frame = index.total_frames if end_time is None else index.frame_at(float(end_time))
+        if start_frame >= end_frame:
+            raise ValueError(f"分析範圍不正確（影片長度 {index.duration:.2f} 秒）")
+        if start_frame == 0 and end_frame == index.total_frames:
+            return file_id
+        return analysis_id(file_id, start_frame, end_frame)
+
+    def analysis_params(self):
+        """影響分析結果的模型與參數（結果快取鍵值的一部分）"""
+        model_path = self.tracker.model_path
+        return {
+            'weights': cached_file_sha256(model_path) if os.path.exists(model_path) else None,
+            'tracker': self.tracker.analysis_params(),
+            'pose_shots': self.pose_shot_detector is not None,
+            'shots': {
+                'swing_threshold': self.shot_detector.swing_threshold,
+                'shot_window': self.shot_detector.shot_window
+            },
+            'speed': {
+                'smoothing_window': self.speed_analyzer.smoothing_window,
+                'polynomial_order': self.speed_analyzer.polynomial_order
+            }
+        }
+
+    def cache_key(self, result_id):
+        file_id, start_frame, end_frame = parse_analysis_id(result_id)
+        digest = self.video_digest(file_id)
+        if not digest:
+            return None
+        params = self.analysis_params()
+        if end_frame is not None:
+            params['range'] = [start_frame, end_frame]
+        return cache_key(digest, params)
+
+    def restore_cached(self, result_id):
+        """
+        相同內容的影片已以相同參數分析過時，直接沿用快取的結果與處理後影片，回傳分析結果；
+        未啟用快取或未命中時回傳 None
+        """
+        if self.result_cache is None:
+            return None
+        key = self.cache_key(result_id)
+        files = self.result_cache.get(key) if key else None
+        if not files or 'analysis.json' not in files:
+            return None
+
+        try:
+            with open(files['analysis.json'], 'r', encoding='utf-8') as f:
+                analysis_results = json.load(f)
+            analysis_results['file_id'] = parse_analysis_id(result_id)[0]
+            analysis_results['analysis_id'] = result_id
+
+            processed_video_path = self.processed_video_path(result_id)
+            for stale_file in (processed_video_path, processed_video_path.rsplit('.mp4', 1)[0] + '_h264.mp4'):
+                if os.path.exists(stale_file):
+                    os.remove(stale_file)
+            if 'detections.npz' in files:
+                link_or_copy(files['detections.npz'], self.detections_path(result_id))
+            if 'processed.mp4' in files:
+                link_or_copy(files['processed.mp4'], processed_video_path)
+            self.result_store.save(result_id, analysis_results)
+        except (OSError, ValueError) as e:
+            # 讀取途中快取被淘汰，視為未命中
+            print(f"讀取結果快取失敗，重新分析: {e}")
+            return None
+
+        print(f"結果快取命中，沿用先前的分析結果: {result_id}")
+        return analysis_results
+
+    def store_in_cache(self, result_id):
+        """將分析結果、檢測結果與（已產生的）處理後影片加入快取"""
+        if self.result_cache is None:
+            return
+        try:
+            key = self.cache_key(result_id)
+            files = {'analysis.json': self.result_path(result_id)}
+            if os.path.exists(self.detections_path(result_id)):
+                files['detections.npz'] = self.detections_path(result_id)
+            if os.path.exists(self.processed_video_path(result_id)):
+                files['processed.mp4'] = self.processed_video_path(result_id)
+            self.result_cache.put(key, files)
+        except OSError as e:
+            print(f"寫入結果快取失敗: {e}")
+
+    def analyze(self, result_id, progress=None):
+        """
+        分析已上傳的影片（或片段，見 resolve_range）並保存結果，回傳分析結果
+        progress: callback(stage, frames_done, total_frames, fps, eta)，stage 為 tracking / shots / speed / saving
+        """
+        file_id, start_frame, end_frame = parse_analysis_id(result_id)
+        video_file = self.find_video(file_id)
+        if not video_file:
+            raise FileNotFoundError(f"找不到影片檔案: {file_id}")
+
+        def report(stage):
+            if progress is not None:
+                progress(stage, 0, 0, None, None)
+
+        cached_results = self.restore_cached(result_id)
+        if cached_results is not None:
+            return cached_results
+
+        print(f"開始分析影片: {video_file}")
+        if end_frame is not None:
+            print(f"分析片段: 第 {start_frame} 幀至第 {end_frame} 幀")
+
+        # 1. 網球追蹤，擊球與速度分析隨追蹤事件同步進行
+        #    影片只解碼一次，由 FrameBus 分派給追蹤與其他逐幀分析器
+        #    延遲繪製時不在此輸出處理後影片，並清除舊的快取影片
+        processed_video_path = self.processed_video_path(result_id)
+        if self.lazy_render:
+            for stale_file in (processed_video_path, processed_video_path.rsplit('.mp4', 1)[0] + '_h264.mp4'):
+                if os.path.exists(stale_file):
+                    os.remove(stale_file)
+        #    片段分析由幀索引跳到最近的關鍵幀，不從頭解碼
+        #    只有片段分析或有其他逐幀分析器（姿態擊球檢測）時才需要匯流排；
+        #    否則由追蹤器自行解碼，TRACK_SHARDS > 1 時分段平行追蹤
+        bus = None
+        pose_consumer = None
+        if end_frame is not None or self.pose_shot_detector:
+            if self.trackers.primary.shards > 1:
+                print("⚠️  片段分析與姿態擊球檢測需單次解碼分派逐幀影像，本次分析不使用 TRACK_SHARDS 分段追蹤")
+            if end_frame is not None:
+                bus = FrameBus(video_file, start_frame, end_frame, index=load_or_build(video_file))
+            else:
+                bus = FrameBus(video_file)
+            if self.pose_shot_detector:
+                pose_consumer = bus.subscribe(self.pose_shot_detector.pose_consumer())
+        shot_stream = self.shot_detector.stream()
+        speed_stream = self.speed_analyzer.stream()
+        consumers = [shot_stream, speed_stream]
+        if progress is not None:
+            consumers.append(ProgressReporter(progress))
+        try:
+            with self.trackers.checkout() as tracker:
+                tracking_results = tracker.track_ball(
+                    video_file,
+                    output_path=None if self.lazy_render else processed_video_path,
+                    consumers=consumers,
+                    bus=bus
+                )
+        except Exception:
+            # 追蹤失敗時釋放本次分析專用的 Pose 實例
+            if pose_consumer is not None:
+                pose_consumer.close()
+            raise
+
+        # 2. 正反手檢測
+        report('shots')
+        if pose_consumer is not None:
+            shot_results = pose_consumer.detect_shots(tracking_results)
+        else:
+            shot_results = shot_stream.result()
+
+        # 3. 速度分析
+        report('speed')
+        speed_results = speed_stream.result()
+
+        # 追蹤時已直接編碼為 H.264 則不需再轉碼；否則（無 ffmpeg 時的 mp4v 輸出）轉碼為瀏覽器兼容格式
+        if not self.lazy_render and tracking_results['video_info'].get('output_codec') != 'h264':
+            try:
+                h264_out = ensure_h264_mp4_safe(processed_video_path)
+                if h264_out:
+                    print("已將處理後影片轉碼為 H.264，瀏覽器可播放。")
+            except Exception as _:
+                pass
+
+        # 逐幀檢測以欄式格式另存，結果 JSON 只保存摘要與軌跡
+        report('saving')
+        ball_positions = tracking_results['ball_positions']
+        tracking_payload = {key: value for key, value in tracking_results.items() if key != 'ball_positions'}
+
+        # 整合結果
+        analysis_results = {
+            'file_id': file_id,
+            'analysis_id': result_id,
+            'timestamp': datetime.now().isoformat(),
+            'tracking': tracking_payload,
+            'shots': shot_results,
+            'speed': speed_results,
+            'summary': {
+                'total_shots': len(shot_results.get('shots', [])),
+                'forehand_count': len([s for s in shot_results.get('shots', []) if s.get('type') == 'forehand']),
+                'backhand_count': len([s for s in shot_results.get('shots', []) if s.get('type') == 'backhand']),
+                'max_speed': speed_results.get('max_speed', 0),
+                'avg_speed': speed_results.get('avg_speed', 0)
+            }
+        }
+
+        self.result_store.save(result_id, analysis_results, ball_positions)
+        self.store_in_cache(result_id)
+
+        return analysis_results
+
+    @contextmanager
+    def _render_lock(self, result_id):
+        """
+        取得處理後影片的繪製權：同行程以執行緒鎖、跨行程（gunicorn 多個 worker）以
+        每個結果一個鎖檔的 flock 互斥
+        """
+        with self.render_locks_guard:
+            lock = self.render_locks.setdefault(result_id, threading.Lock())
+        with lock:
+            lock_path = os.path.join(self.output_folder, f"{result_id}_processed.lock")
+            # 關閉檔案時釋放 flock
+            with open(lock_path, 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                yield
+
+    def render_processed_video(self, result_id):
+        """由保存的檢測結果繪製處理後影片，回傳影片路徑；缺少影片或檢測結果時回傳 None"""
+        processed_file = self.processed_video_path(result_id)
+        with self._render_lock(result_id):
+            # 等待期間可能已由其他請求或其他行程繪製完成
+            if os.path.exists(processed_file):
+                return processed_file
+
+            file_id, start_frame, end_frame = parse_analysis_id(result_id)
+            video_file = self.find_video(file_id)
+            if not video_file or self.result_store.version(result_id) is None:
+                return None
+            _, ball_positions = self.result_store.load(result_id)
+            if ball_positions is None:
+                return None
+
+            codec = self.tracker.render_video(video_file, ball_positions, processed_file, start_frame, end_frame,
+                                              index=FrameIndex.load(video_file))
+            if codec != 'h264':
+                ensure_h264_mp4_safe(processed_file)
+
+            # 之後重複上傳的相同影片可直接取得處理後影片
+            if self.result_cache is not None:
+                key = self.cache_key(result_id)
+                if key:
+                    self.result_cache.add_file(key, 'processed.mp4', processed_file)
+            return processed_file
+
+
+def load_tracker(inference_client=None):
+    from tennis_tracker import TennisTracker
+    return TennisTracker(model_path=os.getenv('YOLO_MODEL_PATH', None), inference_client=inference_client)
+
+
+def load_trackers(cores=None):
+    """
+    追蹤器工作階段池（INFERENCE_SESSIONS 個）
+    INFERENCE_SERVER_ADDRESS：各工作階段連線到獨立行程的批次推論伺服器，本行程不載入模型
+    INFERENCE_BATCHING=1：本行程載入一份模型並啟動批次推論伺服器，同時進行的分析合併批次推論
+    皆未設定時各工作階段各自載入一份模型
+    """
+    address = os.getenv('INFERENCE_SERVER_ADDRESS', '').strip()
+    if address:
+        from inference_server import SocketInferenceClient
+        return InferenceSessionPool([load_tracker(SocketInferenceClient(address))
+                                     for _ in range(configured_sessions())])
+    if os.getenv('INFERENCE_BATCHING', '0') == '1':
+        from inference_server import InferenceClient, create_inference_server
+        # 只有推論伺服器執行模型，分配到的核心全部給它
+        if cores:
+            limit_threads(cores)
+        server = create_inference_server(load_tracker())
+        return InferenceSessionPool([load_tracker(InferenceClient(server)) for _ in range(configured_sessions())],
+                                    cores, inference_server=server)
+    return create_session_pool(load_tracker, cores=cores)
+
+
+def load_shot_detector():
+    from shot_detector import ShotDetector
+    return ShotDetector()
+
+
+def load_speed_analyzer():
+    from speed_analyzer import SpeedAnalyzer
+    return SpeedAnalyzer()
+
+
+def load_pose_shot_detector():
+    """姿態擊球檢測（需要 mediapipe），與網球追蹤共用同一次解碼；無法啟用時回傳 None"""
+    try:
+        from shot_detector_original import ShotDetector as PoseShotDetector
+        return PoseShotDetector()
+    except Exception as e:
+        print(f"姿態擊球檢測無法啟用，使用簡化模式: {e}")
+        return None
+
+
+def create_pipeline(upload_folder='../uploads', output_folder='../output', cores=None):
+    """
+    依環境變數建立分析器（app 啟動時與背景工作行程各呼叫一次）
+    只登記模型，不在此匯入 ultralytics / scipy；MODEL_WARMUP=1（預設）時在背景載入並預熱，
+    MODEL_WARMUP=0 時延遲到第一次分析才載入
+    cores：分配給此行程推論的 CPU 核心數（預設為全部）
+    """
+    models = ModelRegistry()
+    models.register('trackers', lambda: load_trackers(cores))
+    models.register('shot_detector', load_shot_detector)
+    models.register('speed_analyzer', load_speed_analyzer)
+    if os.getenv('POSE_SHOT_DETECTION', '0') == '1':
+        models.register('pose_shot_detector', load_pose_shot_detector)
+
+    pipeline = AnalysisPipeline(
+        upload_folder,
+        output_folder,
+        # 延遲繪製：分析時只保存檢測結果，第一次請求處理後影片時才繪製並快取
+        lazy_render=os.getenv('LAZY_RENDER', '1') == '1',
+        # 相同影片重複上傳時沿用先前的分析結果
+        result_cache=create_result_cache(output_folder),
+        models=models
+    )
+    if os.getenv('MODEL_WARMUP', '1') == '1':
+        models.start_warmup()
+    return pipeline
@@ -1,12 +1,19 @@
-from flask import Flask, request, jsonify, send_file
+import time
+# 開始匯入的時間：健康檢查回報啟動與模型就緒各花了多久
+PROCESS_START = time.monotonic()
+
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 import os
-import cv2
 import json
+import gzip
+import hashlib
 from werkzeug.utils import secure_filename
-from tennis_tracker import TennisTracker
-from shot_detector import ShotDetector
-from speed_analyzer import SpeedAnalyzer
+from frame_bus import probe_video
+from analysis_pipeline import ALLOWED_EXTENSIONS, create_pipeline
+from job_queue import create_job_queue, QueueFullError, PROGRESS_FIELDS, FINAL_STATUSES
+from upload_store import create_upload_store, save_stream, write_digest, UploadOffsetError
+from frame_index import build_index_async, load_or_build
 import uuid
 from datetime import datetime
 
@@ -16,79 +23,72 @@ CORS(app)
 # 設定
 UPLOAD_FOLDER = '../uploads'
 OUTPUT_FOLDER = '../output'
-ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv'}
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB 限制
+app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB 限制（單次請求；較大的影片以 /api/uploads 分段上傳）
+
+# 結果回應超過此大小（位元組）且用戶端支援時以 gzip 壓縮
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = int(os.getenv('RESULTS_GZIP_LEVEL', '6'))
+
+# 背景預熱模型；關閉時模型延遲到第一次分析才載入，服務啟動後即視為就緒
+MODEL_WARMUP = os.getenv('MODEL_WARMUP', '1') == '1'
+
+# SSE 進度推送讀取工作狀態的間隔（秒）
+SSE_POLL_INTERVAL = float(os.getenv('SSE_POLL_INTERVAL', '0.5'))
 
 # 確保資料夾存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
 # 初始化分析器
-tennis_tracker = TennisTracker(model_path=os.getenv('YOLO_MODEL_PATH', None))
-shot_detector = ShotDetector()
-speed_analyzer = SpeedAnalyzer()
-
-# 確保處理後影片為瀏覽器可播放的 H.264 MP4 格式
-# 若系統未安裝 ffmpeg，會嘗試透過 imageio-ffmpeg 自動下載內建版本
-# 若未安裝 imageio-ffmpeg，將跳過轉碼（可能導致瀏覽器無法播放）
-
-def ensure_h264_mp4_safe(input_path: str):
-    """以非破壞方式轉碼：輸出到 *_h264.mp4，成功後再原子替換。避免 Windows 檔案佔用導致 500。"""
-    try:
-        import os
-        import subprocess
-        try:
-            import imageio_ffmpeg as ioff
-        except Exception:
-            print("提示: 建議安裝 imageio-ffmpeg 以轉碼為 H.264，確保瀏覽器可播放。\n    安裝指令: pip install imageio-ffmpeg")
-            return None
-
-        ffmpeg_exe = ioff.get_ffmpeg_exe()
-        tmp_output = input_path.rsplit('.mp4', 1)[0] + '_h264.mp4'
-        # 若前次殘留，先嘗試刪除暫存輸出
-        try:
-            if os.path.exists(tmp_output):
-                os.remove(tmp_output)
-        except Exception:
-            pass
-        # 將 moov atom 前移（+faststart），並使用瀏覽器通用的像素格式
-        cmd = [
-            ffmpeg_exe,
-            '-y',
-            '-i', input_path,
-            '-c:v', 'libx264',
-            '-pix_fmt', 'yuv420p',
-            '-movflags', '+faststart',
-            '-preset', 'veryfast',
-            tmp_output
-        ]
-        try:
-            res = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            # 嘗試原子替換，若失敗則保留原檔與新檔並回傳新檔路徑讓呼叫者改用
-            try:
-                os.replace(tmp_output, input_path)
-                return input_path
-            except Exception as e:
-                print(f"原檔替換失敗，改用轉碼檔回傳：{e}")
-                return tmp_output if os.path.exists(tmp_output) else None
-        except Exception as e:
-            print(f"轉碼失敗（保留原檔）：{e}\n詳細: {getattr(e, 'stderr', b'').decode('utf-8', errors='ignore')}")
-            return None
-    except Exception as e:
-        print(f"轉碼流程發生異常（保留原檔）：{e}")
-        return None
+# 以 spawn 啟動的工作行程會以 __mp_main__ 名稱重新匯入本檔，工作行程不需要（也不應重複載入）分析器與工作佇列
+if __name__ != '__mp_main__':
+    # 只登記模型，載入與預熱在背景進行，健康檢查在匯入完成後即可回應
+    pipeline = create_pipeline(UPLOAD_FOLDER, OUTPUT_FOLDER)
+    
+    # 背景分析工作佇列（/api/jobs）
+    job_queue = create_job_queue(OUTPUT_FOLDER, UPLOAD_FOLDER, pipeline=pipeline)
+    
+    # 可續傳的分段上傳（/api/uploads）
+    upload_store = create_upload_store(UPLOAD_FOLDER, ALLOWED_EXTENSIONS)
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def readiness():
+    """模型是否已就緒，以及啟動與就緒各花了幾秒（尚未就緒時為 None）"""
+    models = pipeline.models
+    ready = models.ready() or not MODEL_WARMUP
+    trackers = models.peek('trackers')
+    return {
+        'ready': ready,
+        'models': models.status(),
+        'inference_sessions': trackers.status() if trackers is not None else None,
+        'startup_seconds': round(STARTUP_SECONDS, 3),
+        'ready_seconds': round(models.ready_at - PROCESS_START, 3) if models.ready_at is not None else None
+    }
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """健康檢查端點"""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
+    """健康檢查端點（存活即回應 200，另附模型就緒狀態）"""
+    return jsonify(dict(readiness(), status='healthy', pid=os.getpid(), timestamp=datetime.now().isoformat()))
+
+@app.route('/api/health/live', methods=['GET'])
+def liveness_check():
+    """存活檢查：行程可回應請求即為 200，不等待模型"""
+    return jsonify({'status': 'alive', 'timestamp': datetime.now().isoformat()})
+
+@app.route('/api/health/ready', methods=['GET'])
+def readiness_check():
+    """就緒檢查：模型預熱完成前回傳 503，負載平衡器據此決定是否導入流量"""
+    payload = readiness()
+    if payload['ready']:
+        return jsonify(dict(payload, status='ready'))
+    failed = any(model['state'] == 'failed' for model in payload['models'].values())
+    return jsonify(dict(payload, status='failed' if failed else 'starting')), 503
 
 @app.route('/api/upload', methods=['POST'])
 def upload_video():
@@ -108,30 +108,20 @@ def upload_video():
             file_extension = filename.rsplit('.', 1)[1].lower()
             new_filename = f"{file_id}.{file_extension}"
             
-            # 保存檔案
+            # 保存檔案（邊寫邊計算內容雜湊，結果快取不必再讀一次）
             file_path = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
-            file.save(file_path)
+            write_digest(app.config['UPLOAD_FOLDER'], file_id, save_stream(file.stream, file_path))
+            # 在背景建立幀索引（片段分析與跳轉用）
+            build_index_async(file_path)
             
-            # 獲取影片資訊
-            cap = cv2.VideoCapture(file_path)
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            duration = frame_count / fps if fps > 0 else 0
-            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            cap.release()
+            # 獲取影片資訊（只讀檔頭，不解碼）
+            info = probe_video(file_path)
             
             return jsonify({
                 'success': True,
                 'file_id': file_id,
                 'filename': filename,
-                'video_info': {
-                    'duration': duration,
-                    'fps': fps,
-                    'width': width,
-                    'height': height,
-                    'frame_count': frame_count
-                }
+                'video_info': format_video_info(info)
             })
         
         return jsonify({'error': '不支援的檔案格式'}), 400
@@ -139,86 +129,288 @@ def upload_video():
     except Exception as e:
         return jsonify({'error': f'上傳失敗: {str(e)}'}), 500
 
+def format_video_info(info):
+    fps = info['fps']
+    frame_count = info['total_frames']
+    return {
+        'duration': frame_count / fps if fps > 0 else 0,
+        'fps': fps,
+        'width': info['width'],
+        'height': info['height'],
+        'frame_count': frame_count
+    }
+
+def upload_status(state):
+    return {
+        'upload_id': state['id'],
+        'offset': state['offset'],
+        'size': state['size'],
+        'chunk_size': upload_store.chunk_size,
+        'video_info': format_video_info(state['video_info']) if state['video_info'] else None
+    }
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """
+    建立分段上傳（JSON：filename、size，可選 analyze）
+    之後以 PUT /api/uploads/<upload_id> 依序傳送各段，標頭 Upload-Offset 為該段起點
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        filename = secure_filename(data.get('filename') or '')
+        try:
+            size = int(data.get('size', 0))
+        except (TypeError, ValueError):
+            size = 0
+        state = upload_store.create(filename, size, analyze=data.get('analyze', False))
+        return jsonify(dict(upload_status(state), success=True)), 201
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'建立上傳失敗: {str(e)}'}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """查詢已收到的位元組數，續傳時從 offset 繼續"""
+    state = upload_store.get(upload_id)
+    if not state:
+        return jsonify({'error': '找不到上傳'}), 404
+    return jsonify(upload_status(state))
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """
+    寫入一段資料（請求本文為原始位元組）
+    未完成時回傳目前進度；最後一段完成時回傳與 /api/upload 相同的結果，
+    建立上傳時指定 analyze 則同時提交分析工作
+    """
+    try:
+        offset = int(request.headers.get('Upload-Offset', '-1'))
+    except ValueError:
+        offset = -1
+    try:
+        state = upload_store.append(upload_id, offset, request.stream)
+    except KeyError:
+        return jsonify({'error': '找不到上傳'}), 404
+    except UploadOffsetError as e:
+        return jsonify({'error': str(e), 'offset': e.offset}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'上傳失敗: {str(e)}'}), 500
+    
+    if 'file_id' not in state:
+        return jsonify(upload_status(state))
+    
+    build_index_async(state['path'])
+    response = {
+        'success': True,
+        'file_id': state['file_id'],
+        'filename': state['filename'],
+        'video_info': format_video_info(state['video_info'])
+    }
+    if state['analyze']:
+        try:
+            response['job'] = job_queue.submit(state['file_id'])
+        except QueueFullError as e:
+            # 影片已保存，稍後再提交分析即可
+            response['job_error'] = str(e)
+    return jsonify(response), 201
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    """取消分段上傳"""
+    if not upload_store.get(upload_id):
+        return jsonify({'error': '找不到上傳'}), 404
+    upload_store.abort(upload_id)
+    return jsonify({'success': True})
+
+def requested_range(data):
+    """請求中的分析時間範圍（秒），未指定時為 None"""
+    start_time = data.get('start_time')
+    end_time = data.get('end_time')
+    return (None if start_time is None else float(start_time),
+            None if end_time is None else float(end_time))
+
+@app.route('/api/videos/<file_id>/index', methods=['GET'])
+def get_video_index(file_id):
+    """影片的幀索引摘要（總幀數、長度與關鍵幀時間），供選擇分析片段使用"""
+    try:
+        video_file = pipeline.find_video(file_id)
+        if not video_file:
+            return jsonify({'error': '找不到影片檔案'}), 404
+        index = load_or_build(video_file)
+        return jsonify({
+            'file_id': file_id,
+            'fps': index.fps,
+            'total_frames': index.total_frames,
+            'duration': index.duration,
+            'keyframe_times': index.times[index.keyframes].tolist()
+        })
+    
+    except Exception as e:
+        return jsonify({'error': f'讀取幀索引失敗: {str(e)}'}), 500
+
 @app.route('/api/analyze/<file_id>', methods=['POST'])
 def analyze_video(file_id):
-    """分析影片端點"""
+    """
+    分析影片端點（同步執行，長影片請改用 /api/jobs）
+    可選 JSON：start_time、end_time（秒）只分析該片段，結果以 analysis_id 保存與查詢
+    """
     try:
-        # 尋找檔案
-        video_file = None
-        for ext in ALLOWED_EXTENSIONS:
-            potential_file = os.path.join(app.config['UPLOAD_FOLDER'], f"{file_id}.{ext}")
-            if os.path.exists(potential_file):
-                video_file = potential_file
-                break
-        
-        if not video_file:
+        if not pipeline.find_video(file_id):
             return jsonify({'error': '找不到影片檔案'}), 404
         
-        # 執行分析
-        print(f"開始分析影片: {video_file}")
-        
-        # 1. 網球追蹤（同時輸出處理後影片）
-        processed_video_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{file_id}_processed.mp4")
-        tracking_results = tennis_tracker.track_ball(video_file, output_path=processed_video_path)
-        
-        # 2. 正反手檢測
-        shot_results = shot_detector.detect_shots(video_file, tracking_results)
-        
-        # 3. 速度分析
-        speed_results = speed_analyzer.analyze_speed(tracking_results)
-
-        # 將處理後影片轉碼為瀏覽器兼容格式（若可用，非破壞性輸出）
         try:
-            h264_out = ensure_h264_mp4_safe(processed_video_path)
-            if h264_out:
-                print("已將處理後影片轉碼為 H.264，瀏覽器可播放。")
-        except Exception as _:
-            pass
-        
-        # 整合結果
-        analysis_results = {
-            'file_id': file_id,
-            'timestamp': datetime.now().isoformat(),
-            'tracking': tracking_results,
-            'shots': shot_results,
-            'speed': speed_results,
-            'summary': {
-                'total_shots': len(shot_results.get('shots', [])),
-                'forehand_count': len([s for s in shot_results.get('shots', []) if s.get('type') == 'forehand']),
-                'backhand_count': len([s for s in shot_results.get('shots', []) if s.get('type') == 'backhand']),
-                'max_speed': speed_results.get('max_speed', 0),
-                'avg_speed': speed_results.get('avg_speed', 0)
-            }
-        }
-        
-        # 保存結果
-        result_file = os.path.join(app.config['OUTPUT_FOLDER'], f"{file_id}_analysis.json")
-        with open(result_file, 'w', encoding='utf-8') as f:
-            json.dump(analysis_results, f, ensure_ascii=False, indent=2)
+            result_id = pipeline.resolve_range(file_id, *requested_range(request.get_json(silent=True) or {}))
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        pipeline.analyze(result_id)
         
-        return jsonify({
+        return json_response({
             'success': True,
-            'results': analysis_results
+            'results': pipeline.result_store.query(result_id)
         })
     
     except Exception as e:
         print(f"分析錯誤: {str(e)}")
         return jsonify({'error': f'分析失敗: {str(e)}'}), 500
 
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    提交背景分析工作，立即回傳工作 ID
+    可選 start_time、end_time（秒）只分析該片段，工作的 file_id 為片段的分析結果 ID
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        file_id = data.get('file_id')
+        if not file_id:
+            return jsonify({'error': '缺少 file_id'}), 400
+        if not pipeline.find_video(file_id):
+            return jsonify({'error': '找不到影片檔案'}), 404
+        
+        try:
+            result_id = pipeline.resolve_range(file_id, *requested_range(data))
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        job = job_queue.submit(result_id)
+        return jsonify({'success': True, 'job': job}), 202
+    
+    except QueueFullError as e:
+        resp = jsonify({'error': str(e)})
+        resp.headers['Retry-After'] = '30'
+        return resp, 429
+    except Exception as e:
+        return jsonify({'error': f'提交分析失敗: {str(e)}'}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查詢工作狀態"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': '找不到分析工作'}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/progress', methods=['GET'])
+def get_job_progress(job_id):
+    """查詢工作進度（輕量版狀態，供前端輪詢）"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': '找不到分析工作'}), 404
+    return jsonify({key: job[key] for key in PROGRESS_FIELDS})
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """
+    以 Server-Sent Events 推送工作進度（階段、已處理幀數、fps、預估剩餘秒數）
+    進度變化時送出 progress 事件，工作結束時送出 done 事件後關閉連線
+    """
+    if not job_queue.get(job_id):
+        return jsonify({'error': '找不到分析工作'}), 404
+
+    def generate():
+        # 建議瀏覽器斷線後 3 秒重新連線
+        yield 'retry: 3000\n\n'
+        for snapshot in job_queue.watch(job_id, interval=SSE_POLL_INTERVAL):
+            if snapshot is None:
+                yield ': keep-alive\n\n'
+                continue
+            event = 'done' if snapshot['status'] in FINAL_STATUSES else 'progress'
+            yield f"event: {event}\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # 避免反向代理緩衝事件
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """取得已完成工作的分析結果"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': '找不到分析工作'}), 404
+    if job['status'] == 'failed':
+        return jsonify({'error': f"分析失敗: {job['error']}", 'job': job}), 500
+    if job['status'] != 'succeeded':
+        return jsonify({'error': '分析尚未完成', 'job': job}), 409
+    return get_results(job['file_id'])
+
+def json_response(payload, etag=None):
+    """
+    緊湊 JSON 回應：用戶端接受 gzip 且內容夠大時壓縮；指定 etag 時附上 ETag，
+    並要求瀏覽器每次以 If-None-Match 重新驗證
+    """
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    headers = {'Vary': 'Accept-Encoding'}
+    if len(body) >= GZIP_MIN_SIZE and 'gzip' in request.accept_encodings:
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        headers['Content-Encoding'] = 'gzip'
+    resp = Response(body, mimetype='application/json', headers=headers)
+    if etag:
+        resp.set_etag(etag, weak=True)
+        resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
 @app.route('/api/results/<file_id>', methods=['GET'])
 def get_results(file_id):
-    """獲取分析結果"""
+    """
+    獲取分析結果（file_id 亦可為片段的 analysis_id）
+    查詢參數：
+        fields       以逗號分隔的欄位，例如 summary,shots 或 tracking.video_info（預設全部）
+        frame_start  逐幀資料（tracking.ball_positions）分頁的起始幀
+        frame_end    分頁的結束幀（不含），預設到最後一幀
+    回應附 ETag，結果未改變時對 If-None-Match 回應 304，不讀取結果內容
+    """
     try:
-        result_file = os.path.join(app.config['OUTPUT_FOLDER'], f"{file_id}_analysis.json")
+        fields = request.args.get('fields')
+        fields = [field.strip() for field in fields.split(',') if field.strip()] if fields else None
+        try:
+            frame_start = max(0, int(request.args.get('frame_start', 0)))
+            frame_end = request.args.get('frame_end')
+            frame_end = None if frame_end is None else max(0, int(frame_end))
+        except ValueError:
+            return jsonify({'error': 'frame_start / frame_end 必須為整數'}), 400
         
-        if not os.path.exists(result_file):
+        version = pipeline.result_store.version(file_id)
+        if version is None:
             return jsonify({'error': '找不到分析結果'}), 404
         
-        with open(result_file, 'r', encoding='utf-8') as f:
-            results = json.load(f)
+        query = json.dumps([fields, frame_start, frame_end])
+        etag = hashlib.sha1(f"{file_id}|{version}|{query}".encode('utf-8')).hexdigest()[:20]
+        if request.if_none_match.contains_weak(etag):
+            resp = Response(status=304)
+            resp.set_etag(etag, weak=True)
+            resp.headers['Cache-Control'] = 'no-cache'
+            return resp
         
-        return jsonify(results)
+        results = pipeline.result_store.query(file_id, fields, frame_start, frame_end)
+        return json_response(results, etag=etag)
     
+    except FileNotFoundError:
+        return jsonify({'error': '找不到分析結果'}), 404
     except Exception as e:
         return jsonify({'error': f'讀取結果失敗: {str(e)}'}), 500
 
@@ -238,7 +430,10 @@ def get_video(file_id):
 
 @app.route('/api/processed-video/<file_id>', methods=['GET'])
 def get_processed_video(file_id):
-    """獲取處理後的影片。注意：不要在此處做任何轉碼或覆蓋，避免 Windows 檔案佔用導致 500。"""
+    """
+    獲取處理後的影片。注意：不要在此處覆蓋已存在的影片，避免 Windows 檔案佔用導致 500。
+    影片尚未產生時（延遲繪製），由保存的檢測結果繪製一次並快取，之後的請求直接回傳。
+    """
     try:
         processed_file = os.path.join(app.config['OUTPUT_FOLDER'], f"{file_id}_processed.mp4")
         alt_file = processed_file.rsplit('.mp4', 1)[0] + '_h264.mp4'
@@ -250,6 +445,11 @@ def get_processed_video(file_id):
         elif os.path.exists(processed_file):
             candidate = processed_file
 
+        if not candidate:
+            candidate = pipeline.render_processed_video(file_id)
+            if candidate and os.path.exists(alt_file):
+                candidate = alt_file
+        
         if not candidate:
             return jsonify({'error': '找不到處理後的影片'}), 404
 
@@ -265,6 +465,9 @@ def get_processed_video(file_id):
     except Exception as e:
         return jsonify({'error': f'讀取處理後影片失敗: {str(e)}'}), 500
 
+# 匯入完成（可回應請求）所花的時間
+STARTUP_SECONDS = time.monotonic() - PROCESS_START
+
 if __name__ == '__main__':
     print("啟動 Smart Tennis 後端服務...")
     print("伺服器地址: http://localhost:5000")
@@ -0,0 +1,234 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+# 指派成本矩陣中代表「不可配對」的值
+_INVALID_COST = 1e9
+
+
+def _inverse_2x2(matrices):
+    """批次計算 2x2 矩陣的反矩陣（比 np.linalg.inv 在小矩陣上快得多）"""
+    a = matrices[:, 0, 0]
+    b = matrices[:, 0, 1]
+    c = matrices[:, 1, 0]
+    d = matrices[:, 1, 1]
+    inverse = np.empty_like(matrices)
+    inverse[:, 0, 0] = d
+    inverse[:, 0, 1] = -b
+    inverse[:, 1, 0] = -c
+    inverse[:, 1, 1] = a
+    return inverse / (a * d - b * c)[:, None, None]
+
+
+def _transition_matrix(dt):
+    """
+    狀態轉移矩陣，狀態為 [x, y, vx, vy, ay]（單位：像素、幀）
+    水平等速、垂直等加速度（重力與透視造成的 y 方向加速度）
+    """
+    return np.array([
+        [1.0, 0.0, dt, 0.0, 0.0],
+        [0.0, 1.0, 0.0, dt, 0.5 * dt * dt],
+        [0.0, 0.0, 1.0, 0.0, 0.0],
+        [0.0, 0.0, 0.0, 1.0, dt],
+        [0.0, 0.0, 0.0, 0.0, 1.0]
+    ])
+
+
+class KalmanBallTracker:
+    """
+    以卡爾曼濾波追蹤多條網球軌跡
+
+    每幀對所有軌跡做預測，以馬氏距離建立向量化成本矩陣並閘控，
+    再以匈牙利演算法指派檢測。軌跡最多可跨越 max_disappeared 幀的漏檢，
+    漏檢的幀以前後觀測線性補齊。每幀成本只與當下活躍的軌跡數有關，
+    整體隨影片長度線性成長。
+    """
+
+    def __init__(self, max_disappeared=10, min_hits=6, confirm_hits=3, gate_threshold=9.21,
+                 measurement_noise=4.0, process_noise=(1.0, 4.0, 0.25)):
+        """
+        max_disappeared: 軌跡可容忍的連續漏檢幀數
+        min_hits: 軌跡至少需要的實際觀測數，較短的軌跡視為雜訊
+        confirm_hits: 觀測數未達此值的暫定軌跡只容忍一幀漏檢，
+            避免速度未知、閘控範圍很大的誤檢軌跡吸走真正的球
+        gate_threshold: 馬氏距離平方的閘控門檻（預設為 2 自由度的 99% 卡方值）
+        measurement_noise: 檢測中心的量測變異數（像素²）
+        process_noise: 位置、速度、加速度的過程雜訊變異數
+        """
+        self.max_disappeared = max_disappeared
+        self.min_hits = min_hits
+        self.confirm_hits = confirm_hits
+        self.gate_threshold = gate_threshold
+        self.R = np.eye(2) * measurement_noise
+        q_pos, q_vel, q_acc = process_noise
+        self.Q = np.diag([q_pos, q_pos, q_vel, q_vel, q_acc])
+        # 新軌跡的初始不確定度：速度與加速度未知
+        self.initial_covariance = np.diag([measurement_noise, measurement_noise, 400.0, 400.0, 4.0])
+
+        self.states = np.zeros((0, 5))
+        self.covariances = np.zeros((0, 5, 5))
+        self.tracks = []
+        self.last_frame = None
+        self.next_track_id = 0
+        self._transitions = {}
+
+    def update(self, frame_number, timestamp, centers, confidences, interpolated=None):
+        """
+        輸入一幀的檢測結果，回傳在此幀結束且長度足夠的軌跡 [(軌跡ID, 軌跡點列表), ...]
+        軌跡ID 依建立順序遞增，因此也依起始幀排序
+        centers: (N, 2) 檢測中心；confidences: (N,) 信心分數；interpolated: (N,) 是否為插值檢測
+        """
+        if self.last_frame is not None and self.tracks:
+            self._predict(frame_number - self.last_frame)
+        self.last_frame = frame_number
+
+        measurements = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        confidences = np.asarray(confidences, dtype=np.float64).reshape(-1)
+        if interpolated is None:
+            interpolated = np.zeros(len(measurements), dtype=bool)
+        matches, unmatched_tracks, unmatched_detections, S_inv = self._associate(measurements)
+
+        if matches:
+            self._correct(matches, measurements, S_inv)
+            for track_index, detection_index in matches:
+                self._append_observation(self.tracks[track_index], frame_number, timestamp,
+                                         measurements[detection_index], confidences[detection_index],
+                                         interpolated[detection_index])
+
+        finished = []
+        keep = np.ones(len(self.tracks), dtype=bool)
+        for track_index in unmatched_tracks:
+            track = self.tracks[track_index]
+            track['misses'] += 1
+            max_misses = self.max_disappeared if track['hits'] >= self.confirm_hits else 1
+            if track['misses'] > max_misses:
+                keep[track_index] = False
+                if track['hits'] >= self.min_hits:
+                    finished.append((track['id'], track['points']))
+
+        if not keep.all():
+            self.states = self.states[keep]
+            self.covariances = self.covariances[keep]
+            self.tracks = [track for track, kept in zip(self.tracks, keep) if kept]
+
+        for detection_index in unmatched_detections:
+            self._start_track(frame_number, timestamp, measurements[detection_index],
+                              confidences[detection_index], interpolated[detection_index])
+
+        return finished
+
+    def finish(self):
+        """影片結束時關閉所有軌跡，回傳長度足夠者"""
+        finished = [(track['id'], track['points']) for track in self.tracks if track['hits'] >= self.min_hits]
+        self.states = np.zeros((0, 5))
+        self.covariances = np.zeros((0, 5, 5))
+        self.tracks = []
+        return finished
+
+    def earliest_open_frame(self):
+        """仍在追蹤中的軌跡最早的起始幀；沒有軌跡時回傳 None"""
+        if not self.tracks:
+            return None
+        return min(track['points'][0]['frame'] for track in self.tracks)
+
+    def _predict(self, dt):
+        """所有軌跡同時往前預測 dt 幀"""
+        if dt <= 0:
+            return
+        F = self._transitions.get(dt)
+        if F is None:
+            F = self._transitions[dt] = _transition_matrix(dt)
+        self.states = self.states @ F.T
+        self.covariances = F @ self.covariances @ F.T + self.Q * dt
+
+    def _associate(self, measurements):
+        """
+        以馬氏距離成本矩陣指派檢測。先配對上一幀仍有觀測的軌跡，
+        剩下的檢測再分配給漏檢中的軌跡，避免漂移的舊軌跡搶走新軌跡的球
+        """
+        track_count = len(self.tracks)
+        detection_count = len(measurements)
+        if track_count == 0 or detection_count == 0:
+            return [], list(range(track_count)), list(range(detection_count)), None
+
+        # 向量化計算所有 (軌跡, 檢測) 組合的馬氏距離平方
+        innovations = measurements[None, :, :] - self.states[:, None, :2]
+        S_inv = _inverse_2x2(self.covariances[:, :2, :2] + self.R)
+        cost = np.einsum('tdi,tij,tdj->td', innovations, S_inv, innovations)
+        cost[cost > self.gate_threshold] = _INVALID_COST
+
+        recent = np.array([track['misses'] == 0 for track in self.tracks])
+        groups = [np.arange(track_count)] if recent.all() or not recent.any() else \
+            [np.flatnonzero(recent), np.flatnonzero(~recent)]
+
+        matches = []
+        free = np.ones(detection_count, dtype=bool)
+        for group in groups:
+            free_detections = np.flatnonzero(free)
+            if len(free_detections) == 0:
+                break
+            sub_cost = cost[group][:, free_detections]
+            rows, cols = linear_sum_assignment(sub_cost)
+            valid = sub_cost[rows, cols] < _INVALID_COST
+            matches.extend(zip(group[rows[valid]].tolist(), free_detections[cols[valid]].tolist()))
+            free[free_detections[cols[valid]]] = False
+
+        matched_tracks = {track_index for track_index, _ in matches}
+        unmatched_tracks = [i for i in range(track_count) if i not in matched_tracks]
+        return matches, unmatched_tracks, np.flatnonzero(free).tolist(), S_inv
+
+    def _correct(self, matches, measurements, S_inv):
+        """以配對到的檢測同時更新多條軌跡的狀態"""
+        track_indices = np.array([track_index for track_index, _ in matches])
+        z = measurements[[detection_index for _, detection_index in matches]]
+
+        x = self.states[track_indices]
+        P = self.covariances[track_indices]
+        K = P[:, :, :2] @ S_inv[track_indices]
+        innovations = z - x[:, :2]
+
+        self.states[track_indices] = x + np.einsum('tij,tj->ti', K, innovations)
+        self.covariances[track_indices] = P - K @ P[:, :2, :]
+
+    def _start_track(self, frame_number, timestamp, center, confidence, interpolated):
+        """以未配對的檢測建立新軌跡"""
+        state = np.array([center[0], center[1], 0.0, 0.0, 0.0])
+        self.states = np.vstack([self.states, state])
+        self.covariances = np.concatenate([self.covariances, self.initial_covariance[None]])
+
+        track = {'id': self.next_track_id, 'points': [], 'hits': 0, 'misses': 0}
+        self.next_track_id += 1
+        self._append_observation(track, frame_number, timestamp, center, confidence, interpolated)
+        self.tracks.append(track)
+
+    def _append_observation(self, track, frame_number, timestamp, center, confidence, interpolated):
+        """加入觀測點；若軌跡剛經過漏檢，以線性插值補齊中間的幀"""
+        position = (float(center[0]), float(center[1]))
+        confidence = float(confidence)
+
+        if track['points'] and track['misses'] > 0:
+            last = track['points'][-1]
+            gap = frame_number - last['frame']
+            for step in range(1, gap):
+                alpha = step / gap
+                track['points'].append({
+                    'frame': last['frame'] + step,
+                    'timestamp': last['timestamp'] + (timestamp - last['timestamp']) * alpha,
+                    'position': (
+                        last['position'][0] + (position[0] - last['position'][0]) * alpha,
+                        last['position'][1] + (position[1] - last['position'][1]) * alpha
+                    ),
+                    'confidence': min(last['confidence'], confidence),
+                    'interpolated': True
+                })
+
+        point = {
+            'frame': frame_number,
+            'timestamp': timestamp,
+            'position': position,
+            'confidence': confidence
+        }
+        if interpolated:
+            point['interpolated'] = True
+        track['points'].append(point)
+        track['hits'] += 1
+        track['misses'] = 0
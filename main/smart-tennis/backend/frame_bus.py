@@ -0,0 +1,110 @@
+import cv2
+
+
+def read_video_info(cap):
+    """由已開啟的 VideoCapture 讀取影片資訊（只讀檔頭，不解碼）"""
+    return {
+        'fps': cap.get(cv2.CAP_PROP_FPS),
+        'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        'total_frames': int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    }
+
+
+def probe_video(video_path):
+    """讀取影片資訊後立即關閉"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"無法開啟影片: {video_path}")
+    try:
+        return read_video_info(cap)
+    finally:
+        cap.release()
+
+
+class FrameBus:
+    """
+    單次解碼的幀匯流排：每幀只解碼一次，再分派給所有已訂閱的 consumer
+
+    consumer 實作 on_frame(frame_number, timestamp, frame)，可選擇實作
+    start(video_info) 與 finish()。frame 為所有 consumer 共用的同一份影像，
+    需要修改的 consumer 應自行複製；on_frame 返回後驅動者可能直接在幀上繪製標註，
+    需要保留幀的 consumer 也應自行複製。
+    網球追蹤以 TennisTracker.track_ball(..., bus=bus) 驅動解碼，其他分析器只需訂閱，
+    新增分析器不會多一次完整解碼。
+
+    指定 start_frame / end_frame 時只解碼 [start_frame, end_frame) 的片段（由幀索引跳轉），
+    片段視為一部獨立的影片：幀號與時間從 0 開始，video_info 的 total_frames 為片段長度，
+    video_info['range'] 記錄片段在原影片中的位置。
+    """
+
+    def __init__(self, video_path, start_frame=0, end_frame=None, index=None):
+        self.video_path = video_path
+        if start_frame > 0:
+            from frame_index import open_at
+            self.cap = open_at(video_path, start_frame, index)
+        else:
+            self.cap = cv2.VideoCapture(video_path)
+        if not self.cap.isOpened():
+            raise ValueError(f"無法開啟影片: {video_path}")
+        self.video_info = read_video_info(self.cap)
+        self.limit = None
+        if start_frame > 0 or end_frame is not None:
+            total = self.video_info['total_frames']
+            end_frame = total if end_frame is None else min(end_frame, total)
+            self.limit = max(0, end_frame - start_frame)
+            fps = self.video_info['fps'] or 30.0
+
+            def frame_time(frame_number):
+                if index is not None and frame_number < index.total_frames:
+                    return float(index.times[frame_number])
+                return frame_number / fps
+
+            self.video_info['total_frames'] = self.limit
+            self.video_info['range'] = {
+                'start_frame': start_frame,
+                'end_frame': end_frame,
+                'start_time': frame_time(start_frame),
+                'end_time': frame_time(end_frame)
+            }
+        self.consumers = []
+        self.frames_decoded = 0
+
+    def subscribe(self, consumer):
+        """訂閱逐幀資料，回傳 consumer 本身方便串接"""
+        self.consumers.append(consumer)
+        return consumer
+
+    def frames(self):
+        """解碼並逐幀分派給 consumer，同時把幀交給呼叫端；解碼完畢後呼叫各 consumer 的 finish()"""
+        fps = self.video_info['fps'] or 30.0
+        for consumer in self.consumers:
+            if hasattr(consumer, 'start'):
+                consumer.start(dict(self.video_info))
+
+        try:
+            while self.limit is None or self.frames_decoded < self.limit:
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                frame_number = self.frames_decoded
+                for consumer in self.consumers:
+                    consumer.on_frame(frame_number, frame_number / fps, frame)
+                self.frames_decoded += 1
+                yield frame
+
+            for consumer in self.consumers:
+                if hasattr(consumer, 'finish'):
+                    consumer.finish()
+        finally:
+            self.release()
+
+    def run(self):
+        """沒有驅動者（例如不需要網球追蹤）時，直接解碼整段影片"""
+        for _ in self.frames():
+            pass
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
@@ -0,0 +1,182 @@
+"""
+影片的幀索引：每幀的顯示時間與關鍵幀位置
+
+上傳完成後建立一次並保存在影片旁（<file_id>.index.npz）。建立時以 ffmpeg 只解封裝、
+不解碼（-c copy -f framecrc），讀取每個封包的時間戳與關鍵幀旗標，因此比解碼整部影片快得多。
+索引提供兩件事：
+    時間 → 幀號的換算（可變幀率的影片不能只用 fps 換算）
+    跳轉到任意幀：先跳到該幀之前最近的關鍵幀（跳轉落點必定正確），再往後略過剩餘的幀
+沒有 ffmpeg 時退回以 fps 推算時間、不記錄關鍵幀，跳轉交由 OpenCV 處理。
+"""
+
+import os
+import subprocess
+import threading
+import cv2
+import numpy as np
+from frame_bus import probe_video
+from video_writer import find_ffmpeg
+
+_building = set()
+_building_lock = threading.Lock()
+
+
+def index_path(video_path):
+    return os.path.splitext(video_path)[0] + '.index.npz'
+
+
+class FrameIndex:
+    """
+    times: 每幀（顯示順序）相對第一幀的時間（秒）
+    keyframes: 關鍵幀的幀號（遞增）；空陣列表示不知道關鍵幀位置
+    """
+
+    def __init__(self, times, keyframes, fps):
+        self.times = np.asarray(times, dtype=np.float64)
+        self.keyframes = np.asarray(keyframes, dtype=np.int64)
+        self.fps = float(fps)
+
+    @property
+    def total_frames(self):
+        return len(self.times)
+
+    @property
+    def duration(self):
+        if not len(self.times):
+            return 0.0
+        return float(self.times[-1]) + (1.0 / self.fps if self.fps > 0 else 0.0)
+
+    def frame_at(self, timestamp):
+        """顯示時間不早於 timestamp 的第一幀幀號（超出影片長度時回傳總幀數）"""
+        return int(np.searchsorted(self.times, timestamp - 1e-6, side='left'))
+
+    def keyframe_before(self, frame_number):
+        """frame_number 之前（含）最近的關鍵幀，不知道關鍵幀位置時回傳 None"""
+        if not len(self.keyframes):
+            return None
+        position = int(np.searchsorted(self.keyframes, frame_number, side='right')) - 1
+        return int(self.keyframes[max(0, position)])
+
+    def save(self, path):
+        # 先寫暫存檔再替換，背景建立與即時建立同時進行時也不會讀到不完整的索引
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, times=self.times, keyframes=self.keyframes, fps=np.float64(self.fps))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, video_path):
+        """讀取影片旁的索引，不存在或已損毀時回傳 None"""
+        path = index_path(video_path)
+        try:
+            with np.load(path) as data:
+                return cls(data['times'], data['keyframes'], float(data['fps']))
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+def _read_packets(ffmpeg_exe, video_path):
+    """以 ffmpeg 解封裝（不解碼）視訊串流，回傳 (時間基準, pts 陣列, 關鍵幀旗標陣列)"""
+    cmd = [ffmpeg_exe, '-hide_banner', '-loglevel', 'error', '-i', video_path,
+           '-map', '0:v:0', '-c', 'copy', '-f', 'framecrc', '-']
+    result = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    time_base = None
+    pts = []
+    keys = []
+    for line in result.stdout.decode('utf-8', errors='ignore').splitlines():
+        if line.startswith('#tb 0:'):
+            num, den = line.split(':', 1)[1].strip().split('/')
+            time_base = int(num) / int(den)
+            continue
+        if not line or line.startswith('#'):
+            continue
+        # stream, dts, pts, duration, size, crc[, F=0x旗標]；沒有旗標欄位的封包為關鍵幀
+        fields = [field.strip() for field in line.split(',')]
+        if len(fields) < 6:
+            continue
+        pts.append(int(fields[2]))
+        keys.append(not (len(fields) > 6 and fields[6].startswith('F=') and int(fields[6][2:], 16) & 1 == 0))
+    if time_base is None or not pts:
+        raise ValueError('無法讀取影片封包資訊')
+    return time_base, np.array(pts, dtype=np.int64), np.array(keys, dtype=bool)
+
+
+def build_index(video_path, save=True):
+    """建立幀索引（可用 ffmpeg 時只解封裝，否則以 fps 推算），預設保存在影片旁"""
+    info = probe_video(video_path)
+    fps = info['fps'] or 30.0
+    index = None
+
+    ffmpeg_exe = find_ffmpeg()
+    if ffmpeg_exe:
+        try:
+            time_base, pts, keys = _read_packets(ffmpeg_exe, video_path)
+            # 封包為解碼順序，依顯示時間排序後即為幀號順序（有 B 幀時兩者不同）
+            order = np.argsort(pts, kind='stable')
+            times = (pts[order] - pts[order[0]]) * time_base
+            index = FrameIndex(times, np.flatnonzero(keys[order]), fps)
+        except Exception as e:
+            print(f"以 ffmpeg 建立幀索引失敗，改以 fps 推算: {e}")
+
+    if index is None:
+        index = FrameIndex(np.arange(info['total_frames']) / fps, [], fps)
+
+    if save:
+        index.save(index_path(video_path))
+    return index
+
+
+def load_or_build(video_path):
+    """讀取影片旁的索引，不存在時立即建立"""
+    index = FrameIndex.load(video_path)
+    if index is None:
+        index = build_index(video_path)
+    return index
+
+
+def build_index_async(video_path):
+    """上傳完成後在背景建立索引，不延遲上傳的回應"""
+    with _building_lock:
+        if video_path in _building:
+            return
+        _building.add(video_path)
+
+    def run():
+        try:
+            build_index(video_path)
+        except Exception as e:
+            print(f"建立幀索引失敗: {e}")
+        finally:
+            with _building_lock:
+                _building.discard(video_path)
+
+    threading.Thread(target=run, name='frame-index', daemon=True).start()
+
+
+def open_at(video_path, frame_number, index=None):
+    """
+    開啟影片並定位到 frame_number（下一次 read 取得該幀），回傳 VideoCapture
+    有索引時先跳到最近的關鍵幀再逐幀略過；跳轉結果不正確時退回從頭略過
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"無法開啟影片: {video_path}")
+    if frame_number <= 0:
+        return cap
+
+    keyframe = index.keyframe_before(frame_number) if index is not None else None
+    target = frame_number if keyframe is None else keyframe
+    position = 0
+    if target > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+        if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == target:
+            position = target
+        else:
+            # 部分編碼格式無法精確跳轉，改為從頭逐幀略過
+            cap.release()
+            cap = cv2.VideoCapture(video_path)
+
+    # grab 只解碼不轉換色彩空間，比 read 便宜
+    for _ in range(frame_number - position):
+        if not cap.grab():
+            break
+    return cap
@@ -0,0 +1,105 @@
+"""
+gunicorn 設定：預先 fork 的多 worker 正式環境伺服器（macOS/Linux）
+
+    cd backend
+    gunicorn -c gunicorn.conf.py app:app
+
+主行程先匯入 app 並同步載入所有模型，再 fork 出各 worker；模型權重在 fork 前已載入，
+各 worker 以寫入時複製（copy-on-write）共用同一份記憶體，不會每個 worker 各載入一份。
+    工作佇列與 Flask 請求在同一個 worker 內以執行緒執行（JOB_EXECUTOR=thread），直接使用共用的模型；
+    工作紀錄存於 SQLite，任何 worker 都能查詢其他 worker 執行中的工作進度
+    worker 處理 GUNICORN_MAX_REQUESTS 個請求後重新啟動（避免記憶體碎片累積），結束前先排空：
+    停止接受新的分析工作，等待已提交的工作完成（最多 GUNICORN_GRACEFUL_TIMEOUT 秒減去保留時間）；
+    逾時仍未完成的工作標記為失敗後才結束，不會被主行程強制結束而留下「執行中」的工作
+中斷工作的恢復：主行程匯入 app 時把上次未完成的工作標記為失敗（因此 preload_app 必須開啟）；
+之後 worker 結束（包含逾時被強制結束）或啟動時，只標記已不存在的 worker 提交的工作。
+"""
+
+import os
+import gc
+import time
+import threading
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
+# 執行緒 worker：SSE 進度推送與長時間的同步分析不會佔住整個 worker
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+preload_app = True
+
+# worker 回收；加上隨機偏移，避免所有 worker 同時重新啟動
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = max_requests // 10
+# 排空分析工作的時間上限；worker 排空期間不回報心跳，timeout 需大於此值
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '300'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', str(graceful_timeout + 30)))
+# 主行程在 graceful_timeout 到期時強制結束 worker；排空需提早結束，留時間把未完成的工作標記為失敗
+drain_timeout = max(1.0, graceful_timeout - min(10.0, graceful_timeout / 4))
+
+# 以下須在匯入 app 之前設定
+# 模型由 on_starting 在主行程同步載入，fork 時不留下背景預熱執行緒
+os.environ['MODEL_WARMUP'] = '0'
+# fork 前不執行推論：已啟動的 OpenMP 執行緒池在 fork 後的子行程中無法使用，改由各 worker 預熱
+_warmup_runs = os.getenv('MODEL_WARMUP_RUNS', '2')
+os.environ['MODEL_WARMUP_RUNS'] = '0'
+os.environ.setdefault('JOB_EXECUTOR', 'thread')
+os.environ['JOB_QUEUE_REPLICAS'] = str(workers)
+
+
+def on_starting(server):
+    """主行程：載入所有模型後凍結現有物件，避免垃圾回收寫入共用的記憶體分頁"""
+    import app as backend
+    if backend.pipeline.models.load_all():
+        print(f"模型已載入，fork {workers} 個 worker 共用")
+    else:
+        print(f"部分模型載入失敗，worker 將在第一次使用時重試: {backend.pipeline.models.status()}")
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """worker：依 worker 數分配推論執行緒並預熱模型"""
+    os.environ['MODEL_WARMUP_RUNS'] = _warmup_runs
+    import app as backend
+    from session_pool import limit_threads, thread_budget
+    # 先前被強制結束的 worker 留下的工作
+    backend.job_queue.store.fail_orphaned()
+    trackers = backend.pipeline.models.peek('trackers')
+    if trackers is None or not trackers.engines():
+        return
+    threads = int(os.getenv('INFERENCE_THREADS', '0')) or thread_budget(workers * len(trackers.engines()))
+    # 同時限制 onnx / openvino 引擎：主行程不推論，引擎的執行階段在之後的預熱時才建立
+    limit_threads(threads)
+    trackers.threads = threads
+    trackers.warmup(int(_warmup_runs))
+
+
+def post_worker_init(worker):
+    """
+    worker 停止接受請求（回收或收到 SIGTERM）時立即開始排空分析工作
+    gthread worker 會先等待進行中的連線（包含等待分析完成的 SSE 進度推送）結束才呼叫 worker_exit，
+    等到那時才排空可能已沒有時間
+    """
+    import app as backend
+
+    def drain_when_stopped():
+        while worker.alive:
+            time.sleep(0.5)
+        if not backend.job_queue.drain(timeout=drain_timeout):
+            print(f"worker {worker.pid} 排空逾時，未完成的分析工作已標記為失敗")
+
+    threading.Thread(target=drain_when_stopped, name='job-drain', daemon=True).start()
+
+
+def worker_exit(server, worker):
+    """worker 結束前：排空未完成（例如快速關閉）時，把剩下的工作標記為失敗並直接結束，不等待分析執行緒"""
+    import app as backend
+    if not backend.job_queue.drain(timeout=0):
+        print(f"worker {worker.pid} 結束時仍有未完成的分析工作，已標記為失敗")
+        os._exit(1)
+
+
+def child_exit(server, worker):
+    """主行程：worker 已結束（包含逾時被強制結束），把它留下的未完成工作標記為失敗"""
+    import app as backend
+    backend.job_queue.store.fail_interrupted(owner=worker.pid)
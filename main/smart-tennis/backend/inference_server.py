@@ -0,0 +1,381 @@
+"""
+跨請求的動態批次推論
+
+同時進行多個分析時，各分析原本各自呼叫模型，每次只送入自己的幾幀。推論伺服器持有一份模型，
+收集所有分析送來的幀，合併為一個批次推論後再把檢測結果分送回各呼叫端：
+    批次達到 max_batch 幀，或等待超過 max_wait 秒，即送出推論
+    近期只有一個呼叫端時不等待，單一分析的延遲與直接呼叫模型相同
+    只合併輸入尺寸與影像大小相同的請求，與逐一推論的前處理（letterbox）一致
+
+兩種使用方式：
+    同一行程：BatchingInferenceServer + InferenceClient
+    獨立行程：python inference_server.py --address /tmp/tennis-inference.sock（或 127.0.0.1:7070），
+              各工作行程以 SocketInferenceClient 連線，不必各自載入模型
+"""
+
+import os
+import json
+import time
+import queue
+import socket
+import struct
+import argparse
+import threading
+import socketserver
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+
+# 近期（秒）送過請求的呼叫端視為仍在分析中，批次會等待它們的下一個請求
+CALLER_TTL = 1.0
+
+_HEADER = struct.Struct('>I')
+_STOP = object()
+
+
+class _Request:
+    def __init__(self, caller, frames, imgsz):
+        self.caller = caller
+        self.frames = frames
+        self.imgsz = imgsz
+        # 只有輸入尺寸與影像大小都相同的請求才合併
+        self.key = (imgsz, frames[0].shape if frames else None)
+        self.future = Future()
+
+
+class BatchingInferenceServer:
+    """
+    以單一背景執行緒執行模型，engine 為已載入模型的 TennisTracker
+    呼叫端以 detect(caller, frames, imgsz) 送出請求並等待結果，caller 用來辨識不同的分析
+    背景執行緒在第一次送出請求時才啟動；fork 後的子行程各自啟動自己的執行緒（執行緒不會隨 fork 複製）
+    """
+
+    def __init__(self, engine, max_batch=16, max_wait=0.005):
+        self.engine = engine
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait)
+        self.thread = None
+        self.pid = None
+        self._reset()
+
+    def _reset(self):
+        self.requests = queue.Queue()
+        # 形狀不同或超過批次上限而延到下一輪的請求
+        self.deferred = deque()
+        self.callers = {}
+        self.callers_lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.batches = 0
+        self.frames = 0
+
+    def _ensure_running(self):
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        with self.start_lock:
+            if self.pid != os.getpid():
+                if self.pid is not None:
+                    self._reset()
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self._run, name='inference-server', daemon=True)
+                self.thread.start()
+
+    def describe(self):
+        """影響檢測結果的模型設定，呼叫端的追蹤器據此設定（結果快取鍵值也需要）"""
+        return {
+            'model_path': self.engine.model_path,
+            'backend': self.engine.inference_backend,
+            'precision': self.engine.inference_precision,
+            'imgsz': self.engine.inference_imgsz,
+            'classes': sorted(self.engine.accepted_class_ids),
+            'confidence_threshold': self.engine.confidence_threshold
+        }
+
+    def submit(self, caller, frames, imgsz=None):
+        """送出請求，回傳 Future（結果為與 frames 順序一致的檢測列表）"""
+        request = _Request(caller, list(frames), imgsz)
+        if not request.frames:
+            request.future.set_result([])
+            return request.future
+        self._ensure_running()
+        with self.callers_lock:
+            self.callers[caller] = time.monotonic()
+        self.requests.put(request)
+        return request.future
+
+    def detect(self, caller, frames, imgsz=None):
+        return self.submit(caller, frames, imgsz).result()
+
+    def _active_callers(self):
+        now = time.monotonic()
+        with self.callers_lock:
+            for caller, last_seen in list(self.callers.items()):
+                if now - last_seen > CALLER_TTL:
+                    del self.callers[caller]
+            return len(self.callers)
+
+    def _collect(self):
+        """取出下一個批次：先處理延後的請求，再等待其他呼叫端的請求直到批次已滿或逾時"""
+        first = self.deferred.popleft() if self.deferred else self.requests.get()
+        if first is _STOP:
+            return None
+        batch = [first]
+        size = len(first.frames)
+
+        for request in list(self.deferred):
+            if request is not _STOP and request.key == first.key and size + len(request.frames) <= self.max_batch:
+                self.deferred.remove(request)
+                batch.append(request)
+                size += len(request.frames)
+
+        # 等待時間從開始收集算起：排隊中的請求也要給其他呼叫端湊入同一批的機會
+        deadline = time.monotonic() + self.max_wait
+        expected = self._active_callers()
+        while size < self.max_batch and len({request.caller for request in batch}) < expected:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is _STOP or request.key != first.key or size + len(request.frames) > self.max_batch:
+                self.deferred.append(request)
+                if request is _STOP:
+                    break
+                continue
+            batch.append(request)
+            size += len(request.frames)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                break
+            frames = [frame for request in batch for frame in request.frames]
+            try:
+                detections = self.engine.detect_tennis_ball_batch(frames, imgsz=batch[0].imgsz)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            self.batches += 1
+            self.frames += len(frames)
+            offset = 0
+            for request in batch:
+                request.future.set_result(detections[offset:offset + len(request.frames)])
+                offset += len(request.frames)
+
+    def close(self):
+        if self.thread is not None and self.pid == os.getpid():
+            self.requests.put(_STOP)
+            self.thread.join()
+
+    def status(self):
+        return {
+            'max_batch': self.max_batch,
+            'max_wait_ms': round(self.max_wait * 1000, 3),
+            'active_callers': self._active_callers(),
+            'batches': self.batches,
+            'frames': self.frames,
+            'avg_batch_frames': round(self.frames / self.batches, 2) if self.batches else None
+        }
+
+
+class InferenceClient:
+    """同一行程內的呼叫端，每個追蹤器工作階段一個"""
+
+    def __init__(self, server):
+        self.server = server
+
+    def describe(self):
+        return self.server.describe()
+
+    def detect(self, frames, imgsz=None):
+        return self.server.detect(id(self), frames, imgsz)
+
+
+def _send_message(sock, header, payload=b''):
+    body = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    sock.sendall(_HEADER.pack(len(body)) + body)
+    if payload:
+        sock.sendall(payload)
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            raise ConnectionError("連線已關閉")
+        received += count
+    return buffer
+
+
+def _recv_message(sock):
+    """讀取一則訊息，回傳 (header, payload)；payload 長度由 header 的 size 指定"""
+    length = _HEADER.unpack(bytes(_recv_exact(sock, _HEADER.size)))[0]
+    header = json.loads(bytes(_recv_exact(sock, length)).decode('utf-8'))
+    size = header.get('size', 0)
+    payload = _recv_exact(sock, size) if size else bytearray()
+    return header, payload
+
+
+def _restore_detections(detections):
+    """JSON 傳輸後將座標恢復為 tuple，與本機推論的結果型別一致"""
+    return [
+        [dict(detection, center=tuple(detection['center']), bbox=tuple(detection['bbox']),
+              size=tuple(detection['size'])) for detection in frame_detections]
+        for frame_detections in detections
+    ]
+
+
+def parse_address(address):
+    """'/path/to.sock' 或 'unix:/path' 為 Unix socket，'host:port' 為 TCP"""
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    if address.startswith('/') or address.startswith('.'):
+        return socket.AF_UNIX, address
+    host, _, port = address.rpartition(':')
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+
+class SocketInferenceClient:
+    """
+    連線到獨立行程的推論伺服器；每個追蹤器工作階段一條連線（每條連線在伺服器端為一個呼叫端）
+    幀以原始位元組傳送，檢測結果以 JSON 回傳；連線中斷時重新連線一次
+    """
+
+    def __init__(self, address, timeout=120.0):
+        self.address = address
+        self.timeout = timeout
+        self.sock = None
+        self.info = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        family, target = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(target)
+        return sock
+
+    def _call(self, header, payload=b''):
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.sock is None:
+                        self.sock = self._connect()
+                    _send_message(self.sock, dict(header, size=len(payload)), payload)
+                    response, _ = _recv_message(self.sock)
+                    break
+                except (OSError, ConnectionError):
+                    self.close()
+                    if attempt:
+                        raise
+        if 'error' in response:
+            raise RuntimeError(f"推論伺服器錯誤: {response['error']}")
+        return response
+
+    def describe(self):
+        if self.info is None:
+            self.info = self._call({'op': 'describe'})['info']
+        return self.info
+
+    def detect(self, frames, imgsz=None):
+        frames = [np.ascontiguousarray(frame, dtype=np.uint8) for frame in frames]
+        if not frames:
+            return []
+        header = {'op': 'detect', 'imgsz': imgsz, 'shapes': [list(frame.shape) for frame in frames]}
+        payload = b''.join(frame.tobytes() for frame in frames)
+        return _restore_detections(self._call(header, payload)['detections'])
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+
+class _ConnectionHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server.inference_server
+        caller = id(self)
+        while True:
+            try:
+                header, payload = _recv_message(self.request)
+            except (OSError, ConnectionError, ValueError):
+                return
+            try:
+                if header.get('op') == 'describe':
+                    response = {'info': server.describe()}
+                elif header.get('op') == 'detect':
+                    frames = []
+                    offset = 0
+                    for shape in header['shapes']:
+                        size = int(np.prod(shape))
+                        frames.append(np.frombuffer(payload, dtype=np.uint8, count=size, offset=offset).reshape(shape))
+                        offset += size
+                    response = {'detections': server.detect(caller, frames, header.get('imgsz'))}
+                else:
+                    response = {'error': f"未知的操作: {header.get('op')}"}
+            except Exception as e:
+                response = {'error': str(e)}
+            try:
+                _send_message(self.request, response)
+            except OSError:
+                return
+
+
+class _UnixSocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPSocketServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve_socket(inference_server, address):
+    """在 address 上接受 SocketInferenceClient 連線（阻塞直到結束），每條連線一個執行緒"""
+    family, target = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(target):
+            os.remove(target)
+        socket_server = _UnixSocketServer(target, _ConnectionHandler)
+    else:
+        socket_server = _TCPSocketServer(target, _ConnectionHandler)
+    socket_server.inference_server = inference_server
+    print(f"推論伺服器已啟動: {address}（批次上限 {inference_server.max_batch} 幀，"
+          f"最長等待 {inference_server.max_wait * 1000:.1f}ms）")
+    try:
+        socket_server.serve_forever()
+    finally:
+        socket_server.server_close()
+        if family == socket.AF_UNIX and os.path.exists(target):
+            os.remove(target)
+
+
+def create_inference_server(engine):
+    """依環境變數建立批次推論伺服器（INFERENCE_MAX_BATCH 幀、INFERENCE_MAX_WAIT_MS 毫秒）"""
+    max_batch = int(os.getenv('INFERENCE_MAX_BATCH', '16'))
+    max_wait = float(os.getenv('INFERENCE_MAX_WAIT_MS', '5')) / 1000
+    return BatchingInferenceServer(engine, max_batch, max_wait)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='網球檢測批次推論伺服器')
+    parser.add_argument('--address', default=os.getenv('INFERENCE_SERVER_ADDRESS', '/tmp/tennis-inference.sock'),
+                        help='Unix socket 路徑或 host:port')
+    args = parser.parse_args()
+
+    from tennis_tracker import TennisTracker
+    serve_socket(create_inference_server(TennisTracker()), args.address)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,482 @@
+"""
+非同步分析工作佇列
+
+提交分析後立即回傳工作 ID，由有上限的工作池在背景執行，狀態與進度寫入工作儲存：
+    SQLiteJobStore  工作紀錄存於 SQLite，可跨行程共用（工作行程直接回寫進度）
+    MemoryJobStore  工作紀錄存於記憶體，只能搭配同行程的執行緒工作池（測試或單機開發用）
+進行中與排隊中的工作數達到 workers × replicas + max_pending 時，新的提交會被拒絕（QueueFullError）；
+replicas 為共用同一個 SQLite 工作儲存、各自執行工作的伺服器行程數（預先 fork 的多個 gunicorn worker）。
+工作進度（階段、已處理幀數、處理速度、預估剩餘時間）可由 JobQueue.watch 持續取得，供 SSE 推送。
+"""
+
+import os
+import time
+import uuid
+import sqlite3
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait as wait_futures
+
+ACTIVE_STATUSES = ('queued', 'running')
+FINAL_STATUSES = ('succeeded', 'failed')
+
+# 各階段在整體進度中的比例（網球追蹤佔大部分時間）
+STAGE_PROGRESS = {
+    'shots': 0.92,
+    'speed': 0.95,
+    'saving': 0.97
+}
+TRACKING_WEIGHT = 0.9
+
+JOB_FIELDS = ('id', 'file_id', 'status', 'stage', 'progress', 'frames_done', 'total_frames', 'fps', 'eta',
+              'error', 'created_at', 'started_at', 'finished_at', 'owner')
+
+# 推送給前端的進度欄位
+PROGRESS_FIELDS = ('status', 'stage', 'progress', 'frames_done', 'total_frames', 'fps', 'eta', 'error')
+
+# 舊版資料庫缺少的欄位（啟動時自動補上）
+ADDED_COLUMNS = {'fps': 'REAL', 'eta': 'REAL', 'owner': 'INTEGER'}
+
+# 工作行程內的分析器（每個行程建立一次，模型只載入一次）
+_worker_pipeline = None
+
+
+class QueueFullError(Exception):
+    """工作池與等待佇列皆已滿"""
+
+
+def new_job(file_id):
+    return {
+        'id': uuid.uuid4().hex,
+        'file_id': file_id,
+        'status': 'queued',
+        'stage': 'queued',
+        'progress': 0.0,
+        'frames_done': 0,
+        'total_frames': 0,
+        'fps': None,
+        'eta': None,
+        'error': None,
+        'created_at': time.time(),
+        'started_at': None,
+        'finished_at': None,
+        # 提交工作的伺服器行程，該行程結束時只把它的工作標記為中斷
+        'owner': os.getpid()
+    }
+
+
+def process_alive(pid):
+    """行程是否仍存在（僅限 POSIX：Windows 的 os.kill 會直接結束行程）"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MemoryJobStore:
+    """以記憶體保存工作紀錄（僅限同一行程內使用）"""
+
+    def __init__(self):
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def create(self, job):
+        with self.lock:
+            self.jobs[job['id']] = dict(job)
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(fields)
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def find_active(self, file_id):
+        with self.lock:
+            for job in self.jobs.values():
+                if job['file_id'] == file_id and job['status'] in ACTIVE_STATUSES:
+                    return dict(job)
+        return None
+
+    def count_active(self):
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if job['status'] in ACTIVE_STATUSES)
+
+    def admit(self, job, limit):
+        """
+        同一影片已有進行中的工作時回傳該工作；進行中與排隊中的工作數已達 limit 時回傳 None；
+        否則建立 job 並回傳。檢查與建立在同一個鎖內完成
+        """
+        with self.lock:
+            for existing in self.jobs.values():
+                if existing['file_id'] == job['file_id'] and existing['status'] in ACTIVE_STATUSES:
+                    return dict(existing)
+            if sum(1 for existing in self.jobs.values() if existing['status'] in ACTIVE_STATUSES) >= limit:
+                return None
+            self.jobs[job['id']] = dict(job)
+        return job
+
+    def fail_interrupted(self, owner=None):
+        pass
+
+    def fail_orphaned(self):
+        pass
+
+
+class SQLiteJobStore:
+    """
+    以 SQLite 保存工作紀錄，可被多個行程同時讀寫
+    每個執行緒各自持有連線；pickle 時只保留檔案路徑，傳到工作行程後重新連線
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connect().execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                progress REAL,
+                frames_done INTEGER,
+                total_frames INTEGER,
+                fps REAL,
+                eta REAL,
+                error TEXT,
+                created_at REAL,
+                started_at REAL,
+                finished_at REAL,
+                owner INTEGER
+            )
+            """
+        )
+        self._connect().execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, file_id)')
+        columns = {row['name'] for row in self._connect().execute('PRAGMA table_info(jobs)')}
+        for column, column_type in ADDED_COLUMNS.items():
+            if column not in columns:
+                self._connect().execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self._local = threading.local()
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        # fork 後的子行程不可沿用父行程開啟的連線，改為重新連線
+        if connection is None or self._local.pid != os.getpid():
+            # autocommit；WAL 讓讀取不會被工作行程的進度寫入阻塞
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def create(self, job):
+        placeholders = ', '.join('?' for _ in JOB_FIELDS)
+        self._connect().execute(
+            f"INSERT INTO jobs ({', '.join(JOB_FIELDS)}) VALUES ({placeholders})",
+            [job[field] for field in JOB_FIELDS]
+        )
+
+    def update(self, job_id, **fields):
+        assignments = ', '.join(f'{field} = ?' for field in fields)
+        self._connect().execute(f'UPDATE jobs SET {assignments} WHERE id = ?', [*fields.values(), job_id])
+
+    def get(self, job_id):
+        row = self._connect().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def find_active(self, file_id):
+        row = self._connect().execute(
+            "SELECT * FROM jobs WHERE file_id = ? AND status IN ('queued', 'running') ORDER BY created_at LIMIT 1",
+            (file_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def count_active(self):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+        ).fetchone()[0]
+
+    def admit(self, job, limit):
+        """
+        同 MemoryJobStore.admit；檢查與建立在同一個寫入交易（BEGIN IMMEDIATE）內完成，
+        多個行程同時提交時不會一起通過上限檢查
+        """
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            admitted = self.find_active(job['file_id'])
+            if admitted is None and self.count_active() < limit:
+                self.create(job)
+                admitted = job
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return admitted
+
+    def fail_interrupted(self, owner=None):
+        """
+        前一次執行時未完成的工作已隨行程結束而中斷，標記為失敗
+        owner：只標記該伺服器行程提交的工作（多個行程共用工作儲存時，單一行程結束不影響其他行程）
+        """
+        if owner is None:
+            self._connect().execute(
+                "UPDATE jobs SET status = 'failed', stage = 'failed', error = ?, finished_at = ? "
+                "WHERE status IN ('queued', 'running')",
+                ('伺服器重新啟動，工作已中斷', time.time())
+            )
+        else:
+            self._connect().execute(
+                "UPDATE jobs SET status = 'failed', stage = 'failed', error = ?, finished_at = ? "
+                "WHERE status IN ('queued', 'running') AND owner = ?",
+                ('伺服器行程重新啟動，工作已中斷', time.time(), owner)
+            )
+
+    def fail_orphaned(self):
+        """提交工作的行程已不存在（例如被強制結束）時，把它未完成的工作標記為失敗（僅限 POSIX）"""
+        rows = self._connect().execute(
+            "SELECT DISTINCT owner FROM jobs WHERE status IN ('queued', 'running') AND owner IS NOT NULL"
+        ).fetchall()
+        for row in rows:
+            if not process_alive(row['owner']):
+                self.fail_interrupted(owner=row['owner'])
+
+
+def _init_worker(upload_folder, output_folder, cores=None):
+    """工作行程初始化：建立分析器並載入模型，推論執行緒數以分配到的核心數為上限"""
+    global _worker_pipeline
+    from analysis_pipeline import create_pipeline
+    _worker_pipeline = create_pipeline(upload_folder, output_folder, cores=cores)
+
+
+def _run_job(store, job_id, file_id, pipeline=None, min_interval=0.5):
+    """
+    執行一個分析工作，狀態與進度直接寫入工作儲存
+    進度回寫以 min_interval 秒節流，避免每幀寫入資料庫
+    """
+    pipeline = pipeline or _worker_pipeline
+    store.update(job_id, status='running', stage='tracking', started_at=time.time())
+    last_update = [0.0]
+
+    def progress(stage, done, total, fps=None, eta=None):
+        now = time.time()
+        if stage == 'tracking':
+            if now - last_update[0] < min_interval and done < total:
+                return
+            fraction = TRACKING_WEIGHT * done / total if total else 0.0
+            last_update[0] = now
+            store.update(job_id, stage=stage, progress=fraction, frames_done=done, total_frames=total,
+                         fps=round(fps, 1) if fps else None, eta=round(eta, 1) if eta is not None else None)
+        else:
+            # 追蹤後的階段很短，不估計剩餘時間；保留追蹤階段最後的處理速度
+            store.update(job_id, stage=stage, progress=STAGE_PROGRESS.get(stage, 0.0), eta=None)
+
+    try:
+        pipeline.analyze(file_id, progress=progress)
+    except Exception as e:
+        print(f"分析工作失敗 ({job_id}): {e}")
+        store.update(job_id, status='failed', stage='failed', error=str(e), finished_at=time.time())
+        return False
+
+    store.update(job_id, status='succeeded', stage='done', progress=1.0, eta=0.0, finished_at=time.time())
+    return True
+
+
+class JobQueue:
+    """
+    有上限的分析工作池
+    mode='process'：每個工作行程各自載入模型，CPU 核心平均分配給各行程，需搭配 SQLiteJobStore
+    mode='thread'：在本行程以執行緒執行，共用傳入的 pipeline；每個工作向 pipeline 的工作階段池借用追蹤器，
+                  workers 超過工作階段數（INFERENCE_SESSIONS）時多出的工作等待歸還
+    兩種模式下傳入的 pipeline 都會在提交時先查詢結果快取（模型就緒後），命中時直接完成工作，不佔用工作池
+    工作池在第一次提交時才建立：在 fork 前建立的 JobQueue，每個子行程各自擁有自己的工作池
+    """
+
+    def __init__(self, store, workers=1, max_pending=4, mode='process', pipeline=None,
+                 upload_folder='../uploads', output_folder='../output', replicas=1):
+        self.store = store
+        self.workers = max(1, workers)
+        self.max_pending = max(0, max_pending)
+        self.replicas = max(1, replicas)
+        self.mode = mode
+        self.pipeline = pipeline
+        self.upload_folder = upload_folder
+        self.output_folder = output_folder
+        self.admission_lock = threading.Lock()
+        self.executor = None
+        self.executor_pid = None
+        # 本行程提交、尚未結束的工作 {job_id: future}（排空時等待）
+        self.futures = {}
+        self.draining = False
+
+        if mode == 'process':
+            if isinstance(store, MemoryJobStore):
+                raise ValueError("行程工作池需要 SQLiteJobStore 才能回寫進度")
+        elif mode == 'thread':
+            if pipeline is None:
+                raise ValueError("執行緒工作池需要提供 pipeline")
+        else:
+            raise ValueError(f"未知的工作池模式: {mode}")
+        if self.replicas > 1 and isinstance(store, MemoryJobStore):
+            raise ValueError("多個伺服器行程需要共用 SQLiteJobStore")
+
+        # 多個伺服器行程共用工作儲存時，只能由 fork 前的主行程建立一次（否則會把其他行程的工作標記為中斷）
+        store.fail_interrupted()
+
+    def _executor(self):
+        """取得本行程的工作池，尚未建立（或在 fork 後的子行程）時建立"""
+        if self.executor is None or self.executor_pid != os.getpid():
+            if self.mode == 'process':
+                # spawn 行程不繼承 Flask 行程的執行緒與模型狀態；多個工作行程時平均分配 CPU 核心，避免執行緒超額配置
+                cores = max(1, (os.cpu_count() or 1) // self.workers) if self.workers > 1 else None
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.upload_folder, self.output_folder, cores)
+                )
+            else:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='analysis-job')
+            self.executor_pid = os.getpid()
+            self.futures = {}
+        return self.executor
+
+    def submit(self, file_id):
+        """
+        提交分析工作並立即回傳工作紀錄
+        同一影片已有進行中的工作時直接回傳該工作；結果快取命中時直接回傳已完成的工作；
+        工作池與佇列皆滿時拋出 QueueFullError
+        """
+        existing = self.store.find_active(file_id)
+        if existing:
+            return existing
+
+        # 快取命中不佔用工作池，佇列已滿時也能立即取得結果
+        # 快取鍵值需要模型資訊，模型尚在預熱時不在此等待，交由工作執行時再查詢快取
+        cached_results = None
+        if self.pipeline is not None and self.pipeline.models.ready():
+            cached_results = self.pipeline.restore_cached(file_id)
+        if cached_results is not None:
+            job = new_job(file_id)
+            total_frames = cached_results['tracking']['video_info'].get('total_frames', 0)
+            now = time.time()
+            job.update(status='succeeded', stage='done', progress=1.0, frames_done=total_frames,
+                       total_frames=total_frames, eta=0.0, started_at=now, finished_at=now)
+            self.store.create(job)
+            return job
+
+        with self.admission_lock:
+            # 排空中（行程即將結束）不再接受新工作，用戶端重試時由其他行程接手
+            if self.draining:
+                raise QueueFullError("伺服器行程即將重新啟動，請稍後再試")
+            job = new_job(file_id)
+            admitted = self.store.admit(job, self.workers * self.replicas + self.max_pending)
+            if admitted is None:
+                raise QueueFullError("分析佇列已滿，請稍後再試")
+            if admitted['id'] != job['id']:
+                return admitted
+
+            if self.mode == 'process':
+                future = self._executor().submit(_run_job, self.store, job['id'], file_id)
+            else:
+                future = self._executor().submit(_run_job, self.store, job['id'], file_id, self.pipeline)
+            self.futures[job['id']] = future
+        future.add_done_callback(lambda f: self._on_done(job['id'], f))
+        return job
+
+    def _on_done(self, job_id, future):
+        with self.admission_lock:
+            self.futures.pop(job_id, None)
+        # 工作行程異常終止（例如記憶體不足被砍）時，工作函式來不及回寫狀態
+        error = future.exception() if not future.cancelled() else None
+        if error is not None:
+            self.store.update(job_id, status='failed', stage='failed', error=str(error), finished_at=time.time())
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def watch(self, job_id, interval=0.5, heartbeat=15.0):
+        """
+        持續產生工作進度，直到工作結束
+        進度有變化時產生進度 dict；超過 heartbeat 秒沒有變化時產生 None（供呼叫端送出保持連線訊息）
+        工作行程只以節流的頻率寫入進度，這裡每 interval 秒讀一次儲存，讀取量與追蹤速度無關
+        """
+        last = None
+        last_sent = time.monotonic()
+        while True:
+            job = self.store.get(job_id)
+            if job is None:
+                return
+            snapshot = {key: job[key] for key in PROGRESS_FIELDS}
+            if snapshot != last:
+                last = snapshot
+                last_sent = time.monotonic()
+                yield snapshot
+            elif time.monotonic() - last_sent >= heartbeat:
+                last_sent = time.monotonic()
+                yield None
+            if snapshot['status'] in FINAL_STATUSES:
+                return
+            time.sleep(interval)
+
+    def drain(self, timeout=None, interval=1.0):
+        """
+        排空：停止接受新工作，等待本行程已提交的工作（執行中與排隊中）完成
+        超過 timeout 秒仍未完成的工作標記為失敗並回傳 False；全部完成時回傳 True
+        """
+        with self.admission_lock:
+            self.draining = True
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self.admission_lock:
+                pending = {job_id: future for job_id, future in self.futures.items() if not future.done()}
+            if not pending:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                for job_id in pending:
+                    self.store.update(job_id, status='failed', stage='failed', error='伺服器行程重新啟動，工作已中斷',
+                                      finished_at=time.time())
+                self.shutdown(wait=False)
+                return False
+            remaining = interval if deadline is None else max(0.0, min(interval, deadline - time.monotonic()))
+            wait_futures(list(pending.values()), timeout=remaining)
+        self.shutdown(wait=True)
+        return True
+
+    def shutdown(self, wait=True):
+        if self.executor is not None and self.executor_pid == os.getpid():
+            self.executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def create_job_queue(output_folder='../output', upload_folder='../uploads', pipeline=None):
+    """
+    依環境變數建立工作佇列（JOB_QUEUE=sqlite 以行程執行、memory 以本行程執行緒執行）
+    JOB_EXECUTOR=thread 時 sqlite 工作儲存改以本行程執行緒執行（預先 fork 的伺服器行程共用已載入的模型）
+    JOB_QUEUE_REPLICAS 為共用工作儲存的伺服器行程數（由 gunicorn.conf.py 設定）
+    """
+    workers = int(os.getenv('JOB_WORKERS', '1'))
+    max_pending = int(os.getenv('JOB_MAX_PENDING', '4'))
+    replicas = int(os.getenv('JOB_QUEUE_REPLICAS', '1'))
+    if os.getenv('JOB_QUEUE', 'sqlite') == 'memory':
+        return JobQueue(MemoryJobStore(), workers, max_pending, mode='thread', pipeline=pipeline, replicas=replicas)
+
+    db_path = os.getenv('JOB_DB_PATH', os.path.join(output_folder, 'jobs.sqlite3'))
+    mode = 'thread' if os.getenv('JOB_EXECUTOR', 'process') == 'thread' else 'process'
+    return JobQueue(SQLiteJobStore(db_path), workers, max_pending, mode=mode, pipeline=pipeline,
+                    upload_folder=upload_folder, output_folder=output_folder, replicas=replicas)
@@ -0,0 +1,129 @@
+"""
+推論後端：將 YOLO 權重匯出為固定輸入形狀的 CPU 推論引擎
+
+支援的後端：
+    torch     Ultralytics PyTorch 模型（預設，可接受任意輸入尺寸與批次）
+    onnx      ONNX Runtime，需安裝 onnxruntime
+    openvino  OpenVINO，需安裝 openvino
+匯出後的模型檔名包含輸入尺寸與批次大小，不同設定可並存。
+"""
+
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+BACKENDS = ('torch', 'onnx', 'openvino')
+
+# 本行程匯出引擎的運算執行緒上限（None 表示執行階段的預設：每個核心一個執行緒）
+_engine_threads = None
+_engine_threads_lock = threading.Lock()
+
+
+def normalize_backend(backend):
+    """檢查後端名稱，未知的名稱退回 torch"""
+    backend = (backend or 'torch').strip().lower()
+    if backend not in BACKENDS:
+        print(f"未知的推論後端 {backend}，改用 torch")
+        return 'torch'
+    return backend
+
+
+def exported_model_path(model_path, backend, imgsz, batch):
+    """匯出模型的存放路徑（與原始權重放在同一目錄）"""
+    if backend == 'torch':
+        return model_path
+    base = f"{os.path.splitext(model_path)[0]}_{imgsz}_b{batch}"
+    if backend == 'onnx':
+        return base + '.onnx'
+    # Ultralytics 以 _openvino_model 目錄名稱辨識 OpenVINO 模型
+    return base + '_openvino_model'
+
+
+def export_model(model_path, backend, imgsz=640, batch=1):
+    """
+    以 Ultralytics 匯出固定輸入形狀（imgsz x imgsz、固定批次）的 CPU 推論模型
+    回傳匯出後的路徑
+    """
+    from ultralytics import YOLO
+
+    target = exported_model_path(model_path, backend, imgsz, batch)
+    if backend == 'torch':
+        return target
+
+    print(f"匯出 {backend} 模型 (imgsz={imgsz}, batch={batch})...")
+    model = YOLO(model_path)
+    kwargs = {'format': backend, 'imgsz': imgsz, 'batch': batch, 'dynamic': False, 'device': 'cpu'}
+    if backend == 'onnx':
+        kwargs['simplify'] = True
+    exported = model.export(**kwargs)
+
+    # Ultralytics 固定輸出為 <權重名稱>.onnx / <權重名稱>_openvino_model，改名以保留形狀資訊
+    if os.path.abspath(exported) != os.path.abspath(target):
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        elif os.path.exists(target):
+            os.remove(target)
+        shutil.move(exported, target)
+
+    print(f"✅ 已匯出 {backend} 模型: {target}")
+    return target
+
+
+def set_engine_threads(threads):
+    """設定之後建立的 onnxruntime / OpenVINO 執行階段使用的運算執行緒數（行程層級）"""
+    global _engine_threads
+    _engine_threads = threads or None
+
+
+@contextmanager
+def engine_threads(backend):
+    """
+    在此區塊內建立的 onnxruntime / OpenVINO 執行階段套用 set_engine_threads 的執行緒數
+    Ultralytics 在第一次推論時才建立執行階段，且不接受執行緒設定：暫時替換建構函式，在建立時帶入設定
+    """
+    threads = _engine_threads
+    if not threads or backend not in ('onnx', 'openvino'):
+        yield
+        return
+    with _engine_threads_lock:
+        if backend == 'onnx':
+            try:
+                import onnxruntime
+            except ImportError:
+                yield
+                return
+            original = onnxruntime.InferenceSession
+
+            class LimitedSession(original):
+                def __init__(self, path, sess_options=None, *args, **kwargs):
+                    if sess_options is None:
+                        sess_options = onnxruntime.SessionOptions()
+                        sess_options.intra_op_num_threads = threads
+                        sess_options.inter_op_num_threads = 1
+                    super().__init__(path, sess_options, *args, **kwargs)
+
+            onnxruntime.InferenceSession = LimitedSession
+            try:
+                yield
+            finally:
+                onnxruntime.InferenceSession = original
+        else:
+            try:
+                import openvino
+            except ImportError:
+                yield
+                return
+            original = openvino.Core.compile_model
+
+            def compile_model(core, model, device_name=None, config=None):
+                # 只在 CPU 上執行，指定 CPU 裝置才能設定執行緒數
+                config = dict(config or {})
+                config.setdefault('INFERENCE_NUM_THREADS', threads)
+                return original(core, model, 'CPU', config)
+
+            openvino.Core.compile_model = compile_model
+            try:
+                yield
+            finally:
+                openvino.Core.compile_model = original
@@ -0,0 +1,125 @@
+"""
+模型註冊表：延遲載入與背景預熱
+
+啟動時只登記各模型的建構函式（factory），不匯入 ultralytics / torch / scipy 等大型套件，
+服務因此能立即回應健康檢查。預熱執行緒在背景依序載入並預熱各模型；
+請求在模型就緒前取用時會等待載入完成（尚未開始載入時由該請求直接載入）。
+"""
+
+import time
+import threading
+
+PENDING = 'pending'
+LOADING = 'loading'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class _Entry:
+    def __init__(self, factory):
+        self.factory = factory
+        self.instance = None
+        self.state = PENDING
+        self.error = None
+        self.load_seconds = None
+        # 同一模型同時只由一個執行緒載入，其他取用者等待
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    """依名稱管理模型；factory 為無參數函式，回傳模型物件（可為 None，表示該功能不啟用）"""
+
+    def __init__(self):
+        self.entries = {}
+        self.created_at = time.monotonic()
+        self.ready_at = None
+        self.warmup_thread = None
+
+    def register(self, name, factory):
+        self.entries[name] = _Entry(factory)
+
+    def provide(self, name, instance):
+        """登記已建立好的模型（測試或外部傳入的分析器）"""
+        entry = _Entry(None)
+        entry.instance = instance
+        entry.state = READY
+        entry.load_seconds = 0.0
+        self.entries[name] = entry
+        self._check_ready()
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def get(self, name):
+        """取得模型，尚未載入時載入（或等待背景預熱載入完成）；載入失敗時拋出例外，下次取用再重試"""
+        entry = self.entries[name]
+        if entry.state == READY:
+            return entry.instance
+        with entry.lock:
+            if entry.state != READY:
+                self._load(name, entry)
+        return entry.instance
+
+    def peek(self, name):
+        """模型已載入時回傳，否則回傳 None（不觸發載入，也不等待）"""
+        entry = self.entries.get(name)
+        return entry.instance if entry is not None and entry.state == READY else None
+
+    def _load(self, name, entry):
+        entry.state = LOADING
+        entry.error = None
+        start = time.perf_counter()
+        try:
+            entry.instance = entry.factory()
+        except Exception as e:
+            entry.state = FAILED
+            entry.error = str(e)
+            print(f"模型載入失敗 ({name}): {e}")
+            raise
+        entry.load_seconds = round(time.perf_counter() - start, 3)
+        entry.state = READY
+        print(f"模型已就緒 ({name}, {entry.load_seconds:.2f}s)")
+        self._check_ready()
+
+    def _check_ready(self):
+        if self.ready_at is None and self.ready():
+            self.ready_at = time.monotonic()
+
+    def ready(self):
+        """所有模型皆已載入"""
+        return all(entry.state == READY for entry in self.entries.values())
+
+    def load_all(self):
+        """依登記順序載入所有模型，回傳是否全部就緒"""
+        for name in list(self.entries):
+            try:
+                self.get(name)
+            except Exception:
+                # 錯誤已記錄在狀態中，繼續載入其他模型
+                continue
+        return self.ready()
+
+    def start_warmup(self):
+        """在背景執行緒依登記順序載入所有模型，不阻塞呼叫端"""
+        if self.warmup_thread is not None:
+            return self.warmup_thread
+        self.warmup_thread = threading.Thread(target=self.load_all, name='model-warmup', daemon=True)
+        self.warmup_thread.start()
+        return self.warmup_thread
+
+    def wait_ready(self, timeout=None):
+        """等待背景預熱結束，回傳是否所有模型皆已就緒"""
+        if self.warmup_thread is not None:
+            self.warmup_thread.join(timeout)
+        return self.ready()
+
+    def status(self):
+        """各模型的載入狀態（健康檢查使用）"""
+        return {
+            name: {
+                'state': entry.state,
+                'load_seconds': entry.load_seconds,
+                'error': entry.error
+            }
+            for name, entry in self.entries.items()
+        }
@@ -0,0 +1,72 @@
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """
+    以縮小後的幀差判斷是否需要執行網球檢測
+
+    畫面中沒有「像球一樣」的小面積移動時（死球時間、球員走動、固定鏡頭），
+    可跳過推論並沿用上一幀的結果。球仍在畫面中時只有畫面完全靜止才跳過，
+    避免球與球員、球拍重疊的擊球瞬間被略過。
+    """
+
+    def __init__(self, width=160, diff_threshold=25, min_blob_area=1,
+                 max_blob_fraction=0.005, max_skip=15):
+        """
+        width: 幀差計算用的縮圖寬度（像素）
+        diff_threshold: 灰階差異超過此值的像素視為移動
+        min_blob_area: 視為球的移動區塊最小面積（縮圖像素）
+        max_blob_fraction: 視為球的移動區塊最大面積（佔縮圖的比例），更大的區塊視為人物移動
+        max_skip: 連續跳過的最大幀數，超過即強制推論一次以修正誤判
+        """
+        self.width = width
+        self.diff_threshold = diff_threshold
+        self.min_blob_area = min_blob_area
+        self.max_blob_fraction = max_blob_fraction
+        self.max_skip = max_skip
+
+        self.previous_gray = None
+        self.skipped_streak = 0
+
+    def should_infer(self, frame, ball_visible):
+        """
+        判斷此幀是否需要推論
+        ball_visible: 上一個已知結果中是否有球
+        """
+        height, width = frame.shape[:2]
+        small_height = max(1, int(round(height * self.width / width)))
+        small = cv2.resize(frame, (self.width, small_height), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        previous = self.previous_gray
+        self.previous_gray = gray
+        if previous is None or self.skipped_streak >= self.max_skip:
+            self.skipped_streak = 0
+            return True
+
+        diff = cv2.absdiff(gray, previous)
+        _, mask = cv2.threshold(diff, self.diff_threshold, 255, cv2.THRESH_BINARY)
+
+        if ball_visible:
+            # 球在畫面中：只要有任何移動就推論
+            moving = cv2.countNonZero(mask) > 0
+        else:
+            moving = self._has_ball_like_motion(mask)
+
+        if moving:
+            self.skipped_streak = 0
+            return True
+
+        self.skipped_streak += 1
+        return False
+
+    def _has_ball_like_motion(self, mask):
+        """移動區塊中是否有面積接近網球的小區塊"""
+        if cv2.countNonZero(mask) == 0:
+            return False
+
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        areas = stats[1:count, cv2.CC_STAT_AREA]
+        max_area = max(self.min_blob_area, self.max_blob_fraction * mask.size)
+        return bool(np.any((areas >= self.min_blob_area) & (areas <= max_area)))
@@ -0,0 +1,298 @@
+"""
+INT8 訓練後量化：以上傳影片抽樣的幀校正 ONNX 模型，並與 FP32 模型比較召回率與速度
+
+用法：
+    python quantization.py                 # 匯出 FP32 ONNX、校正並產生 INT8 模型
+    python quantization.py --compare       # 另外輸出與 FP32 的召回率差異與加速比
+需安裝 onnx 與 onnxruntime。
+"""
+
+import os
+import re
+import glob
+import math
+import time
+import argparse
+import cv2
+import numpy as np
+from model_backends import exported_model_path, export_model
+
+VIDEO_EXTENSIONS = ('mp4', 'avi', 'mov', 'mkv')
+
+
+def quantized_model_path(model_path, imgsz, batch):
+    """INT8 模型的存放路徑（與 FP32 ONNX 模型並列）"""
+    base = os.path.splitext(exported_model_path(model_path, 'onnx', imgsz, batch))[0]
+    return base + '_int8.onnx'
+
+
+def list_videos(video_dir):
+    """列出目錄中的影片檔"""
+    paths = []
+    for ext in VIDEO_EXTENSIONS:
+        paths.extend(glob.glob(os.path.join(video_dir, f'*.{ext}')))
+    return sorted(paths)
+
+
+def frame_positions(video_paths, max_frames=200, exclude=None):
+    """
+    每部影片平均間隔抽樣的幀號 {影片路徑: [幀號]}，每部影片最多 ceil(max_frames / 影片數) 幀
+    exclude：不可選取的幀號 {影片路徑: [幀號]}，例如比較用幀需避開校正用幀
+    """
+    if not video_paths:
+        return {}
+
+    per_video = max(1, math.ceil(max_frames / len(video_paths)))
+    positions = {}
+    for path in video_paths:
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            print(f"無法開啟影片，略過: {path}")
+            continue
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        candidates = np.arange(max(total, 1))
+        if exclude and exclude.get(path):
+            candidates = candidates[~np.isin(candidates, exclude[path])]
+        if len(candidates) == 0:
+            continue
+        picks = np.linspace(0, len(candidates) - 1, per_video).astype(int)
+        positions[path] = np.unique(candidates[picks]).tolist()
+    return positions
+
+
+def sample_frames(video_paths, max_frames=200, exclude=None):
+    """依 frame_positions 讀取抽樣的幀（BGR），總數不超過 max_frames"""
+    frames = []
+    for path, indices in frame_positions(video_paths, max_frames, exclude).items():
+        cap = cv2.VideoCapture(path)
+        for index in indices:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            ret, frame = cap.read()
+            if ret:
+                frames.append(frame)
+        cap.release()
+    return frames[:max_frames]
+
+
+def letterbox(frame, imgsz):
+    """與 Ultralytics 推論前處理相同的等比例縮放與灰邊填充"""
+    height, width = frame.shape[:2]
+    ratio = min(imgsz / height, imgsz / width)
+    new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+    pad_x, pad_y = (imgsz - new_width) / 2, (imgsz - new_height) / 2
+
+    if (new_width, new_height) != (width, height):
+        frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    return cv2.copyMakeBorder(frame, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+
+
+def preprocess(frames, imgsz):
+    """BGR 幀 -> 模型輸入張量 (N, 3, imgsz, imgsz)，RGB、0~1"""
+    batch = np.stack([letterbox(frame, imgsz) for frame in frames])
+    batch = batch[..., ::-1].transpose(0, 3, 1, 2)
+    return np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+
+
+def _calibration_reader(input_name, frames, imgsz, batch):
+    """建立 onnxruntime 的校正資料讀取器，依模型的固定批次逐批提供前處理後的幀"""
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class FrameCalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            # 不足一批的尾端以最後一幀補齊，符合固定輸入形狀
+            padded = list(frames) + [frames[-1]] * (-len(frames) % batch)
+            self.batches = [padded[i:i + batch] for i in range(0, len(padded), batch)]
+            self.index = 0
+
+        def get_next(self):
+            if self.index >= len(self.batches):
+                return None
+            chunk = self.batches[self.index]
+            self.index += 1
+            return {input_name: preprocess(chunk, imgsz)}
+
+        def rewind(self):
+            self.index = 0
+
+    return FrameCalibrationReader()
+
+
+def _head_nodes_to_exclude(onnx_model):
+    """
+    偵測頭（最後一個 /model.N/ 模組）中卷積以外的節點維持浮點運算
+    框座標解碼（0~imgsz）與類別機率（0~1）在同一張量中串接，量化後誤差最大
+    """
+    indices = {}
+    for node in onnx_model.graph.node:
+        match = re.match(r'/model\.(\d+)/', node.name)
+        if match:
+            indices.setdefault(int(match.group(1)), []).append(node)
+    if not indices:
+        return []
+    return [node.name for node in indices[max(indices)] if node.op_type != 'Conv']
+
+
+def quantize_model(model_path, imgsz=640, batch=1, video_dir=None, max_frames=200):
+    """
+    以上傳影片抽樣的幀校正並產生 INT8 ONNX 模型（QDQ 格式、權重逐通道量化）
+    回傳 INT8 模型路徑
+    """
+    import onnx
+    import onnxruntime
+    from onnxruntime.quantization import quantize_static, QuantFormat, QuantType
+
+    video_dir = video_dir or os.getenv('UPLOAD_FOLDER', '../uploads')
+    frames = sample_frames(list_videos(video_dir), max_frames)
+    if not frames:
+        raise ValueError(f"找不到可用於校正的影片: {video_dir}")
+
+    fp32_path = exported_model_path(model_path, 'onnx', imgsz, batch)
+    if not os.path.exists(fp32_path):
+        fp32_path = export_model(model_path, 'onnx', imgsz, batch)
+    target = quantized_model_path(model_path, imgsz, batch)
+
+    print(f"INT8 量化校正中（{len(frames)} 幀，來源 {video_dir}）...")
+    source_path = fp32_path
+    try:
+        # 先做形狀推論與圖最佳化，量化結果較穩定
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+        source_path = os.path.splitext(target)[0] + '_prep.onnx'
+        quant_pre_process(fp32_path, source_path)
+    except Exception as e:
+        print(f"量化前處理失敗，直接量化原始模型: {e}")
+        source_path = fp32_path
+
+    fp32_model = onnx.load(fp32_path)
+    session = onnxruntime.InferenceSession(fp32_path, providers=['CPUExecutionProvider'])
+    input_name = session.get_inputs()[0].name
+    # 前處理的圖最佳化可能改名或合併節點，排除的節點名稱需取自實際量化的模型
+    nodes_to_exclude = _head_nodes_to_exclude(onnx.load(source_path))
+
+    try:
+        quantize_static(
+            source_path,
+            target,
+            _calibration_reader(input_name, frames, imgsz, batch),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            weight_type=QuantType.QInt8,
+            activation_type=QuantType.QUInt8,
+            nodes_to_exclude=nodes_to_exclude
+        )
+    finally:
+        if source_path != fp32_path and os.path.exists(source_path):
+            os.remove(source_path)
+
+    # Ultralytics 由模型 metadata 讀取類別名稱、stride 與輸入尺寸，複製到 INT8 模型
+    int8_model = onnx.load(target)
+    del int8_model.metadata_props[:]
+    int8_model.metadata_props.extend(fp32_model.metadata_props)
+    onnx.save(int8_model, target)
+
+    print(f"✅ 已產生 INT8 模型: {target}")
+    return target
+
+
+def _box_iou(box, boxes):
+    """單一框與多個框的 IoU"""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return intersection / np.maximum(area + areas - intersection, 1e-9)
+
+
+def _timed_detections(tracker, model, frames, imgsz, runs):
+    """執行檢測並回傳 (逐幀檢測, 每幀平均毫秒數)；先執行一批預熱"""
+    tracker.run_fixed_batch(model, frames[:tracker.batch_size], imgsz)
+    start = time.perf_counter()
+    for _ in range(runs):
+        results = tracker.run_fixed_batch(model, frames, imgsz)
+    elapsed = (time.perf_counter() - start) / runs
+    return [tracker.parse_detections(result) for result in results], elapsed * 1000 / len(frames)
+
+
+def compare_models(tracker, fp32_path, int8_path, frames, imgsz, iou_threshold=0.5, runs=1):
+    """
+    以 FP32 模型的檢測為基準比較 INT8 模型
+    recall: FP32 檢測中被 INT8 以 IoU >= iou_threshold 找到的比例
+    frames_with_ball_change: 有球幀數的相對變化（負值表示 INT8 漏掉的幀）
+    """
+    from ultralytics import YOLO
+
+    fp32_detections, fp32_ms = _timed_detections(tracker, YOLO(fp32_path, task='detect'), frames, imgsz, runs)
+    int8_detections, int8_ms = _timed_detections(tracker, YOLO(int8_path, task='detect'), frames, imgsz, runs)
+
+    reference_count = 0
+    matched = 0
+    for reference, candidate in zip(fp32_detections, int8_detections):
+        reference_count += len(reference)
+        available = [d['bbox'] for d in candidate]
+        for detection in reference:
+            if not available:
+                break
+            ious = _box_iou(detection['bbox'], available)
+            best = int(np.argmax(ious))
+            if ious[best] >= iou_threshold:
+                matched += 1
+                available.pop(best)
+
+    fp32_frames = sum(1 for d in fp32_detections if d)
+    int8_frames = sum(1 for d in int8_detections if d)
+    return {
+        'frames': len(frames),
+        'fp32_detections': reference_count,
+        'int8_detections': sum(len(d) for d in int8_detections),
+        'recall': matched / reference_count if reference_count else 1.0,
+        'fp32_frames_with_ball': fp32_frames,
+        'int8_frames_with_ball': int8_frames,
+        'frames_with_ball_change': (int8_frames - fp32_frames) / fp32_frames if fp32_frames else 0.0,
+        'fp32_ms_per_frame': fp32_ms,
+        'int8_ms_per_frame': int8_ms,
+        'speedup': fp32_ms / int8_ms if int8_ms > 0 else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='網球檢測模型 INT8 量化')
+    parser.add_argument('--videos', default=os.getenv('UPLOAD_FOLDER', '../uploads'), help='校正用影片目錄')
+    parser.add_argument('--max-frames', type=int, default=200, help='校正抽樣幀數')
+    parser.add_argument('--compare', action='store_true', help='輸出與 FP32 模型的召回率與速度比較')
+    parser.add_argument('--compare-frames', type=int, default=100, help='比較用抽樣幀數')
+    args = parser.parse_args()
+
+    # 比較時沿用追蹤器的類別過濾、信心門檻與批次設定
+    os.environ['INFERENCE_BACKEND'] = 'torch'
+    from tennis_tracker import TennisTracker
+    tracker = TennisTracker()
+    imgsz = tracker.inference_imgsz
+
+    int8_path = quantize_model(tracker.model_path, imgsz, tracker.batch_size, args.videos, args.max_frames)
+    if not args.compare:
+        return
+
+    # 比較用幀避開校正用的幀號（抽樣方式相同，可重新計算校正幀的位置）
+    videos = list_videos(args.videos)
+    calibration = frame_positions(videos, args.max_frames)
+    frames = sample_frames(videos, args.compare_frames, exclude=calibration)
+    fp32_path = exported_model_path(tracker.model_path, 'onnx', imgsz, tracker.batch_size)
+    report = compare_models(tracker, fp32_path, int8_path, frames, imgsz)
+
+    print("\n📊 INT8 與 FP32 比較")
+    print(f"  比較幀數: {report['frames']}")
+    print(f"  檢測召回率（以 FP32 為基準）: {report['recall']:.1%}")
+    print(f"  有球幀數: FP32 {report['fp32_frames_with_ball']} / INT8 {report['int8_frames_with_ball']} "
+          f"({report['frames_with_ball_change']:+.1%})")
+    print(f"  每幀推論時間: FP32 {report['fp32_ms_per_frame']:.1f} ms / INT8 {report['int8_ms_per_frame']:.1f} ms")
+    print(f"  加速比: {report['speedup']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
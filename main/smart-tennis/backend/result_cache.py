@@ -0,0 +1,172 @@
+"""
+以內容定址的分析結果快取
+
+鍵值 = 影片內容的 SHA-256 + 模型權重的 SHA-256 + 影響結果的分析參數，
+同一部影片重複上傳（檔名與 file_id 不同）時直接沿用先前的分析結果與處理後影片。
+每筆快取是 cache_dir 下以鍵值命名的資料夾，資料夾的修改時間即最近使用時間；
+總大小超過上限時，從最久未使用的快取開始刪除（LRU）。
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+# 分析流程的輸出格式改變時遞增，使舊快取失效
+CACHE_VERSION = 2
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_digest_cache = {}
+_digest_lock = threading.Lock()
+
+
+def file_sha256(path):
+    """逐塊計算檔案的 SHA-256，不把整個檔案讀入記憶體"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cached_file_sha256(path):
+    """
+    同一行程內重複使用的檔案（例如模型權重）只計算一次
+    以路徑、大小與修改時間判斷檔案是否變更
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        if key in _digest_cache:
+            return _digest_cache[key]
+    digest = file_sha256(path)
+    with _digest_lock:
+        _digest_cache[key] = digest
+    return digest
+
+
+def cache_key(video_digest, params):
+    """由影片雜湊與分析參數（可轉為 JSON 的 dict）產生快取鍵值"""
+    payload = json.dumps({'version': CACHE_VERSION, 'video': video_digest, 'params': params},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def link_or_copy(source, target):
+    """優先建立硬連結（不佔額外空間），跨檔案系統時改為複製"""
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+class ResultCache:
+    """
+    磁碟上的結果快取，有大小上限（max_bytes）與 LRU 淘汰
+    寫入先放在暫存資料夾，完成後再改名，多個行程同時寫入同一鍵值也不會讀到不完整的快取
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """快取命中時回傳 {檔名: 路徑}，並更新最近使用時間；未命中回傳 None"""
+        entry = self.entry_dir(key)
+        try:
+            files = {name: os.path.join(entry, name) for name in os.listdir(entry)}
+            os.utime(entry)
+        except OSError:
+            return None
+        return files
+
+    def put(self, key, files):
+        """
+        加入一筆快取，files 為 {快取內檔名: 來源路徑}
+        已存在相同鍵值時不覆蓋（內容相同）
+        """
+        entry = self.entry_dir(key)
+        if os.path.isdir(entry):
+            return entry
+        staging = tempfile.mkdtemp(prefix='.staging_', dir=self.cache_dir)
+        try:
+            for name, source in files.items():
+                link_or_copy(source, os.path.join(staging, name))
+            os.rename(staging, entry)
+        except OSError:
+            # 其他行程已先寫入同一鍵值
+            shutil.rmtree(staging, ignore_errors=True)
+            if not os.path.isdir(entry):
+                raise
+        self.evict()
+        return entry
+
+    def add_file(self, key, name, source):
+        """在既有快取中補上一個檔案（例如延遲繪製完成的處理後影片）"""
+        entry = self.entry_dir(key)
+        if not os.path.isdir(entry):
+            return False
+        target = os.path.join(entry, name)
+        tmp_target = target + '.tmp'
+        try:
+            link_or_copy(source, tmp_target)
+            os.replace(tmp_target, target)
+        except OSError as e:
+            print(f"加入快取檔案失敗: {e}")
+            return False
+        self.evict()
+        return True
+
+    def evict(self):
+        """總大小超過上限時，從最久未使用的快取開始刪除"""
+        with self.lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                entry = os.path.join(self.cache_dir, name)
+                if name.startswith('.') or not os.path.isdir(entry):
+                    continue
+                try:
+                    size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+                    entries.append((os.path.getmtime(entry), size, entry))
+                except OSError:
+                    continue
+                total += size
+
+            entries.sort()
+            for _, size, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+                print(f"結果快取超過上限，刪除最久未使用的快取: {os.path.basename(entry)}")
+
+    def clean_staging(self, max_age=3600):
+        """清除異常中斷留下的暫存資料夾"""
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith('.staging_') and now - os.path.getmtime(path) > max_age:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def create_result_cache(output_folder='../output'):
+    """依環境變數建立結果快取，RESULT_CACHE=0 時停用（回傳 None）"""
+    if os.getenv('RESULT_CACHE', '1') != '1':
+        return None
+    cache_dir = os.getenv('RESULT_CACHE_DIR', os.path.join(output_folder, 'cache'))
+    max_bytes = int(float(os.getenv('RESULT_CACHE_MAX_MB', '2048')) * 1024 * 1024)
+    cache = ResultCache(cache_dir, max_bytes)
+    cache.clean_staging()
+    return cache
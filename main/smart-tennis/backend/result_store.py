@@ -0,0 +1,161 @@
+"""
+分析結果的儲存與查詢
+
+結果分成兩個檔案：
+    <id>_analysis.json    摘要、擊球、速度、影片資訊與軌跡（不含逐幀資料，緊湊格式不縮排）
+    <id>_detections.npz   逐幀網球檢測（BallPositions 的欄式陣列）
+查詢時只讀取需要的部分：可指定欄位（例如只要 summary、shots），逐幀資料可依幀範圍分頁，
+只把該頁轉為逐幀 dict。讀取過的結果依檔案版本快取在記憶體，重複查詢不必再解析。
+舊版（逐幀資料內嵌在 JSON）的結果仍可讀取。
+"""
+
+import os
+import json
+import threading
+from collections import OrderedDict
+import numpy as np
+from tracking_store import BallPositions
+
+BALL_POSITIONS_FIELD = 'tracking.ball_positions'
+
+
+def select_fields(results, fields):
+    """
+    依欄位路徑（最多兩層，例如 summary、tracking.video_info）挑出結果的一部分，保留原本的巢狀結構
+    fields 為 None 時回傳全部
+    """
+    if fields is None:
+        return dict(results)
+    selected = {}
+    for field in fields:
+        top, _, sub = field.partition('.')
+        if top not in results:
+            continue
+        value = results[top]
+        if not sub:
+            selected[top] = value
+            continue
+        if not isinstance(value, dict) or sub not in value:
+            continue
+        current = selected.get(top)
+        if current is value:
+            # 已選取整個欄位
+            continue
+        if current is None:
+            current = selected[top] = {}
+        current[sub] = value[sub]
+    return selected
+
+
+def wants_ball_positions(fields):
+    return fields is None or 'tracking' in fields or BALL_POSITIONS_FIELD in fields
+
+
+class ResultStore:
+    """分析結果的讀寫，讀取結果以 (路徑, 修改時間, 大小) 為版本快取最近 cache_size 筆"""
+
+    def __init__(self, output_folder, cache_size=16):
+        self.output_folder = output_folder
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def result_path(self, result_id):
+        return os.path.join(self.output_folder, f"{result_id}_analysis.json")
+
+    def detections_path(self, result_id):
+        """欄式檢測結果的保存路徑（逐幀資料與延遲繪製處理後影片時使用）"""
+        return os.path.join(self.output_folder, f"{result_id}_detections.npz")
+
+    def save(self, result_id, analysis_results, ball_positions=None):
+        """
+        保存結果（先寫暫存檔再替換，避免其他請求讀到寫到一半的檔案）
+        ball_positions 為 BallPositions 時另存欄式檢測結果；analysis_results 不應包含逐幀資料
+        """
+        if ball_positions is not None:
+            detections_file = self.detections_path(result_id)
+            tmp_detections = detections_file + '.tmp.npz'
+            np.savez(tmp_detections, **ball_positions.to_arrays())
+            os.replace(tmp_detections, detections_file)
+
+        result_file = self.result_path(result_id)
+        tmp_file = result_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(analysis_results, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_file, result_file)
+
+    def version(self, result_id):
+        """結果檔的版本字串（檔案改變即不同），結果不存在時回傳 None；只讀檔案屬性，不讀內容"""
+        parts = []
+        for path in (self.result_path(result_id), self.detections_path(result_id)):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                if path.endswith('.json'):
+                    return None
+                continue
+            parts.append(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+        return '-'.join(parts)
+
+    def _cached(self, key, loader):
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        value = loader()
+        with self.lock:
+            self.cache[key] = value
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return value
+
+    def load(self, result_id):
+        """
+        讀取結果，回傳 (結果 dict（不含逐幀資料）, BallPositions 或 None)
+        結果不存在時拋出 FileNotFoundError
+        """
+        version = self.version(result_id)
+        if version is None:
+            raise FileNotFoundError(result_id)
+
+        def loader():
+            with open(self.result_path(result_id), 'r', encoding='utf-8') as f:
+                results = json.load(f)
+            tracking = results.get('tracking')
+            ball_positions = None
+            if isinstance(tracking, dict) and 'ball_positions' in tracking:
+                # 舊版：逐幀資料內嵌在 JSON
+                tracking = dict(tracking)
+                ball_positions = BallPositions.from_dicts(tracking.pop('ball_positions'))
+                results['tracking'] = tracking
+            elif os.path.exists(self.detections_path(result_id)):
+                with np.load(self.detections_path(result_id)) as data:
+                    ball_positions = BallPositions.from_arrays(data)
+            return results, ball_positions
+
+        return self._cached((result_id, version), loader)
+
+    def query(self, result_id, fields=None, frame_start=0, frame_end=None):
+        """
+        查詢結果：fields 為欄位路徑列表（None 表示全部）；包含 tracking.ball_positions 時
+        只回傳 [frame_start, frame_end) 的逐幀資料，並以 ball_positions_page 標示範圍與總幀數
+        """
+        results, ball_positions = self.load(result_id)
+        payload = select_fields(results, fields)
+
+        if wants_ball_positions(fields):
+            total = len(ball_positions) if ball_positions is not None else 0
+            start = min(max(0, frame_start), total)
+            end = total if frame_end is None else min(max(start, frame_end), total)
+            page = [ball_positions[i] for i in range(start, end)] if ball_positions is not None else []
+            tracking = dict(payload.get('tracking') or {})
+            tracking['ball_positions'] = page
+            payload['tracking'] = tracking
+            if frame_start > 0 or frame_end is not None:
+                payload['ball_positions_page'] = {
+                    'frame_start': start,
+                    'frame_end': end,
+                    'total_frames': total,
+                    'next_frame_start': end if end < total else None
+                }
+        return payload
@@ -0,0 +1,137 @@
+"""
+推論工作階段池
+
+每個工作階段是一個獨立載入模型的追蹤器（TennisTracker）。同時進行的分析各自借出一個工作階段，
+用完歸還，不會有兩個執行緒同時使用同一個模型；工作階段都被借出時，後到的分析等待歸還。
+每個工作階段的運算執行緒數（threads）依「工作階段數 × 執行緒數 = CPU 核心數」分配，
+多個分析同時推論時不會因執行緒超額配置而互相拖慢。
+"""
+
+import os
+import queue
+import threading
+from contextlib import contextmanager
+import cv2
+from model_backends import set_engine_threads
+
+
+def thread_budget(sessions, cores=None):
+    """每個工作階段可使用的執行緒數"""
+    cores = cores or os.cpu_count() or 1
+    return max(1, cores // max(1, sessions))
+
+
+def limit_threads(threads):
+    """
+    限制 torch、OpenCV 與匯出引擎（onnxruntime / OpenVINO）每次運算使用的執行緒數
+    設定都是行程層級：每個同時推論的工作階段各自使用 threads 個執行緒；
+    匯出引擎在第一次推論時建立執行階段，需在此之前設定
+    """
+    cv2.setNumThreads(threads)
+    set_engine_threads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+class InferenceSessionPool:
+    """
+    固定數量的推論工作階段，以 checkout() 借出、離開 with 區塊時歸還
+    最近歸還的工作階段優先借出（後進先出），其模型權重較可能仍在 CPU 快取中
+    inference_server：各工作階段共用的批次推論伺服器（若有），其統計一併回報
+    """
+
+    def __init__(self, sessions, threads=None, inference_server=None):
+        if not sessions:
+            raise ValueError("工作階段池至少需要一個工作階段")
+        self.sessions = list(sessions)
+        self.threads = threads
+        self.inference_server = inference_server
+        self.free = queue.LifoQueue()
+        for session in self.sessions:
+            self.free.put(session)
+        self.lock = threading.Lock()
+        self.waiting = 0
+
+    @property
+    def size(self):
+        return len(self.sessions)
+
+    @property
+    def primary(self):
+        """讀取設定或不需推論的操作（例如繪製處理後影片）使用的工作階段，不需借出"""
+        return self.sessions[0]
+
+    def acquire(self, timeout=None):
+        """借出一個工作階段，全部借出時等待；超過 timeout 秒仍無法借出時拋出 TimeoutError"""
+        with self.lock:
+            self.waiting += 1
+        try:
+            return self.free.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"等待推論工作階段逾時（{timeout} 秒）")
+        finally:
+            with self.lock:
+                self.waiting -= 1
+
+    def release(self, session):
+        self.free.put(session)
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        session = self.acquire(timeout)
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    def engines(self):
+        """本行程中實際執行模型的追蹤器（共用批次推論伺服器時只有伺服器的一份，連線到獨立伺服器時沒有）"""
+        if self.inference_server is not None:
+            return [self.inference_server.engine]
+        return [session for session in self.sessions if session.inference_client is None]
+
+    def warmup(self, runs=2):
+        """在本行程預熱各模型（預先載入、fork 後的子行程使用）"""
+        for engine in self.engines():
+            engine.warmup(runs)
+
+    def status(self):
+        """工作階段的使用狀況（健康檢查使用）"""
+        available = self.free.qsize()
+        status = {
+            'sessions': self.size,
+            'threads_per_session': self.threads,
+            'in_use': self.size - available,
+            'waiting': self.waiting
+        }
+        if self.inference_server is not None:
+            status['batching'] = self.inference_server.status()
+        return status
+
+
+def configured_sessions():
+    """INFERENCE_SESSIONS：同時可進行推論的工作階段數（預設 1）"""
+    return max(1, int(os.getenv('INFERENCE_SESSIONS', '1')))
+
+
+def create_session_pool(factory, sessions=None, threads=None, cores=None):
+    """
+    依環境變數建立工作階段池，factory 為建立一個工作階段（載入一份模型）的函式
+    INFERENCE_SESSIONS：工作階段數（預設 1）
+    INFERENCE_THREADS：每個工作階段的執行緒數（預設 0 = CPU 核心數 / 工作階段數）
+    cores：此行程可使用的核心數（預設為全部；多個工作行程分配核心時由呼叫端指定）
+    只有一個工作階段且未指定執行緒數時維持 torch / OpenCV 的預設設定
+    """
+    sessions = configured_sessions() if sessions is None else max(1, sessions)
+    if threads is None:
+        threads = int(os.getenv('INFERENCE_THREADS', '0'))
+
+    if threads <= 0 and (sessions > 1 or cores):
+        threads = thread_budget(sessions, cores)
+    if threads > 0:
+        limit_threads(threads)
+        print(f"推論工作階段: {sessions} 個，每個使用 {threads} 個執行緒")
+    return InferenceSessionPool([factory() for _ in range(sessions)], threads or None)
@@ -4,8 +4,10 @@
 """
 
 import os
+import argparse
 import urllib.request
 from ultralytics import YOLO
+from model_backends import BACKENDS, normalize_backend, export_model
 
 def download_yolo_model():
     """下載 YOLOv8 模型"""
@@ -26,14 +28,70 @@ def download_yolo_model():
     else:
         print(f"✅ 模型已存在: {model_path}")
 
-def setup_models():
+def inference_sizes():
+    """追蹤時使用的輸入尺寸：INFERENCE_IMGSZ，啟用 ROI 時加上 ROI_SIZE"""
+    sizes = [max(32, int(os.getenv('INFERENCE_IMGSZ', '640')) // 32 * 32)]
+    if os.getenv('ROI_TRACKING', '0') == '1':
+        sizes.append(max(32, int(os.getenv('ROI_SIZE', '320')) // 32 * 32))
+    return sorted(set(sizes))
+
+def export_inference_model(backend):
+    """
+    匯出 onnx / openvino 推論模型（固定輸入形狀）
+    輸入尺寸與批次大小取自 INFERENCE_IMGSZ / INFERENCE_BATCH_SIZE，啟用 ROI 時一併匯出 ROI_SIZE 的版本；
+    批次大於 1 時另外匯出批次 1 的版本
+    """
+    backend = normalize_backend(backend)
+    if backend == 'torch':
+        return
+    
+    model_path = os.getenv('YOLO_MODEL_PATH', '../models/yolov8n.pt')
+    batch = max(1, int(os.getenv('INFERENCE_BATCH_SIZE', '1')))
+    
+    for imgsz in inference_sizes():
+        # 批次 1 的引擎供關鍵幀、ROI 視窗等不足一批的推論使用
+        for size in sorted({1, batch}):
+            try:
+                export_model(model_path, backend, imgsz, size)
+            except Exception as e:
+                print(f"❌ 匯出 {backend} 模型失敗 (imgsz={imgsz}, batch={size}): {e}")
+
+def quantize_inference_model(video_dir=None):
+    """
+    以上傳影片校正產生 INT8 ONNX 模型（INFERENCE_PRECISION=int8 時後端只載入，不會自動量化）
+    校正失敗時拋出例外
+    """
+    from quantization import quantize_model
+    
+    model_path = os.getenv('YOLO_MODEL_PATH', '../models/yolov8n.pt')
+    batch = max(1, int(os.getenv('INFERENCE_BATCH_SIZE', '1')))
+    for imgsz in inference_sizes():
+        for size in sorted({1, batch}):
+            quantize_model(model_path, imgsz, size, video_dir)
+
+def setup_models(backend=None, int8=False, video_dir=None):
     """設置所有必要的模型"""
     print("🤖 設置 AI 模型...")
     
     # 下載 YOLO 模型
     download_yolo_model()
     
+    # 匯出 CPU 推論後端模型
+    export_inference_model(backend or os.getenv('INFERENCE_BACKEND', 'torch'))
+    
+    # INT8 量化（需 onnx 後端）
+    if int8:
+        quantize_inference_model(video_dir)
+    
     print("🎉 模型設置完成！")
 
 if __name__ == "__main__":
-    setup_models()
+    parser = argparse.ArgumentParser(description='下載並設置 AI 模型')
+    parser.add_argument('--backend', choices=BACKENDS, default=None,
+                        help='同時匯出的推論後端（預設讀取 INFERENCE_BACKEND）')
+    parser.add_argument('--int8', action='store_true',
+                        default=os.getenv('INFERENCE_PRECISION', 'fp32').strip().lower() == 'int8',
+                        help='以上傳影片校正產生 INT8 模型（預設依 INFERENCE_PRECISION）')
+    parser.add_argument('--videos', default=None, help='INT8 校正用影片目錄（預設為 UPLOAD_FOLDER 或 ../uploads）')
+    args = parser.parse_args()
+    setup_models(args.backend, args.int8, args.videos)
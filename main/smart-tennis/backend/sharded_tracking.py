@@ -0,0 +1,189 @@
+"""
+多行程分段追蹤：將單一影片依幀範圍切段，每段由獨立行程（各自載入模型）檢測，再拼接結果
+
+每段會從起點前 overlap 幀開始解碼並執行檢測，讓關鍵幀間隔、ROI、幀差預篩等
+依賴前幾幀的狀態先收斂，重疊部分的結果丟棄。各段的檢測拼接後，由主行程在完整的
+檢測序列上重新執行一次軌跡追蹤，跨段的軌跡因此自然接續，與單行程結果一致。
+工作行程常駐（ShardPool），模型只在行程啟動時載入與預熱一次，之後的影片直接沿用。
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import cv2
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from tracking_store import BallPositions
+from frame_bus import probe_video
+from video_writer import find_ffmpeg, open_video_writer
+
+# 工作行程內的追蹤器（每個行程載入一次模型）
+_worker_tracker = None
+
+
+def plan_shards(total_frames, shards, overlap, stride=1):
+    """
+    將 [0, total_frames) 切為 shards 段，回傳 [(decode_start, start, end), ...]
+    decode_start 對齊關鍵幀間隔，使各段的關鍵幀位置與單行程處理相同；最後一段 end 為 None（讀到檔尾）
+    """
+    shards = max(1, min(shards, total_frames // max(1, 2 * overlap) or 1))
+    bounds = np.linspace(0, total_frames, shards + 1).astype(int)
+    plan = []
+    for i in range(shards):
+        start = int(bounds[i])
+        decode_start = max(0, start - overlap) // stride * stride
+        end = int(bounds[i + 1]) if i < shards - 1 else None
+        plan.append((decode_start, start, end))
+    return plan
+
+
+def _init_worker(model_path, threads):
+    """工作行程初始化：限制每個行程的運算執行緒數（torch 與 onnxruntime / OpenVINO），並載入模型"""
+    global _worker_tracker
+    from session_pool import limit_threads
+    limit_threads(threads)
+    # 解碼只在單一執行緒進行，運算執行緒留給推論
+    cv2.setNumThreads(1)
+
+    from tennis_tracker import TennisTracker
+    _worker_tracker = TennisTracker(model_path)
+
+
+def _run_shard(video_path, decode_start, start, end, part_path, options):
+    """在工作行程中檢測一段影片，回傳可 pickle 的欄式結果"""
+    return _worker_tracker.detect_range(video_path, decode_start, start, end, part_path, **options)
+
+
+class ShardPool:
+    """
+    常駐的分段追蹤行程池：workers 個 spawn 行程，第一次使用時啟動並各自載入模型，
+    之後每部影片都重複使用，不必每次重新啟動行程、載入與預熱模型
+    每個行程分配的運算執行緒數，行程數 × 執行緒數 ≈ CPU 核心數
+    """
+
+    def __init__(self, model_path, workers):
+        self.model_path = model_path
+        self.workers = workers
+        self.threads = max(1, (os.cpu_count() or 1) // workers)
+        self.executor = None
+
+    def submit(self, fn, *args):
+        if self.executor is None:
+            # spawn 行程不繼承父行程的模型與執行緒狀態，各平台行為一致
+            context = multiprocessing.get_context('spawn')
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                                initializer=_init_worker, initargs=(self.model_path, self.threads))
+        return self.executor.submit(fn, *args)
+
+    def close(self):
+        """結束工作行程；之後再使用時重新啟動"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+
+def track_sharded(tracker, video_path, output_path=None, shards=2, overlap=30, batch_size=None, stride=None,
+                  roi=None, motion_gate=None):
+    """
+    分段平行追蹤，回傳格式與 TennisTracker.track_ball 相同
+    """
+    video_info = probe_video(video_path)
+
+    options = {
+        'batch_size': batch_size,
+        'stride': tracker.detection_stride if stride is None else stride,
+        'roi': roi,
+        'motion_gate': motion_gate
+    }
+    plan = plan_shards(video_info['total_frames'], shards, overlap, max(1, int(options['stride'])))
+    print(f"分段追蹤: {video_info['total_frames']} 幀，{len(plan)} 個行程")
+
+    part_dir = tempfile.mkdtemp(prefix='shards_') if output_path else None
+    part_paths = [os.path.join(part_dir, f'part_{i:03d}.mp4') if part_dir else None for i in range(len(plan))]
+    pool = tracker.shard_pool(shards)
+
+    try:
+        try:
+            futures = [
+                pool.submit(_run_shard, video_path, decode_start, start, end, part_path, options)
+                for (decode_start, start, end), part_path in zip(plan, part_paths)
+            ]
+            shard_results = [future.result() for future in futures]
+        except BrokenProcessPool:
+            # 工作行程異常結束時丟棄整個行程池，下一次重新啟動
+            pool.close()
+            raise
+
+        ball_positions = stitch_ball_positions([result['ball_positions'] for result in shard_results])
+        video_info['skipped_frames'] = sum(result['skipped_frames'] for result in shard_results)
+        video_info['shards'] = len(plan)
+
+        if output_path:
+            video_info['output_codec'] = concat_videos(
+                [p for p in part_paths if os.path.exists(p)], output_path, video_info, shard_results[0]['output_codec']
+            )
+    finally:
+        if part_dir:
+            shutil.rmtree(part_dir, ignore_errors=True)
+
+    # 在拼接後的完整檢測序列上重新追蹤，跨段邊界的軌跡得以接續
+    trajectories = tracker.analyze_trajectories(ball_positions)
+
+    print(f"追蹤完成，共檢測到 {ball_positions.frames_with_detections()} 幀包含網球")
+
+    return {
+        'video_info': video_info,
+        'ball_positions': ball_positions,
+        'trajectories': trajectories
+    }
+
+
+def stitch_ball_positions(shard_arrays):
+    """依序拼接各段 BallPositions.to_arrays() 的結果"""
+    frames = [arrays['frames'] for arrays in shard_arrays]
+    detections = [arrays['detections'] for arrays in shard_arrays]
+    offsets = [np.zeros(1, dtype=np.int64)]
+    base = 0
+    for arrays in shard_arrays:
+        offsets.append(arrays['offsets'][1:] + base)
+        base += len(arrays['detections'])
+    return BallPositions(np.concatenate(frames), np.concatenate(detections), np.concatenate(offsets))
+
+
+def concat_videos(part_paths, output_path, video_info, codec):
+    """
+    串接各段的標註影片，回傳輸出影片的編碼格式
+    有 ffmpeg 時以 concat demuxer 直接複製串流（維持各段的編碼），否則逐幀重新寫入
+    """
+    if not part_paths:
+        return None
+    ffmpeg_exe = find_ffmpeg()
+    if ffmpeg_exe:
+        try:
+            list_path = os.path.join(os.path.dirname(part_paths[0]), 'parts.txt')
+            with open(list_path, 'w', encoding='utf-8') as f:
+                for path in part_paths:
+                    f.write(f"file '{os.path.abspath(path)}'\n")
+            cmd = [ffmpeg_exe, '-y', '-f', 'concat', '-safe', '0', '-i', list_path, '-c', 'copy',
+                   '-movflags', '+faststart', output_path]
+            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            return codec
+        except Exception as e:
+            print(f"ffmpeg 串接失敗，改為逐幀重新寫入: {e}")
+
+    out = open_video_writer(output_path, video_info['fps'], (video_info['width'], video_info['height']))
+    try:
+        for path in part_paths:
+            cap = cv2.VideoCapture(path)
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                out.write(frame)
+            cap.release()
+    finally:
+        out.release()
+    return out.codec
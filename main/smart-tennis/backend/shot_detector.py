@@ -1,7 +1,8 @@
-import cv2
 import numpy as np
 from collections import deque
 import math
+from tracking_store import BallPositions
+from frame_bus import probe_video
 
 class ShotDetector:
     def __init__(self):
@@ -17,20 +18,23 @@ class ShotDetector:
         """檢測影片中的正反手擊球（簡化版本）"""
         print("開始檢測正反手擊球（簡化模式）...")
         
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            raise ValueError(f"無法開啟影片: {video_path}")
-        
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        # 只需要 fps：優先使用追蹤結果中的影片資訊，避免再開啟影片
+        video_info = tracking_results.get('video_info') or probe_video(video_path)
+        fps = video_info['fps']
         
         # 基於網球軌跡變化檢測擊球
         shots = self.detect_shots_from_ball_trajectory(tracking_results, fps)
         
-        cap.release()
-        
         print(f"檢測完成，找到 {len(shots)} 次擊球")
         
+        return self.summarize_shots(shots)
+    
+    def stream(self):
+        """建立串流擊球檢測，可作為 TennisTracker.track_ball 的 consumer 邊追蹤邊檢測"""
+        return ShotStream(self)
+    
+    def summarize_shots(self, shots):
+        """整理擊球檢測結果"""
         return {
             'shots': shots,
             'total_shots': len(shots),
@@ -41,62 +45,89 @@ class ShotDetector:
     def detect_shots_from_ball_trajectory(self, tracking_results, fps):
         """基於網球軌跡檢測擊球"""
         shots = []
-        ball_positions = tracking_results.get('ball_positions', [])
+        frame_numbers, centers = self.ball_track_from_trajectories(tracking_results.get('trajectories'))
+        if frame_numbers is None:
+            # 沒有軌跡時直接讀取欄式檢測結果，取每幀第一個檢測
+            ball_positions = BallPositions.ensure(tracking_results.get('ball_positions'))
+            frame_numbers = ball_positions.frame_numbers.astype(np.int64)
+            centers = ball_positions.first_centers()
         
-        if len(ball_positions) < 10:
+        if len(frame_numbers) < 10:
             return shots
         
-        # 計算網球速度變化
-        velocities = []
-        for i in range(1, len(ball_positions)):
-            prev_frame = ball_positions[i-1]
-            curr_frame = ball_positions[i]
-            
-            if prev_frame['detections'] and curr_frame['detections']:
-                prev_pos = prev_frame['detections'][0]['center']
-                curr_pos = curr_frame['detections'][0]['center']
-                
-                # 計算速度
-                dx = curr_pos[0] - prev_pos[0]
-                dy = curr_pos[1] - prev_pos[1]
-                distance = math.sqrt(dx**2 + dy**2)
-                
-                frame_diff = curr_frame['frame_number'] - prev_frame['frame_number']
-                if frame_diff > 0:
-                    velocity = distance / frame_diff
-                    velocities.append({
-                        'frame': curr_frame['frame_number'],
-                        'velocity': velocity,
-                        'position': curr_pos,
-                        'direction': (dx, dy)
-                    })
+        # 計算網球速度變化（相鄰兩幀都有球時才計算）
+        has_ball = ~np.isnan(centers[:, 0])
+        pairs = np.flatnonzero(has_ball[:-1] & has_ball[1:])
+        directions = centers[pairs + 1] - centers[pairs]
+        distances = np.hypot(directions[:, 0], directions[:, 1])
+        frame_diffs = frame_numbers[pairs + 1] - frame_numbers[pairs]
+        moving = frame_diffs > 0
+        
+        velocities = [
+            {
+                'frame': frame,
+                'velocity': velocity,
+                'position': tuple(position),
+                'direction': tuple(direction)
+            }
+            for frame, velocity, position, direction in zip(
+                frame_numbers[pairs + 1][moving].tolist(),
+                (distances[moving] / frame_diffs[moving]).tolist(),
+                centers[pairs + 1][moving].tolist(),
+                directions[moving].tolist()
+            )
+        ]
         
         # 檢測速度突變（可能的擊球點）
         for i in range(2, len(velocities) - 2):
-            current_vel = velocities[i]['velocity']
-            prev_vel = velocities[i-1]['velocity']
-            next_vel = velocities[i+1]['velocity']
-            
-            # 檢測速度突然增加（擊球）
-            if (current_vel > prev_vel * 1.5 and 
-                current_vel > 20 and  # 最小速度閾值
-                next_vel > current_vel * 0.7):  # 確保不是雜訊
-                
-                shot_type = self.classify_shot_simple(velocities[i])
-                
-                shots.append({
-                    'frame': velocities[i]['frame'],
-                    'timestamp': velocities[i]['frame'] / fps,
-                    'type': shot_type,
-                    'side': 'right' if shot_type == 'forehand' else 'left',
-                    'confidence': min(current_vel / 100, 1.0),
-                    'ball_contact_frame': velocities[i]['frame'],
-                    'swing_velocity': current_vel
-                })
+            if self.is_shot_candidate(velocities[i-1], velocities[i], velocities[i+1]):
+                shots.append(self.build_shot(velocities[i], fps))
         
         # 過濾重複檢測
         return self.filter_duplicate_shots(shots)
     
+    def ball_track_from_trajectories(self, trajectories):
+        """
+        由追蹤器輸出的軌跡重建逐幀球位置，排除未被任何軌跡採用的誤檢
+        多條軌跡重疊時以較長的軌跡為準；回傳 (幀號陣列, 中心點陣列)，無球的幀為 NaN
+        """
+        trajectories = [t for t in (trajectories or []) if t and t['positions']]
+        if not trajectories:
+            return None, None
+        
+        first_frame = min(t['start_frame'] for t in trajectories)
+        last_frame = max(t['start_frame'] + len(t['positions']) - 1 for t in trajectories)
+        centers = np.full((last_frame - first_frame + 1, 2), np.nan)
+        
+        # 由短到長寫入，較長的軌跡最後寫入而覆蓋重疊的幀
+        for trajectory in sorted(trajectories, key=lambda t: len(t['positions'])):
+            start = trajectory['start_frame'] - first_frame
+            centers[start:start + len(trajectory['positions'])] = trajectory['positions']
+        
+        return np.arange(first_frame, last_frame + 1), centers
+    
+    def is_shot_candidate(self, prev_velocity, velocity, next_velocity):
+        """檢測速度突然增加（擊球）"""
+        current_vel = velocity['velocity']
+        return (current_vel > prev_velocity['velocity'] * 1.5 and
+                current_vel > 20 and  # 最小速度閾值
+                next_velocity['velocity'] > current_vel * 0.7)  # 確保不是雜訊
+    
+    def build_shot(self, velocity_data, fps):
+        """由速度突變點建立擊球紀錄"""
+        current_vel = velocity_data['velocity']
+        shot_type = self.classify_shot_simple(velocity_data)
+        
+        return {
+            'frame': velocity_data['frame'],
+            'timestamp': velocity_data['frame'] / fps,
+            'type': shot_type,
+            'side': 'right' if shot_type == 'forehand' else 'left',
+            'confidence': min(current_vel / 100, 1.0),
+            'ball_contact_frame': velocity_data['frame'],
+            'swing_velocity': current_vel
+        }
+    
     def classify_shot_simple(self, velocity_data):
         """簡化的擊球分類"""
         # 基於球的移動方向簡單分類
@@ -127,4 +158,114 @@ class ShotDetector:
             if not is_duplicate:
                 filtered_shots.append(shot)
         
-        return filtered_shots
\ No newline at end of file
+        return filtered_shots
+
+class _VelocitySpikeScanner:
+    """
+    逐幀累積球速並檢查速度突變，只保留最近幾筆速度，記憶體用量固定
+    與 ShotDetector.detect_shots_from_ball_trajectory 的批次判斷一致
+    """
+    def __init__(self, detector, fps):
+        self.detector = detector
+        self.fps = fps
+        self.previous = None
+        self.window = deque(maxlen=4)
+        self.velocity_count = 0
+        self.shots = []
+    
+    def add(self, frame, center):
+        """依幀序加入球位置，無球的幀傳入 None"""
+        if center is None:
+            self.previous = None
+            return
+        
+        if self.previous is not None:
+            prev_frame, prev_center = self.previous
+            dx = center[0] - prev_center[0]
+            dy = center[1] - prev_center[1]
+            frame_diff = frame - prev_frame
+            if frame_diff > 0:
+                self._push({
+                    'frame': frame,
+                    'velocity': math.sqrt(dx**2 + dy**2) / frame_diff,
+                    'position': tuple(center),
+                    'direction': (dx, dy)
+                })
+        
+        self.previous = (frame, center)
+    
+    def _push(self, velocity):
+        self.window.append(velocity)
+        self.velocity_count += 1
+        # 批次版本只檢查前後各有兩筆速度的位置
+        if self.velocity_count < 5:
+            return
+        
+        prev_velocity, candidate, next_velocity = self.window[0], self.window[1], self.window[2]
+        if self.detector.is_shot_candidate(prev_velocity, candidate, next_velocity):
+            shot = self.detector.build_shot(candidate, self.fps)
+            # 30幀內的檢測視為重複
+            if not self.shots or shot['frame'] - self.shots[-1]['frame'] >= 30:
+                self.shots.append(shot)
+
+
+class ShotStream:
+    """
+    串流擊球檢測：消費 TennisTracker.iter_track 的事件，在追蹤進行中逐步找出擊球
+
+    已結束的軌跡依 settled_before 依序交給掃描器，重疊時以較長的軌跡為準；
+    整段影片都沒有軌跡時，改用每幀第一個原始檢測的結果。
+    """
+    def __init__(self, detector):
+        self.detector = detector
+        self.trajectory_scanner = None
+        self.raw_scanner = None
+        self.closed_positions = {}
+        self.next_frame = None
+        self.has_trajectories = False
+    
+    def consume(self, event):
+        kind = event['type']
+        if kind == 'start':
+            fps = event['video_info']['fps']
+            self.trajectory_scanner = _VelocitySpikeScanner(self.detector, fps)
+            self.raw_scanner = _VelocitySpikeScanner(self.detector, fps)
+        elif kind == 'trajectory':
+            self._add_trajectory(event['trajectory'])
+        elif kind == 'frame':
+            detections = event['detections']
+            self.raw_scanner.add(event['frame_number'], detections[0]['center'] if detections else None)
+            self._settle(event['settled_before'])
+        elif kind == 'end':
+            if self.closed_positions:
+                self._settle(max(self.closed_positions) + 1)
+    
+    def result(self):
+        scanner = self.trajectory_scanner if self.has_trajectories else self.raw_scanner
+        shots = scanner.shots if scanner is not None else []
+        print(f"檢測完成，找到 {len(shots)} 次擊球")
+        return self.detector.summarize_shots(list(shots))
+    
+    def _add_trajectory(self, trajectory):
+        if not trajectory or not trajectory['positions']:
+            return
+        
+        self.has_trajectories = True
+        length = len(trajectory['positions'])
+        for offset, position in enumerate(trajectory['positions']):
+            frame = trajectory['start_frame'] + offset
+            current = self.closed_positions.get(frame)
+            if current is None or length >= current[0]:
+                self.closed_positions[frame] = (length, position)
+    
+    def _settle(self, settled_before):
+        """將已不會再變動的幀依序交給軌跡掃描器"""
+        if self.next_frame is None:
+            if not self.closed_positions:
+                return
+            self.next_frame = min(self.closed_positions)
+        
+        for frame in range(self.next_frame, settled_before):
+            entry = self.closed_positions.pop(frame, None)
+            self.trajectory_scanner.add(frame, entry[1] if entry else None)
+        self.next_frame = max(self.next_frame, settled_before)
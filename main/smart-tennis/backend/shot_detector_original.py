@@ -1,8 +1,14 @@
 import cv2
 import numpy as np
-# import mediapipe as mp  # 暫時註解，Python 3.13 不支援
+# mediapipe 尚不支援 Python 3.13，未安裝時此模組仍可匯入，但無法建立 ShotDetector
+try:
+    import mediapipe as mp
+except ImportError:
+    mp = None
 from collections import deque
 import math
+from frame_bus import FrameBus
+from tracking_store import BallPositions
 
 class ShotDetector:
     def __init__(self):
@@ -11,13 +17,7 @@ class ShotDetector:
         """
         self.mp_pose = mp.solutions.pose
         self.mp_hands = mp.solutions.hands
-        self.pose = self.mp_pose.Pose(
-            static_image_mode=False,
-            model_complexity=1,
-            smooth_landmarks=True,
-            min_detection_confidence=0.5,
-            min_tracking_confidence=0.5
-        )
+        self.pose = self.create_pose()
         
         self.hands = self.mp_hands.Hands(
             static_image_mode=False,
@@ -34,52 +34,51 @@ class ShotDetector:
     def detect_shots(self, video_path, tracking_results):
         """
         檢測影片中的正反手擊球
+        已與網球追蹤共用 FrameBus 時，改用 pose_consumer() 避免再解碼一次影片
         """
         print("開始檢測正反手擊球...")
         
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            raise ValueError(f"無法開啟影片: {video_path}")
-        
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        bus = FrameBus(video_path)
+        consumer = bus.subscribe(self.pose_consumer())
+        bus.run()
         
+        return consumer.detect_shots(tracking_results)
+    
+    def create_pose(self):
+        """
+        建立 MediaPipe Pose；static_image_mode=False 會在幀與幀之間保留追蹤狀態，
+        每段影片（每個 consumer）都需要自己的實例，不能跨分析共用
+        """
+        return self.mp_pose.Pose(
+            static_image_mode=False,
+            model_complexity=1,
+            smooth_landmarks=True,
+            min_detection_confidence=0.5,
+            min_tracking_confidence=0.5
+        )
+    
+    def pose_consumer(self):
+        """建立逐幀姿態檢測的 FrameBus consumer（自帶 Pose 實例，可多個分析同時使用）"""
+        return PoseConsumer(self)
+    
+    def detect_shots_from_poses(self, poses, tracking_results):
+        """
+        以逐幀姿態資料與網球追蹤結果檢測擊球
+        poses: [{'frame', 'timestamp', 'pose_data'}, ...]，只包含偵測到人體的幀
+        """
         shots = []
-        frame_count = 0
         
         # 姿態追蹤歷史
         pose_history = deque(maxlen=self.shot_window)
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # 檢測人體姿態
-            pose_landmarks = self.detect_pose(frame)
-            
-            if pose_landmarks:
-                # 分析姿態
-                pose_data = self.extract_pose_data(pose_landmarks, frame.shape)
-                pose_history.append({
-                    'frame': frame_count,
-                    'timestamp': frame_count / fps,
-                    'pose_data': pose_data
-                })
-                
-                # 檢測擊球動作
-                if len(pose_history) >= self.shot_window:
-                    shot = self.detect_shot_in_window(pose_history, tracking_results, frame_count)
-                    if shot:
-                        shots.append(shot)
+        for pose in poses:
+            pose_history.append(pose)
             
-            frame_count += 1
-            
-            if frame_count % 60 == 0:
-                progress = (frame_count / total_frames) * 100
-                print(f"檢測進度: {progress:.1f}%")
-        
-        cap.release()
+            # 檢測擊球動作
+            if len(pose_history) >= self.shot_window:
+                shot = self.detect_shot_in_window(pose_history, tracking_results, pose['frame'])
+                if shot:
+                    shots.append(shot)
         
         # 過濾重複檢測
         filtered_shots = self.filter_duplicate_shots(shots)
@@ -93,12 +92,13 @@ class ShotDetector:
             'backhand_count': len([s for s in filtered_shots if s['type'] == 'backhand'])
         }
     
-    def detect_pose(self, frame):
+    def detect_pose(self, frame, pose=None):
         """
         檢測人體姿態
+        pose: 指定使用的 Pose 實例，預設為檢測器本身的 self.pose
         """
         rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = self.pose.process(rgb_frame)
+        results = (pose or self.pose).process(rgb_frame)
         return results.pose_landmarks
     
     def extract_pose_data(self, landmarks, frame_shape):
@@ -227,36 +227,52 @@ class ShotDetector:
     def check_ball_contact(self, pose_history, tracking_results):
         """
         檢查是否有球拍接觸網球
+        直接讀取欄式檢測結果，以二分搜尋找出時間窗口內的幀，不逐幀產生 dict
         """
         # 獲取當前時間窗口的網球位置
         window_start_frame = pose_history[0]['frame']
         window_end_frame = pose_history[-1]['frame']
         
-        for frame_data in tracking_results['ball_positions']:
-            frame_num = frame_data['frame_number']
-            if window_start_frame <= frame_num <= window_end_frame and frame_data['detections']:
-                # 檢查網球是否接近手腕位置
-                for detection in frame_data['detections']:
-                    ball_pos = detection['center']
-                    
-                    # 找到對應幀的姿態數據
-                    for pose_frame in pose_history:
-                        if pose_frame['frame'] == frame_num:
-                            pose_data = pose_frame['pose_data']
-                            
-                            # 計算距離
-                            left_dist = self.calculate_distance(ball_pos, pose_data['left_wrist'])
-                            right_dist = self.calculate_distance(ball_pos, pose_data['right_wrist'])
-                            
-                            # 接觸閾值（像素）
-                            contact_threshold = 100
-                            
-                            if left_dist < contact_threshold or right_dist < contact_threshold:
-                                return {
-                                    'frame': frame_num,
-                                    'ball_position': ball_pos,
-                                    'distance': min(left_dist, right_dist)
-                                }
+        ball_positions = BallPositions.ensure(tracking_results['ball_positions'])
+        frame_numbers = ball_positions.frame_numbers
+        offsets = ball_positions.offsets
+        first = int(np.searchsorted(frame_numbers, window_start_frame, side='left'))
+        last = int(np.searchsorted(frame_numbers, window_end_frame, side='right'))
+        if first >= last:
+            return None
+        
+        # 只取窗口內的檢測計算中心點
+        bboxes = ball_positions.detections['bbox'][offsets[first]:offsets[last]].astype(np.float64)
+        centers = ((bboxes[:, :2] + bboxes[:, 2:]) / 2).tolist()
+        base = offsets[first]
+        
+        # 各幀對應的姿態數據（同一幀有多筆時取第一筆）
+        poses = {}
+        for pose_frame in pose_history:
+            poses.setdefault(pose_frame['frame'], pose_frame['pose_data'])
+        
+        # 接觸閾值（像素）
+        contact_threshold = 100
+        
+        for i in range(first, last):
+            frame_num = int(frame_numbers[i])
+            pose_data = poses.get(frame_num)
+            if pose_data is None:
+                continue
+            # 檢查網球是否接近手腕位置
+            for center in centers[offsets[i] - base:offsets[i + 1] - base]:
+                ball_pos = tuple(center)
+                
+                # 計算距離
+                left_dist = self.calculate_distance(ball_pos, pose_data['left_wrist'])
+                right_dist = self.calculate_distance(ball_pos, pose_data['right_wrist'])
+                
+                if left_dist < contact_threshold or right_dist < contact_threshold:
+                    return {
+                        'frame': frame_num,
+                        'ball_position': ball_pos,
+                        'distance': min(left_dist, right_dist)
+                    }
         
         return None
     
@@ -323,3 +339,48 @@ class ShotDetector:
                 filtered_shots.append(shot)
         
         return filtered_shots
+
+
+class PoseConsumer:
+    """
+    FrameBus consumer：逐幀檢測人體姿態並保存關鍵點
+    擊球判斷需要網球位置，於追蹤完成後呼叫 detect_shots(tracking_results)
+    """
+    def __init__(self, detector):
+        self.detector = detector
+        self.pose = None
+        self.poses = []
+        self.total_frames = 0
+    
+    def start(self, video_info):
+        self.total_frames = video_info['total_frames']
+        # 每個 consumer 使用自己的 Pose，並行的分析不會共用追蹤狀態
+        self.pose = self.detector.create_pose()
+    
+    def on_frame(self, frame_number, timestamp, frame):
+        # 檢測人體姿態（只讀取共用幀，不修改）
+        pose_landmarks = self.detector.detect_pose(frame, self.pose)
+        
+        if pose_landmarks:
+            self.poses.append({
+                'frame': frame_number,
+                'timestamp': timestamp,
+                'pose_data': self.detector.extract_pose_data(pose_landmarks, frame.shape)
+            })
+        
+        if (frame_number + 1) % 60 == 0 and self.total_frames:
+            progress = ((frame_number + 1) / self.total_frames) * 100
+            print(f"姿態檢測進度: {progress:.1f}%")
+    
+    def finish(self):
+        self.close()
+    
+    def close(self):
+        if self.pose is not None:
+            self.pose.close()
+            self.pose = None
+    
+    def detect_shots(self, tracking_results):
+        # 解碼中途失敗時不會呼叫 finish()，在這裡補上釋放
+        self.close()
+        return self.detector.detect_shots_from_poses(self.poses, tracking_results)
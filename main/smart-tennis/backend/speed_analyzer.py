@@ -2,7 +2,6 @@ import numpy as np
 import cv2
 from scipy.signal import savgol_filter
 from scipy.spatial.distance import euclidean
-import math
 
 class SpeedAnalyzer:
     def __init__(self):
@@ -27,28 +26,26 @@ class SpeedAnalyzer:
         print("開始分析網球速度...")
         
         if not tracking_results or not tracking_results.get('trajectories'):
-            return {
-                'max_speed': 0,
-                'avg_speed': 0,
-                'speed_distribution': [],
-                'trajectory_speeds': []
-            }
+            return self.empty_result()
         
-        fps = tracking_results['video_info']['fps']
+        stream = self.stream()
+        stream.consume({'type': 'start', 'video_info': tracking_results['video_info']})
+        for trajectory in tracking_results['trajectories']:
+            stream.consume({'type': 'trajectory', 'trajectory': trajectory})
         
-        trajectory_speeds = []
+        return stream.result()
+    
+    def stream(self):
+        """建立串流速度分析，可作為 TennisTracker.track_ball 的 consumer 邊追蹤邊計算"""
+        return SpeedStream(self)
+    
+    def summarize_speeds(self, trajectory_speeds, tracking_results):
+        """
+        彙整各軌跡速度為整體統計
+        """
         all_speeds = []
-        
-        for trajectory in tracking_results['trajectories']:
-            if trajectory and len(trajectory['positions']) > 2:
-                speeds = self.calculate_trajectory_speed(trajectory, fps)
-                trajectory_speeds.append({
-                    'trajectory_id': trajectory['id'],
-                    'speeds': speeds,
-                    'max_speed': max(speeds) if speeds else 0,
-                    'avg_speed': np.mean(speeds) if speeds else 0
-                })
-                all_speeds.extend(speeds)
+        for trajectory_speed in trajectory_speeds:
+            all_speeds.extend(trajectory_speed['speeds'])
         
         # 統計分析
         max_speed = max(all_speeds) if all_speeds else 0
@@ -74,6 +71,15 @@ class SpeedAnalyzer:
             }
         }
     
+    def empty_result(self):
+        """沒有任何軌跡時的分析結果"""
+        return {
+            'max_speed': 0,
+            'avg_speed': 0,
+            'speed_distribution': [],
+            'trajectory_speeds': []
+        }
+    
     def calculate_trajectory_speed(self, trajectory, fps):
         """
         計算單條軌跡的速度
@@ -83,23 +89,13 @@ class SpeedAnalyzer:
             return []
         
         # 平滑軌跡
-        smoothed_positions = self.smooth_trajectory(positions)
-        
-        speeds = []
-        for i in range(1, len(smoothed_positions)):
-            # 計算位移
-            dx = smoothed_positions[i][0] - smoothed_positions[i-1][0]
-            dy = smoothed_positions[i][1] - smoothed_positions[i-1][1]
-            distance = math.sqrt(dx**2 + dy**2)
-            
-            # 計算時間差
-            dt = 1.0 / fps
-            
-            # 計算速度 (像素/秒)
-            speed = distance / dt if dt > 0 else 0
-            speeds.append(speed)
+        smoothed_positions = np.asarray(self.smooth_trajectory(positions), dtype=np.float64)
         
-        return speeds
+        # 相鄰幀間距 1/fps，速度 = 位移 × fps (像素/秒)
+        displacements = np.diff(smoothed_positions, axis=0)
+        speeds = np.hypot(displacements[:, 0], displacements[:, 1]) * fps
+        
+        return speeds.tolist()
     
     def smooth_trajectory(self, positions):
         """
@@ -280,3 +276,38 @@ class SpeedAnalyzer:
             'start_position': positions[0],
             'end_position': positions[-1]
         }
+
+
+class SpeedStream:
+    """
+    串流速度分析：消費 TennisTracker.iter_track 的事件，每條軌跡結束時即計算其速度
+    """
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+        self.video_info = {}
+        self.trajectory_speeds = []
+        self.has_trajectories = False
+    
+    def consume(self, event):
+        kind = event['type']
+        if kind == 'start':
+            self.video_info = event['video_info']
+        elif kind == 'trajectory':
+            trajectory = event['trajectory']
+            self.has_trajectories = True
+            if trajectory and len(trajectory['positions']) > 2:
+                speeds = self.analyzer.calculate_trajectory_speed(trajectory, self.video_info['fps'])
+                self.trajectory_speeds.append({
+                    'trajectory_id': trajectory['id'],
+                    'speeds': speeds,
+                    'max_speed': max(speeds) if speeds else 0,
+                    'avg_speed': np.mean(speeds) if speeds else 0
+                })
+    
+    def result(self):
+        if not self.has_trajectories:
+            return self.analyzer.empty_result()
+        
+        # 軌跡依結束順序到達，依軌跡ID（起始順序）排列
+        trajectory_speeds = sorted(self.trajectory_speeds, key=lambda t: t['trajectory_id'])
+        return self.analyzer.summarize_speeds(trajectory_speeds, {'video_info': self.video_info})
@@ -2,12 +2,80 @@ import cv2
 import numpy as np
 from ultralytics import YOLO
 import os
-from collections import defaultdict
+import queue
+import tempfile
+import threading
+import time
+from itertools import islice
+from contextlib import nullcontext
+from ball_tracker import KalmanBallTracker
+from tracking_store import BallPositions
+from motion_gate import MotionGate
+from model_backends import normalize_backend, exported_model_path, export_model, engine_threads
+from quantization import quantized_model_path
+from sharded_tracking import ShardPool, track_sharded
+from frame_bus import read_video_info
+from frame_index import FrameIndex, open_at
+from video_writer import open_video_writer
+
+# 管線階段之間傳遞的結束標記
+_STAGE_END = object()
+
+
+def _put_until_stopped(stage_queue, item, stop_event):
+    """放入有界佇列；若下游已停止則放棄，避免執行緒永久阻塞"""
+    while not stop_event.is_set():
+        try:
+            stage_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+class _AnnotationWriter:
+    """
+    標註/編碼階段：在背景執行緒繪製檢測結果並寫入輸出影片
+    """
+    def __init__(self, tracker, out, queue_size):
+        self.tracker = tracker
+        self.out = out
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='annotate-encode', daemon=True)
+        self.thread.start()
+    
+    def write(self, frame, detections, frame_number):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((frame, detections, frame_number))
+    
+    def close(self):
+        self.queue.put(_STAGE_END)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+    
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STAGE_END:
+                break
+            # 發生錯誤後仍持續取出佇列內容，避免推論階段卡在 put()
+            if self.error is None:
+                try:
+                    frame, detections, frame_number = item
+                    self.out.write(self.tracker.draw_detections(frame, detections, frame_number, in_place=True))
+                except Exception as e:
+                    self.error = e
+
 
 class TennisTracker:
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, inference_client=None):
         """
         初始化網球追蹤器
+        inference_client: 批次推論伺服器的呼叫端（見 inference_server.py）；指定時不在本地載入模型，
+                          推論、類別過濾與信心門檻皆由伺服器端的模型設定決定
         """
         if model_path is None:
             # 允許透過環境變數覆寫模型路徑
@@ -15,7 +83,32 @@ class TennisTracker:
         
         self.model_path = model_path
         self.model = None
-        self.load_model()
+        # PyTorch 模型；匯出引擎的輸入形狀固定，某個尺寸的引擎無法使用時以此推論
+        self.torch_model = None
+        
+        # 批次推論大小（多幀一次送入模型，攤平每次呼叫的固定開銷；1 表示逐幀）
+        self.batch_size = max(1, int(os.getenv('INFERENCE_BATCH_SIZE', '1')))
+        
+        # 推論後端：torch，或匯出為固定輸入形狀的 onnx / openvino CPU 引擎
+        self.inference_backend = normalize_backend(os.getenv('INFERENCE_BACKEND', 'torch'))
+        self.inference_imgsz = max(32, int(os.getenv('INFERENCE_IMGSZ', '640')) // 32 * 32)
+        # 推論精度：int8 時載入以上傳影片校正的 INT8 量化模型（僅 onnx 後端）
+        self.inference_precision = os.getenv('INFERENCE_PRECISION', 'fp32').strip().lower()
+        if self.inference_precision == 'int8' and self.inference_backend != 'onnx':
+            print("INT8 量化模型僅支援 onnx 後端，改用 fp32")
+            self.inference_precision = 'fp32'
+        # ROI 模式：軌跡建立後只在預測位置附近裁切的視窗內推論（視窗邊長需為 32 的倍數）
+        # 固定形狀的後端需為此尺寸另外匯出引擎，須在載入模型前決定
+        self.roi_enabled = os.getenv('ROI_TRACKING', '0') == '1'
+        self.roi_size = max(32, int(os.getenv('ROI_SIZE', '320')) // 32 * 32)
+        
+        # 匯出引擎 {(輸入尺寸, 批次): 模型}：固定形狀的後端每種尺寸與批次需要各自的引擎；
+        # None 表示該組合無法匯出，改用 PyTorch 模型（批次 1 的引擎無法使用時改為補齊批次）
+        self.engines = {}
+        
+        self.inference_client = inference_client
+        if inference_client is None:
+            self.load_model()
         
         # 建立可接受的球類類別ID集合（預設涵蓋 COCO 球類 32..37 與 sports ball=37）
         self.accepted_class_ids = set([32, 33, 34, 35, 36, 37])
@@ -47,6 +140,41 @@ class TennisTracker:
         self.confidence_threshold = float(os.getenv('CONFIDENCE_THRESHOLD', '0.3'))
         self.max_disappeared = 10
         
+        if inference_client is not None:
+            # 沿用伺服器端模型的設定，結果快取鍵值才與本地推論一致
+            info = inference_client.describe()
+            self.model_path = info['model_path']
+            self.inference_backend = info['backend']
+            self.inference_precision = info['precision']
+            self.inference_imgsz = info['imgsz']
+            self.accepted_class_ids = set(info['classes'])
+            self.confidence_threshold = info['confidence_threshold']
+        
+        # 管線模式：解碼、推論、標註/編碼分別在不同執行緒執行，以有界佇列銜接
+        self.pipeline_enabled = os.getenv('TRACK_PIPELINE', '0') == '1'
+        self.pipeline_queue_size = max(1, int(os.getenv('PIPELINE_QUEUE_SIZE', '8')))
+        
+        # 關鍵幀間隔檢測：每 N 幀執行一次模型，中間幀以運動模型插值（1 表示逐幀檢測）
+        self.detection_stride = max(1, int(os.getenv('DETECTION_STRIDE', '1')))
+        # 運動模型預測與實際檢測的最大允許偏差（像素），超過即回退為逐幀檢測
+        self.stride_max_error = float(os.getenv('STRIDE_MAX_ERROR', '20'))
+        
+        # 幀差預篩：畫面中沒有像球的移動時跳過推論並沿用上一幀結果
+        self.motion_gate_enabled = os.getenv('MOTION_GATE', '0') == '1'
+        self.motion_gate_max_skip = max(1, int(os.getenv('MOTION_GATE_MAX_SKIP', '15')))
+        
+        # 分段模式：單一影片切成數段由多個行程平行處理（1 表示不分段）
+        self.shards = max(1, int(os.getenv('TRACK_SHARDS', '1')))
+        # 每段向前多處理的幀數，讓依賴前幾幀的檢測狀態在段首收斂
+        self.shard_overlap = max(0, int(os.getenv('SHARD_OVERLAP', '30')))
+        # 常駐的分段追蹤行程池 {行程數: ShardPool}，第一次分段追蹤時啟動，之後重複使用
+        self.shard_pools = {}
+        
+        # 預熱：第一次推論需要初始化執行緒池與記憶體配置，先在載入時完成（推論伺服器已自行預熱）
+        # MODEL_WARMUP_RUNS=0 時不在載入時推論（預先載入後 fork 的主行程不可先啟動運算執行緒池，改由子行程預熱）
+        if inference_client is None:
+            self.warmup(int(os.getenv('MODEL_WARMUP_RUNS', '2')))
+        
     def load_model(self):
         """載入YOLO模型"""
         try:
@@ -64,123 +192,773 @@ class TennisTracker:
             print(f"載入模型失敗: {e}")
             # 使用預設模型作為備選
             self.model = YOLO('yolov8n.pt')
+        self.torch_model = self.model
+        
+        if self.inference_precision == 'int8':
+            self.check_quantized_models()
+        
+        if self.inference_backend != 'torch':
+            exported = self.engine(self.inference_imgsz, self.batch_size)
+            if exported is not None:
+                self.model = exported
+            else:
+                # 主要尺寸無法匯出時整個追蹤器改用 PyTorch 模型
+                self.inference_backend = 'torch'
+                self.inference_precision = 'fp32'
+    
+    def check_quantized_models(self):
+        """
+        INT8 模型需事先以上傳影片校正產生（python setup_models.py --int8），載入時不自動量化；
+        缺少任何需要的輸入尺寸時拋出 FileNotFoundError，不默默退回 FP32
+        """
+        sizes = [self.inference_imgsz]
+        if self.roi_enabled:
+            sizes.append(self.roi_size)
+        batches = sorted({1, self.batch_size})
+        paths = [
+            quantized_model_path(self.model_path, imgsz, batch)
+            for imgsz in sorted(set(sizes)) for batch in batches
+        ]
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(
+                f"找不到 INT8 量化模型: {', '.join(missing)}；請先執行 python setup_models.py --int8"
+            )
+    
+    def engine(self, imgsz, batch):
+        """取得指定輸入尺寸與批次的匯出引擎，第一次使用時載入；無法使用時回傳 None（只嘗試一次）"""
+        key = (imgsz, batch)
+        if key not in self.engines:
+            self.engines[key] = self.load_exported_model(imgsz, batch)
+        return self.engines[key]
+    
+    def shard_pool(self, workers):
+        """取得分段追蹤的常駐行程池，同一追蹤器的每次分段追蹤共用，模型只載入一次"""
+        if workers not in self.shard_pools:
+            self.shard_pools[workers] = ShardPool(self.model_path, workers)
+        return self.shard_pools[workers]
+    
+    def load_exported_model(self, imgsz, batch=None):
+        """
+        載入（fp32 時必要時先匯出）指定輸入尺寸與批次的 onnx / openvino 模型，失敗時回傳 None
+        """
+        batch = batch or self.batch_size
+        try:
+            if self.inference_precision == 'int8':
+                path = quantized_model_path(self.model_path, imgsz, batch)
+            else:
+                path = exported_model_path(self.model_path, self.inference_backend, imgsz, batch)
+                if not os.path.exists(path):
+                    path = export_model(self.model_path, self.inference_backend, imgsz, batch)
+            model = YOLO(path, task='detect')
+            print(f"已載入 {self.inference_backend} ({self.inference_precision}) 推論模型: {path}")
+            return model
+        except Exception as e:
+            print(f"載入 {self.inference_backend} 模型失敗（輸入尺寸 {imgsz}，批次 {batch}）: {e}")
+            return None
+    
+    def warmup(self, runs=2):
+        """以空白影像執行數次推論，讓第一個真正的請求不必負擔初始化成本"""
+        if runs <= 0:
+            return
+        try:
+            # ROI 模式下視窗推論使用另一個輸入尺寸，一併預熱
+            sizes = [None]
+            if self.roi_enabled:
+                sizes.append(self.roi_size)
+            start = time.perf_counter()
+            for imgsz in sizes:
+                size = imgsz or self.inference_imgsz
+                dummy = np.zeros((size, size, 3), dtype=np.uint8)
+                for _ in range(runs):
+                    self.detect_tennis_ball_batch([dummy] * self.batch_size, imgsz=imgsz)
+                    # 關鍵幀與 ROI 視窗常是單幀推論，匯出後端另有批次 1 的引擎
+                    if self.batch_size > 1:
+                        self.detect_tennis_ball_batch([dummy], imgsz=imgsz)
+            print(f"模型預熱完成 ({self.inference_backend}, {time.perf_counter() - start:.2f}s)")
+        except Exception as e:
+            print(f"模型預熱失敗: {e}")
+
+    def analysis_params(self):
+        """
+        影響追蹤結果的設定（結果快取的鍵值的一部分）
+        批次大小、管線模式與分段數只影響速度，不列入
+        """
+        return {
+            'model_path': os.path.basename(self.model_path),
+            'backend': self.inference_backend,
+            'precision': self.inference_precision,
+            'imgsz': self.inference_imgsz,
+            'classes': sorted(self.accepted_class_ids),
+            'confidence_threshold': self.confidence_threshold,
+            'max_disappeared': self.max_disappeared,
+            'detection_stride': self.detection_stride,
+            'stride_max_error': self.stride_max_error,
+            'roi': self.roi_size if self.roi_enabled else None,
+            'motion_gate': self.motion_gate_max_skip if self.motion_gate_enabled else None
+        }
+
+    def predict(self, images, imgsz=None):
+        """
+        依推論後端執行模型，回傳與輸入順序一致的 Ultralytics 結果
+        固定形狀的匯出模型只接受固定批次：完整的批次送入批次引擎，剩下不足一批的影像逐張送入批次 1 的引擎
+        （關鍵幀、ROI 視窗與幀差預篩後的少量幀不必補齊成整批）
+        """
+        images = list(images)
+        if self.inference_backend == 'torch':
+            kwargs = {'imgsz': imgsz} if imgsz else {}
+            return self._run_model(self.torch_model, images, **kwargs)
+        
+        imgsz = imgsz or self.inference_imgsz
+        # 匯出失敗的尺寸之後直接使用 PyTorch 模型，其他尺寸仍使用匯出引擎
+        model = self.engine(imgsz, self.batch_size)
+        if model is None:
+            return self._run_model(self.torch_model, images, imgsz=imgsz)
+        
+        single = None
+        if self.batch_size > 1 and len(images) % self.batch_size:
+            single = self.engine(imgsz, 1)
+        return self.run_fixed_batch(model, images, imgsz, single)
+    
+    def run_fixed_batch(self, model, images, imgsz, single=None):
+        """
+        以固定批次執行匯出模型；不足一批的尾端逐張送入 single（批次 1 的引擎），
+        未提供 single 時以最後一張影像補齊並丟棄補齊的結果
+        """
+        results = []
+        full = len(images) - len(images) % self.batch_size if single is not None else len(images)
+        for start in range(0, full, self.batch_size):
+            chunk = images[start:start + self.batch_size]
+            padded = chunk + [chunk[-1]] * (self.batch_size - len(chunk))
+            results.extend(self._run_model(model, padded, imgsz=imgsz)[:len(chunk)])
+        for image in images[full:]:
+            results.extend(self._run_model(single, [image], imgsz=imgsz))
+        return results
+    
+    def _run_model(self, model, images, **kwargs):
+        # 匯出引擎在第一次推論時建立執行階段，建立時套用本行程的執行緒上限
+        setup = nullcontext()
+        if model is not self.torch_model and getattr(model, 'predictor', None) is None:
+            setup = engine_threads(self.inference_backend)
+        # 類別與信心門檻交給模型在 NMS 階段過濾，避免產生大量人物等無關框
+        with setup:
+            return model(
+                images,
+                verbose=False,
+                classes=sorted(self.accepted_class_ids),
+                conf=self.confidence_threshold,
+                **kwargs
+            )
     
     def detect_tennis_ball(self, frame):
         """
         在單一幀中檢測網球
         """
-        results = self.model(frame, verbose=False)
-        detections = []
-        
-        for result in results:
-            boxes = result.boxes
-            if boxes is not None:
-                for box in boxes:
-                    # 檢查是否為網球或運動球類
-                    class_id = int(box.cls[0])
-                    confidence = float(box.conf[0])
-                    
-                    # 擴展檢測範圍，包含球類物體
-                    if (class_id in self.accepted_class_ids) and confidence > self.confidence_threshold:
-                        
-                        x1, y1, x2, y2 = box.xyxy[0].tolist()
-                        center_x = (x1 + x2) / 2
-                        center_y = (y1 + y2) / 2
-                        width = x2 - x1
-                        height = y2 - y1
-                        
-                        detections.append({
-                            'center': (center_x, center_y),
-                            'bbox': (x1, y1, x2, y2),
-                            'confidence': confidence,
-                            'size': (width, height)
-                        })
-        
-        return detections
-    
-    def track_ball(self, video_path, output_path=None):
+        return self.detect_tennis_ball_batch([frame])[0]
+    
+    def detect_tennis_ball_batch(self, frames, imgsz=None):
+        """
+        批次檢測多幀中的網球，回傳與輸入幀順序一致的檢測列表
+        imgsz: 模型輸入尺寸，未指定時使用模型預設值
+        """
+        if self.inference_client is not None:
+            return self.inference_client.detect(frames, imgsz)
+        results = self.predict(frames, imgsz)
+        return [self.parse_detections(result) for result in results]
+    
+    def parse_detections(self, result):
+        """
+        將單幀的模型輸出轉為網球檢測列表
+        整批框一次取出為陣列並以遮罩過濾，最後才轉成 Python 物件
+        """
+        boxes = result.boxes
+        if boxes is None or len(boxes) == 0:
+            return []
+        
+        # data 欄位: x1, y1, x2, y2, confidence, class_id
+        data = boxes.data.cpu().numpy()
+        class_ids = data[:, 5].astype(np.int64)
+        confidences = data[:, 4]
+        
+        # 檢查是否為網球或運動球類，且信心分數超過門檻
+        keep = np.isin(class_ids, list(self.accepted_class_ids)) & (confidences > self.confidence_threshold)
+        if not keep.any():
+            return []
+        
+        bboxes = data[keep, :4].astype(np.float64)
+        centers = (bboxes[:, :2] + bboxes[:, 2:]) / 2
+        sizes = bboxes[:, 2:] - bboxes[:, :2]
+        
+        return [
+            {
+                'center': tuple(center),
+                'bbox': tuple(bbox),
+                'confidence': confidence,
+                'size': tuple(size)
+            }
+            for bbox, center, size, confidence in zip(
+                bboxes.tolist(), centers.tolist(), sizes.tolist(), confidences[keep].tolist()
+            )
+        ]
+    
+    def track_ball(self, video_path, output_path=None, batch_size=None, pipelined=None, stride=None, roi=None,
+                   motion_gate=None, consumers=None, shards=None, bus=None):
         """
         追蹤整個影片中的網球
+        batch_size: 每次送入模型的幀數，未指定時使用 INFERENCE_BATCH_SIZE 設定
+        pipelined: 是否啟用解碼/推論/編碼管線，未指定時使用 TRACK_PIPELINE 設定
+        stride: 關鍵幀檢測間隔，未指定時使用 DETECTION_STRIDE 設定
+        roi: 是否只在預測位置附近的視窗內檢測，未指定時使用 ROI_TRACKING 設定
+        motion_gate: 是否以幀差預篩跳過沒有球移動的幀，未指定時使用 MOTION_GATE 設定
+        consumers: 具有 consume(event) 方法的物件，追蹤過程中即時收到 iter_track 的每個事件
+        shards: 分段平行處理的行程數，未指定時使用 TRACK_SHARDS 設定
+        bus: FrameBus，由匯流排解碼並同時分派給其他已訂閱的分析器（此時不分段）
+        """
+        consumers = consumers or []
+        if shards is None:
+            shards = self.shards
+        if shards > 1 and bus is None:
+            tracking_results = track_sharded(
+                self, video_path, output_path, shards, self.shard_overlap, batch_size, stride, roi, motion_gate
+            )
+            # 分段模式在全部完成後才有結果，依事件順序補送給 consumers
+            for event in self.replay_events(tracking_results):
+                for consumer in consumers:
+                    consumer.consume(event)
+            return tracking_results
+        
+        tracking_results = None
+        
+        for event in self.iter_track(video_path, output_path, batch_size, pipelined, stride, roi, motion_gate, bus):
+            for consumer in consumers:
+                consumer.consume(event)
+            
+            if event['type'] == 'frame':
+                tracking_results['ball_positions'].append(
+                    event['frame_number'], event['timestamp'], event['detections']
+                )
+            elif event['type'] == 'trajectory':
+                tracking_results['trajectories'].append(event['trajectory'])
+            elif event['type'] == 'start':
+                # 初始化追蹤結果
+                tracking_results = {
+                    'video_info': event['video_info'],
+                    'ball_positions': BallPositions(),
+                    'trajectories': []
+                }
+        
+        # 軌跡依結束順序產生，依軌跡ID（即起始順序）排序
+        tracking_results['trajectories'].sort(key=lambda trajectory: trajectory['id'])
+        
+        print(f"追蹤完成，共檢測到 {tracking_results['ball_positions'].frames_with_detections()} 幀包含網球")
+        
+        return tracking_results
+    
+    def iter_track(self, video_path, output_path=None, batch_size=None, pipelined=None, stride=None, roi=None,
+                   motion_gate=None, bus=None):
+        """
+        串流追蹤：邊解碼邊產出事件，下游不需等待整段影片處理完
+        參數同 track_ball。事件依序為：
+            {'type': 'start', 'video_info': {...}}
+            {'type': 'trajectory', 'trajectory': {...}}  軌跡結束時產出，格式同 analyze_single_trajectory
+            {'type': 'frame', 'frame_number', 'timestamp', 'detections', 'settled_before'}
+                settled_before: 小於此幀號的幀已不會再被任何軌跡涵蓋
+            {'type': 'end', 'video_info': {...}, 'frames_processed': n}
+                結束時 video_info 會補上 skipped_frames（幀差預篩跳過推論的幀數）
         """
+        if bus is not None:
+            video_path = bus.video_path
         print(f"開始追蹤網球: {video_path}")
         
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            raise ValueError(f"無法開啟影片: {video_path}")
+        if batch_size is None:
+            batch_size = self.batch_size
+        batch_size = max(1, int(batch_size))
+        if pipelined is None:
+            pipelined = self.pipeline_enabled
+        if stride is None:
+            stride = self.detection_stride
+        stride = max(1, int(stride))
+        if roi is None:
+            roi = self.roi_enabled
+        if motion_gate is None:
+            motion_gate = self.motion_gate_enabled
+        # 佇列至少要容納一整批，推論階段才不會等待解碼
+        queue_size = max(self.pipeline_queue_size, 2 * batch_size)
+        
+        # 使用匯流排時由匯流排解碼，不另外開啟影片
+        if bus is not None:
+            cap = None
+            source = bus.frames()
+            video_info = dict(bus.video_info)
+        else:
+            cap = cv2.VideoCapture(video_path)
+            if not cap.isOpened():
+                raise ValueError(f"無法開啟影片: {video_path}")
+            source = self._iter_frames(cap)
+            video_info = read_video_info(cap)
         
         # 獲取影片資訊
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        
-        # 初始化追蹤結果
-        tracking_results = {
-            'video_info': {
-                'fps': fps,
-                'width': width,
-                'height': height,
-                'total_frames': total_frames
-            },
-            'ball_positions': [],
-            'trajectories': []
-        }
+        fps = video_info['fps']
+        width = video_info['width']
+        height = video_info['height']
+        total_frames = video_info['total_frames']
         
-        # 設置輸出影片
+        # 設置輸出影片（有 ffmpeg 時直接編碼為 H.264，不需事後轉碼）
+        out = None
+        writer = None
         if output_path:
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+            out = open_video_writer(output_path, fps, (width, height))
+            video_info['output_codec'] = out.codec
+            if pipelined:
+                writer = _AnnotationWriter(self, out, queue_size)
         
+        frames = self._iter_frames_pipelined(source, queue_size) if pipelined else source
+        tracker = KalmanBallTracker(max_disappeared=self.max_disappeared)
+        gate = MotionGate(max_skip=self.motion_gate_max_skip) if motion_gate else None
+        stats = {'skipped_frames': 0}
         frame_count = 0
-        ball_tracks = defaultdict(list)
-        current_track_id = 0
         
         print(f"處理 {total_frames} 幀...")
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # 檢測網球
-            detections = self.detect_tennis_ball(frame)
-            
-            frame_data = {
-                'frame_number': frame_count,
-                'timestamp': frame_count / fps,
-                'detections': detections
-            }
+        try:
+            yield {'type': 'start', 'video_info': video_info}
             
-            tracking_results['ball_positions'].append(frame_data)
+            for frame, detections in self._iter_detections(frames, batch_size, stride, roi, gate, stats):
+                timestamp = frame_count / fps
+                
+                # 繪製檢測結果
+                if writer is not None:
+                    writer.write(frame, detections, frame_count)
+                elif out is not None:
+                    annotated_frame = self.draw_detections(frame, detections, frame_count, in_place=True)
+                    out.write(annotated_frame)
+                
+                # 逐幀更新軌跡，結束的軌跡立即分析並產出
+                finished = tracker.update(
+                    frame_count,
+                    timestamp,
+                    [d['center'] for d in detections],
+                    [d['confidence'] for d in detections],
+                    [d.get('interpolated', False) for d in detections]
+                )
+                for track_id, points in finished:
+                    yield {'type': 'trajectory', 'trajectory': self.analyze_single_trajectory(points, track_id)}
+                
+                # 結束的軌跡已先產出，settled_before 之前的幀不會再有新的軌跡資料
+                earliest_open = tracker.earliest_open_frame()
+                yield {
+                    'type': 'frame',
+                    'frame_number': frame_count,
+                    'timestamp': timestamp,
+                    'detections': detections,
+                    'settled_before': frame_count + 1 if earliest_open is None else earliest_open
+                }
+                
+                frame_count += 1
+                
+                # 進度顯示
+                if frame_count % 30 == 0:
+                    progress = (frame_count / total_frames) * 100
+                    print(f"處理進度: {progress:.1f}%")
             
-            # 繪製檢測結果
-            if output_path:
-                annotated_frame = self.draw_detections(frame, detections, frame_count)
-                out.write(annotated_frame)
+            # 處理影片結束時仍在追蹤中的軌跡
+            for track_id, points in tracker.finish():
+                yield {'type': 'trajectory', 'trajectory': self.analyze_single_trajectory(points, track_id)}
             
-            frame_count += 1
+            video_info['skipped_frames'] = stats['skipped_frames']
+            if gate is not None:
+                print(f"幀差預篩共跳過 {stats['skipped_frames']} 幀推論")
             
-            # 進度顯示
-            if frame_count % 30 == 0:
-                progress = (frame_count / total_frames) * 100
-                print(f"處理進度: {progress:.1f}%")
+            yield {'type': 'end', 'video_info': video_info, 'frames_processed': frame_count}
+        finally:
+            frames.close()
+            source.close()
+            if writer is not None:
+                writer.close()
+            if cap is not None:
+                cap.release()
+            if out is not None:
+                out.release()
+    
+    def replay_events(self, tracking_results):
+        """由完整的追蹤結果產生與 iter_track 相同格式的事件"""
+        video_info = tracking_results['video_info']
+        yield {'type': 'start', 'video_info': video_info}
+        for trajectory in tracking_results['trajectories']:
+            yield {'type': 'trajectory', 'trajectory': trajectory}
+        
+        ball_positions = tracking_results['ball_positions']
+        for frame_data in ball_positions:
+            yield dict(frame_data, type='frame', settled_before=frame_data['frame_number'] + 1)
+        yield {'type': 'end', 'video_info': video_info, 'frames_processed': len(ball_positions)}
+    
+    def detect_range(self, video_path, decode_start, start, end=None, output_path=None, batch_size=None,
+                     stride=None, roi=None, motion_gate=None):
+        """
+        檢測影片中 [start, end) 的幀（分段模式的工作單位），end 為 None 時讀到檔尾
+        從 decode_start 開始解碼並檢測，start 之前的幀只用於讓檢測狀態收斂，結果丟棄
+        回傳 {'ball_positions': BallPositions.to_arrays(), 'skipped_frames': n, 'output_codec': 編碼格式或 None}
+        """
+        if batch_size is None:
+            batch_size = self.batch_size
+        batch_size = max(1, int(batch_size))
+        stride = max(1, int(self.detection_stride if stride is None else stride))
+        if roi is None:
+            roi = self.roi_enabled
+        if motion_gate is None:
+            motion_gate = self.motion_gate_enabled
         
-        cap.release()
+        # 有幀索引時先跳到最近的關鍵幀再略過剩餘的幀
+        cap = open_at(video_path, decode_start, FrameIndex.load(video_path))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        
+        out = None
         if output_path:
-            out.release()
+            size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            out = open_video_writer(output_path, fps, size)
         
-        # 分析軌跡
-        tracking_results['trajectories'] = self.analyze_trajectories(tracking_results['ball_positions'])
+        frames = self._iter_frames(cap)
+        limited = islice(frames, None if end is None else max(0, end - decode_start))
+        gate = MotionGate(max_skip=self.motion_gate_max_skip) if motion_gate else None
+        stats = {'skipped_frames': 0}
+        skipped_before = 0
+        ball_positions = BallPositions()
+        frame_number = decode_start
         
-        print(f"追蹤完成，共檢測到 {len([p for p in tracking_results['ball_positions'] if p['detections']])} 幀包含網球")
+        try:
+            for frame, detections in self._iter_detections(limited, batch_size, stride, roi, gate, stats):
+                if frame_number == start:
+                    skipped_before = stats['skipped_frames']
+                if frame_number >= start:
+                    ball_positions.append(frame_number, frame_number / fps, detections)
+                    if out is not None:
+                        out.write(self.draw_detections(frame, detections, frame_number, in_place=True))
+                frame_number += 1
+        finally:
+            frames.close()
+            cap.release()
+            if out is not None:
+                out.release()
         
-        return tracking_results
+        print(f"分段 [{start}, {frame_number}) 檢測完成")
+        return {
+            'ball_positions': ball_positions.to_arrays(),
+            'skipped_frames': stats['skipped_frames'] - skipped_before,
+            'output_codec': out.codec if out is not None else None
+        }
+    
+    def _iter_frames(self, cap):
+        """
+        逐幀解碼影片
+        """
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame
+    
+    def _iter_frames_pipelined(self, source, queue_size):
+        """
+        解碼階段：在背景執行緒讀取影片（source 為逐幀產生器），透過有界佇列交給推論階段
+        """
+        frame_queue = queue.Queue(maxsize=queue_size)
+        stop_event = threading.Event()
+        errors = []
+        
+        def decode():
+            try:
+                for frame in source:
+                    if not _put_until_stopped(frame_queue, frame, stop_event):
+                        return
+            except Exception as e:
+                errors.append(e)
+            _put_until_stopped(frame_queue, _STAGE_END, stop_event)
+        
+        decoder = threading.Thread(target=decode, name='video-decoder', daemon=True)
+        decoder.start()
+        try:
+            while True:
+                frame = frame_queue.get()
+                if frame is _STAGE_END:
+                    break
+                yield frame
+            if errors:
+                raise errors[0]
+        finally:
+            stop_event.set()
+            decoder.join()
+    
+    def _iter_detections(self, frames, batch_size, stride=1, roi=False, gate=None, stats=None):
+        """
+        推論階段：將幀湊成批次送入模型，依原順序產出 (幀, 檢測結果)
+        間隔模式優先於 ROI 模式（關鍵幀之間的距離太遠，預測視窗不可靠），
+        兩者皆未啟用時才套用幀差預篩 gate
+        """
+        if stride > 1:
+            yield from self._iter_detections_strided(frames, batch_size, stride)
+            return
+        if roi:
+            yield from self._iter_detections_roi(frames, batch_size)
+            return
+        
+        state = {'previous': []}
+        pending = []
+        for frame in frames:
+            # 預篩只看上一個已知結果；同批尚未推論的幀不影響判斷
+            infer = gate is None or gate.should_infer(frame, bool(state['previous']))
+            pending.append((frame, infer))
+            if len(pending) >= batch_size:
+                yield from self._resolve_gated_batch(pending, state, stats)
+                pending = []
+        
+        if pending:
+            yield from self._resolve_gated_batch(pending, state, stats)
+    
+    def _resolve_gated_batch(self, pending, state, stats):
+        """
+        只對需要推論的幀批次檢測，被預篩跳過的幀沿用前一幀的結果
+        """
+        inferred_frames = [frame for frame, infer in pending if infer]
+        results = iter(self.detect_tennis_ball_batch(inferred_frames) if inferred_frames else [])
+        
+        for frame, infer in pending:
+            if infer:
+                detections = next(results)
+            else:
+                detections = list(state['previous'])
+                if stats is not None:
+                    stats['skipped_frames'] += 1
+            state['previous'] = detections
+            yield frame, detections
+    
+    def _iter_detections_roi(self, frames, batch_size):
+        """
+        ROI 模式：軌跡建立後，依等速模型預測球的位置並只對周圍視窗推論，
+        檢測框再映射回全幀座標。視窗內未命中時改以全幀重新捕捉；
+        連續消失超過 max_disappeared 幀則放棄軌跡，回到全幀搜尋。
+        """
+        roi_state = {'center': None, 'velocity': (0.0, 0.0), 'hits': 0, 'disappeared': 0}
+        pending_frames = []
+        for frame in frames:
+            pending_frames.append(frame)
+            if len(pending_frames) >= batch_size:
+                yield from self._detect_roi_batch(pending_frames, roi_state)
+                pending_frames = []
+        
+        if pending_frames:
+            yield from self._detect_roi_batch(pending_frames, roi_state)
+    
+    def _detect_roi_batch(self, frames, roi_state):
+        """
+        以批次開始前的軌跡狀態外插每幀的視窗，批次推論後依序更新狀態
+        """
+        frame_detections = [None] * len(frames)
+        
+        windows = [self._predict_roi_window(frame.shape, roi_state, offset)
+                   for offset, frame in enumerate(frames, start=1)]
+        roi_indices = [i for i, window in enumerate(windows) if window is not None]
+        if roi_indices:
+            crops = []
+            for i in roi_indices:
+                x1, y1, x2, y2 = windows[i]
+                crops.append(np.ascontiguousarray(frames[i][y1:y2, x1:x2]))
+            crop_detections = self.detect_tennis_ball_batch(crops, imgsz=self.roi_size)
+            for i, detections in zip(roi_indices, crop_detections):
+                if detections:
+                    x1, y1 = windows[i][:2]
+                    frame_detections[i] = [self._offset_detection(d, x1, y1) for d in detections]
+        
+        # 尚未建立軌跡或視窗內未命中的幀，以全幀檢測
+        full_indices = [i for i, detections in enumerate(frame_detections) if detections is None]
+        if full_indices:
+            full_detections = self.detect_tennis_ball_batch([frames[i] for i in full_indices])
+            for i, detections in zip(full_indices, full_detections):
+                frame_detections[i] = detections
+        
+        for frame, detections in zip(frames, frame_detections):
+            self._update_roi_state(roi_state, detections)
+            yield frame, detections
+    
+    def _predict_roi_window(self, frame_shape, roi_state, offset):
+        """
+        預測 offset 幀後球的位置並回傳裁切視窗 (x1, y1, x2, y2)；無法預測時回傳 None
+        """
+        if roi_state['center'] is None or roi_state['hits'] < 2 or roi_state['disappeared'] > 0:
+            return None
+        
+        height, width = frame_shape[:2]
+        size = self.roi_size
+        if size >= width or size >= height:
+            return None
+        
+        center_x = roi_state['center'][0] + roi_state['velocity'][0] * offset
+        center_y = roi_state['center'][1] + roi_state['velocity'][1] * offset
+        x1 = min(max(0, int(round(center_x - size / 2))), width - size)
+        y1 = min(max(0, int(round(center_y - size / 2))), height - size)
+        return (x1, y1, x1 + size, y1 + size)
     
-    def draw_detections(self, frame, detections, frame_number):
+    def _update_roi_state(self, roi_state, detections):
+        """
+        依本幀檢測結果更新 ROI 軌跡狀態
+        """
+        best = self._best_detection(detections)
+        if best is None:
+            if roi_state['center'] is not None:
+                roi_state['disappeared'] += 1
+                if roi_state['disappeared'] > self.max_disappeared:
+                    roi_state.update({'center': None, 'velocity': (0.0, 0.0), 'hits': 0, 'disappeared': 0})
+            return
+        
+        if roi_state['center'] is None:
+            roi_state['velocity'] = (0.0, 0.0)
+            roi_state['hits'] = 1
+        else:
+            gap = roi_state['disappeared'] + 1
+            roi_state['velocity'] = (
+                (best['center'][0] - roi_state['center'][0]) / gap,
+                (best['center'][1] - roi_state['center'][1]) / gap
+            )
+            roi_state['hits'] += 1
+        roi_state['center'] = best['center']
+        roi_state['disappeared'] = 0
+    
+    def _offset_detection(self, detection, offset_x, offset_y):
+        """將視窗座標的檢測映射回全幀座標"""
+        x1, y1, x2, y2 = detection['bbox']
+        center_x, center_y = detection['center']
+        mapped = dict(detection)
+        mapped['bbox'] = (x1 + offset_x, y1 + offset_y, x2 + offset_x, y2 + offset_y)
+        mapped['center'] = (center_x + offset_x, center_y + offset_y)
+        return mapped
+    
+    def _iter_detections_strided(self, frames, batch_size, stride):
+        """
+        關鍵幀間隔檢測：每 stride 幀執行一次模型，中間幀依運動模型插值。
+        預測與關鍵幀檢測偏離時（例如擊球、落地）回退為逐幀檢測，
+        直到逐幀結果再次符合運動模型為止。
+        """
+        # 一開始沒有速度估計，先以逐幀模式建立運動模型
+        state = {'last_key': None, 'velocity': None, 'dense': True}
+        segment = []
+        first_frame = True
+        
+        for frame in frames:
+            if first_frame:
+                # 第一幀作為初始關鍵幀
+                detections = self.detect_tennis_ball(frame)
+                state['last_key'] = self._best_detection(detections)
+                first_frame = False
+                yield frame, detections
+                continue
+            
+            segment.append(frame)
+            if len(segment) >= stride:
+                yield from self._resolve_stride_segment(segment, state, batch_size)
+                segment = []
+        
+        # 影片結尾不足一個間隔的幀，以最後一幀作為關鍵幀
+        if segment:
+            yield from self._resolve_stride_segment(segment, state, batch_size)
+    
+    def _resolve_stride_segment(self, segment, state, batch_size):
+        """
+        處理兩個關鍵幀之間的一段幀，segment 的最後一幀為新的關鍵幀
+        """
+        span = len(segment)
+        key_detections = self.detect_tennis_ball(segment[-1])
+        prev_key = state['last_key']
+        key = self._best_detection(key_detections)
+        
+        if not state['dense'] and self._stride_prediction_holds(prev_key, key, state['velocity'], span):
+            # 運動模型可信：中間幀直接插值
+            inner_detections = []
+            for i in range(1, span):
+                if key is None:
+                    inner_detections.append([])
+                else:
+                    inner_detections.append([self._interpolate_detection(prev_key, key, i / span)])
+        else:
+            # 預測偏離：回退為逐幀檢測，並以實際結果檢查是否可回到間隔模式
+            inner_detections = []
+            inner_frames = segment[:-1]
+            for start in range(0, len(inner_frames), batch_size):
+                inner_detections.extend(self.detect_tennis_ball_batch(inner_frames[start:start + batch_size]))
+            state['dense'] = not self._segment_follows_motion(prev_key, inner_detections + [key_detections], span)
+        
+        if prev_key is not None and key is not None:
+            state['velocity'] = (
+                (key['center'][0] - prev_key['center'][0]) / span,
+                (key['center'][1] - prev_key['center'][1]) / span
+            )
+        else:
+            state['velocity'] = None
+        state['last_key'] = key
+        
+        yield from zip(segment, inner_detections + [key_detections])
+    
+    def _best_detection(self, detections):
+        """取最可信的檢測，無檢測時回傳 None"""
+        if not detections:
+            return None
+        return max(detections, key=lambda x: x['confidence'])
+    
+    def _stride_prediction_holds(self, prev_key, key, velocity, span):
+        """
+        以等速運動模型預測新關鍵幀的位置，檢查是否與實際檢測相符
+        """
+        if prev_key is None and key is None:
+            # 前後關鍵幀皆無球（例如死球時間），視為穩定
+            return True
+        if prev_key is None or key is None or velocity is None:
+            return False
+        
+        predicted_x = prev_key['center'][0] + velocity[0] * span
+        predicted_y = prev_key['center'][1] + velocity[1] * span
+        error = np.hypot(key['center'][0] - predicted_x, key['center'][1] - predicted_y)
+        return error <= self.stride_max_error
+    
+    def _segment_follows_motion(self, prev_key, segment_detections, span):
+        """
+        檢查逐幀檢測結果是否能由前後關鍵幀之間的插值解釋
+        """
+        if prev_key is None:
+            return not any(segment_detections)
+        
+        key = self._best_detection(segment_detections[-1])
+        if key is None:
+            return False
+        
+        for i, detections in enumerate(segment_detections[:-1], start=1):
+            best = self._best_detection(detections)
+            if best is None:
+                return False
+            expected = self._interpolate_detection(prev_key, key, i / span)['center']
+            if np.hypot(best['center'][0] - expected[0], best['center'][1] - expected[1]) > self.stride_max_error:
+                return False
+        
+        return True
+    
+    def _interpolate_detection(self, start, end, alpha):
+        """
+        在兩個關鍵幀檢測之間線性插值，產生標記為插值的檢測
+        """
+        def lerp(a, b):
+            return tuple(x + (y - x) * alpha for x, y in zip(a, b))
+        
+        return {
+            'center': lerp(start['center'], end['center']),
+            'bbox': lerp(start['bbox'], end['bbox']),
+            'confidence': min(start['confidence'], end['confidence']),
+            'size': lerp(start['size'], end['size']),
+            'interpolated': True
+        }
+    
+    def draw_detections(self, frame, detections, frame_number, in_place=False):
         """
         在幀上繪製檢測結果
+        in_place: 直接畫在傳入的幀上（幀已不再被其他階段使用時），省去每幀複製
         """
-        annotated_frame = frame.copy()
+        annotated_frame = frame if in_place else frame.copy()
         
         for detection in detections:
             x1, y1, x2, y2 = detection['bbox']
@@ -204,37 +982,78 @@ class TennisTracker:
         
         return annotated_frame
     
+    def render_video(self, video_path, ball_positions, output_path, start_frame=0, end_frame=None, index=None):
+        """
+        由已儲存的檢測結果重新解碼影片並繪製標註影片（延遲產生處理後影片用）
+        先寫入同目錄下唯一命名的暫存檔，完成後才替換為 output_path，避免讀到未完成的影片；
+        多個行程同時繪製也不會寫到同一個暫存檔，失敗時刪除暫存檔
+        片段分析的結果只繪製 [start_frame, end_frame)，幀號從片段起點算起
+        回傳輸出影片的編碼格式
+        """
+        ball_positions = BallPositions.ensure(ball_positions)
+        cap = open_at(video_path, start_frame, index)
+        
+        video_info = read_video_info(cap)
+        root, ext = os.path.splitext(output_path)
+        fd, tmp_output = tempfile.mkstemp(suffix=ext, prefix=os.path.basename(root) + '_rendering_',
+                                          dir=os.path.dirname(output_path) or '.')
+        os.close(fd)
+        # mkstemp 建立的檔案權限為 0600，改回一般輸出檔的權限
+        os.chmod(tmp_output, 0o644)
+        frame_count = 0
+        
+        print(f"繪製標註影片: {output_path}")
+        try:
+            out = open_video_writer(tmp_output, video_info['fps'], (video_info['width'], video_info['height']))
+            codec = out.codec
+            try:
+                frames = self._iter_frames(cap)
+                if end_frame is not None:
+                    frames = islice(frames, max(0, end_frame - start_frame))
+                for frame in frames:
+                    detections = ball_positions[frame_count]['detections'] if frame_count < len(ball_positions) else []
+                    out.write(self.draw_detections(frame, detections, frame_count, in_place=True))
+                    frame_count += 1
+            finally:
+                out.release()
+            os.replace(tmp_output, output_path)
+        finally:
+            cap.release()
+            if os.path.exists(tmp_output):
+                os.remove(tmp_output)
+        
+        return codec
+    
     def analyze_trajectories(self, ball_positions):
         """
         分析網球軌跡
+        以卡爾曼濾波追蹤器關聯各幀檢測，漏檢不超過 max_disappeared 幀的軌跡會被接續
         """
+        ball_positions = BallPositions.ensure(ball_positions)
+        tracker = KalmanBallTracker(max_disappeared=self.max_disappeared)
         trajectories = []
-        current_trajectory = []
         
-        for frame_data in ball_positions:
-            if frame_data['detections']:
-                # 取最可信的檢測
-                best_detection = max(frame_data['detections'], key=lambda x: x['confidence'])
-                current_trajectory.append({
-                    'frame': frame_data['frame_number'],
-                    'timestamp': frame_data['timestamp'],
-                    'position': best_detection['center'],
-                    'confidence': best_detection['confidence']
-                })
-            else:
-                # 如果檢測中斷，結束當前軌跡
-                if len(current_trajectory) > 5:  # 只保留足夠長的軌跡
-                    trajectories.append(current_trajectory)
-                current_trajectory = []
+        # 直接讀取欄式陣列，逐幀切片送入追蹤器
+        frame_numbers = ball_positions.frame_numbers.tolist()
+        timestamps = ball_positions.timestamps.tolist()
+        offsets = ball_positions.offsets.tolist()
+        centers = ball_positions.centers
+        confidences = ball_positions.confidences
+        interpolated = ball_positions.detections['interpolated']
+        for i, (frame_number, timestamp) in enumerate(zip(frame_numbers, timestamps)):
+            start, end = offsets[i], offsets[i + 1]
+            trajectories.extend(tracker.update(
+                frame_number, timestamp, centers[start:end], confidences[start:end], interpolated[start:end]
+            ))
         
-        # 處理最後一段軌跡
-        if len(current_trajectory) > 5:
-            trajectories.append(current_trajectory)
+        # 處理影片結束時仍在追蹤中的軌跡
+        trajectories.extend(tracker.finish())
+        trajectories.sort(key=lambda trajectory: trajectory[0])
         
         # 分析每條軌跡
         analyzed_trajectories = []
-        for i, trajectory in enumerate(trajectories):
-            analysis = self.analyze_single_trajectory(trajectory, i)
+        for track_id, trajectory in trajectories:
+            analysis = self.analyze_single_trajectory(trajectory, track_id)
             analyzed_trajectories.append(analysis)
         
         return analyzed_trajectories
@@ -0,0 +1,178 @@
+import numpy as np
+
+# 每幀一筆：幀號與時間戳
+FRAME_DTYPE = np.dtype([
+    ('frame_number', np.int32),
+    ('timestamp', np.float64)
+])
+
+# 每個檢測一筆：邊界框、信心分數與是否為插值結果
+# 中心點與尺寸可由邊界框推得，不另外儲存
+DETECTION_DTYPE = np.dtype([
+    ('bbox', np.float32, (4,)),
+    ('confidence', np.float32),
+    ('interpolated', np.bool_)
+])
+
+
+class BallPositions:
+    """
+    逐幀網球檢測結果的欄式儲存
+
+    frames 為每幀一筆的結構化陣列，detections 為所有檢測依幀順序串接的結構化陣列，
+    第 i 幀的檢測為 detections[offsets[i]:offsets[i + 1]]。
+    只有 API 需要時才以 to_dicts() 產生逐幀 dict 的表示。
+    """
+
+    def __init__(self, frames=None, detections=None, offsets=None):
+        if frames is None:
+            self._frames = np.zeros(64, dtype=FRAME_DTYPE)
+            self._detections = np.zeros(64, dtype=DETECTION_DTYPE)
+            self._offsets = np.zeros(65, dtype=np.int64)
+            self._frame_count = 0
+            self._detection_count = 0
+        else:
+            self._frames = np.asarray(frames, dtype=FRAME_DTYPE)
+            self._detections = np.asarray(detections, dtype=DETECTION_DTYPE)
+            self._offsets = np.asarray(offsets, dtype=np.int64)
+            self._frame_count = len(self._frames)
+            self._detection_count = len(self._detections)
+
+    @classmethod
+    def from_dicts(cls, ball_positions):
+        """由逐幀 dict 列表（舊格式或 API 輸出）建立"""
+        store = cls()
+        for frame_data in ball_positions:
+            store.append(frame_data['frame_number'], frame_data['timestamp'], frame_data['detections'])
+        return store
+
+    @classmethod
+    def ensure(cls, ball_positions):
+        """接受 BallPositions 或逐幀 dict 列表，統一回傳 BallPositions"""
+        if isinstance(ball_positions, cls):
+            return ball_positions
+        return cls.from_dicts(ball_positions or [])
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """由 to_arrays() 的輸出還原"""
+        return cls(arrays['frames'], arrays['detections'], arrays['offsets'])
+
+    def to_arrays(self):
+        """回傳可直接序列化（pickle/np.savez）的陣列"""
+        return {
+            'frames': self.frames,
+            'detections': self.detections,
+            'offsets': self.offsets
+        }
+
+    def append(self, frame_number, timestamp, detections):
+        """加入一幀的檢測結果（檢測為 tracker 產生的 dict 列表）"""
+        if self._frame_count == len(self._frames):
+            capacity = 2 * len(self._frames)
+            self._frames = np.resize(self._frames, capacity)
+            self._offsets = np.resize(self._offsets, capacity + 1)
+        needed = self._detection_count + len(detections)
+        if needed > len(self._detections):
+            self._detections = np.resize(self._detections, max(needed, 2 * len(self._detections)))
+
+        self._frames[self._frame_count] = (frame_number, timestamp)
+        for detection in detections:
+            self._detections[self._detection_count] = (
+                detection['bbox'], detection['confidence'], detection.get('interpolated', False)
+            )
+            self._detection_count += 1
+
+        self._frame_count += 1
+        self._offsets[self._frame_count] = self._detection_count
+
+    def __len__(self):
+        return self._frame_count
+
+    def __iter__(self):
+        for i in range(self._frame_count):
+            yield self[i]
+
+    def __getitem__(self, index):
+        """單幀的 dict 檢視（與舊版 ball_positions 的元素相同）"""
+        if index < 0:
+            index += self._frame_count
+        if not 0 <= index < self._frame_count:
+            raise IndexError(index)
+        frame = self._frames[index]
+        return {
+            'frame_number': int(frame['frame_number']),
+            'timestamp': float(frame['timestamp']),
+            'detections': self._detection_dicts(self._offsets[index], self._offsets[index + 1])
+        }
+
+    @property
+    def frames(self):
+        return self._frames[:self._frame_count]
+
+    @property
+    def detections(self):
+        return self._detections[:self._detection_count]
+
+    @property
+    def offsets(self):
+        return self._offsets[:self._frame_count + 1]
+
+    @property
+    def frame_numbers(self):
+        return self.frames['frame_number']
+
+    @property
+    def timestamps(self):
+        return self.frames['timestamp']
+
+    @property
+    def detection_counts(self):
+        return np.diff(self.offsets)
+
+    @property
+    def bboxes(self):
+        return self.detections['bbox'].astype(np.float64)
+
+    @property
+    def centers(self):
+        bboxes = self.bboxes
+        return (bboxes[:, :2] + bboxes[:, 2:]) / 2
+
+    @property
+    def confidences(self):
+        return self.detections['confidence'].astype(np.float64)
+
+    def frames_with_detections(self):
+        """包含至少一個檢測的幀數"""
+        return int(np.count_nonzero(self.detection_counts))
+
+    def first_centers(self):
+        """每幀第一個檢測的中心點，無檢測的幀為 NaN"""
+        centers = np.full((self._frame_count, 2), np.nan)
+        has_detection = self.detection_counts > 0
+        centers[has_detection] = self.centers[self.offsets[:-1][has_detection]]
+        return centers
+
+    def to_dicts(self):
+        """產生 API/JSON 使用的逐幀 dict 列表"""
+        return [self[i] for i in range(self._frame_count)]
+
+    def _detection_dicts(self, start, end):
+        detections = []
+        for bbox, confidence, interpolated in zip(
+            self._detections['bbox'][start:end].astype(np.float64).tolist(),
+            self._detections['confidence'][start:end].astype(np.float64).tolist(),
+            self._detections['interpolated'][start:end].tolist()
+        ):
+            x1, y1, x2, y2 = bbox
+            detection = {
+                'center': ((x1 + x2) / 2, (y1 + y2) / 2),
+                'bbox': (x1, y1, x2, y2),
+                'confidence': confidence,
+                'size': (x2 - x1, y2 - y1)
+            }
+            if interpolated:
+                detection['interpolated'] = True
+            detections.append(detection)
+        return detections
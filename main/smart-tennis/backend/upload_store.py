@@ -0,0 +1,269 @@
+"""
+可續傳的分段上傳
+
+用戶端先建立上傳（檔名與總大小），再依序以 PUT 傳送各段原始位元組（Upload-Offset 標示起點）。
+每段直接串流寫入暫存檔，同時累計 SHA-256；收到檔頭後立即讀取影片資訊。
+傳輸中斷時以 GET 查詢已收到的位元組數，從該位置繼續上傳。
+上傳完成時影片的雜湊與資訊都已取得，不需要再讀一次整個檔案。
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import threading
+from contextlib import contextmanager
+# fcntl 僅限 POSIX；Windows 只以單一行程的開發伺服器執行，行程內的鎖已足夠
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from frame_bus import probe_video
+
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+# 至少收到這麼多位元組才嘗試讀取檔頭
+MIN_PROBE_BYTES = 64 * 1024
+
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadOffsetError(Exception):
+    """分段的起點與伺服器已收到的位元組數不符"""
+
+    def __init__(self, offset):
+        super().__init__(f"上傳位置不符，伺服器已收到 {offset} 位元組")
+        self.offset = offset
+
+
+def digest_path(upload_folder, file_id):
+    """影片內容雜湊的保存路徑（結果快取使用）"""
+    return os.path.join(upload_folder, f"{file_id}.sha256")
+
+
+def write_digest(upload_folder, file_id, digest):
+    with open(digest_path(upload_folder, file_id), 'w', encoding='utf-8') as f:
+        f.write(digest)
+
+
+def save_stream(stream, path):
+    """將串流寫入檔案並同時計算 SHA-256，回傳雜湊值"""
+    digest = hashlib.sha256()
+    with open(path, 'wb') as f:
+        for block in iter(lambda: stream.read(STREAM_BLOCK_SIZE), b''):
+            digest.update(block)
+            f.write(block)
+    return digest.hexdigest()
+
+
+def probe_partial(path):
+    """
+    讀取（可能尚未傳完的）影片檔頭，取得有效資訊時回傳 dict，否則回傳 None
+    moov 在檔尾的 MP4 需等到上傳完成才能讀取
+    """
+    try:
+        info = probe_video(path)
+    except Exception:
+        return None
+    if info['fps'] > 0 and info['total_frames'] > 0 and info['width'] > 0:
+        return info
+    return None
+
+
+class ChunkedUploadStore:
+    """
+    分段上傳的狀態保存在 upload_folder/.partial：<upload_id>.part 為已收到的資料，
+    <upload_id>.json 為檔名、總大小與影片資訊；已收到的位元組數以暫存檔大小為準。
+    雜湊計算的中間狀態只保存在記憶體，由其他行程接手或伺服器重啟後會先補算已收到的部分。
+    同一上傳的寫入以執行緒鎖與暫存檔的檔案鎖（flock）互斥，多個伺服器行程同時收到分段也不會重複寫入。
+    """
+
+    def __init__(self, upload_folder, allowed_extensions, max_size, chunk_size, partial_ttl=24 * 3600):
+        self.upload_folder = upload_folder
+        self.partial_dir = os.path.join(upload_folder, '.partial')
+        self.allowed_extensions = allowed_extensions
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.partial_ttl = partial_ttl
+        # upload_id -> (已計算的位元組數, sha256 物件)
+        self.hashers = {}
+        self.locks = {}
+        self.locks_guard = threading.Lock()
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self.clean_expired()
+
+    def _paths(self, upload_id):
+        base = os.path.join(self.partial_dir, upload_id)
+        return base + '.part', base + '.json'
+
+    def _lock(self, upload_id):
+        with self.locks_guard:
+            return self.locks.setdefault(upload_id, threading.Lock())
+
+    @contextmanager
+    def _exclusive(self, upload_id):
+        """
+        取得上傳的寫入權：同行程以執行緒鎖、跨行程以暫存檔的 flock 互斥
+        暫存檔不存在（上傳不存在或已完成）時拋出 KeyError
+        """
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            raise KeyError(upload_id)
+        data_path, _ = self._paths(upload_id)
+        with self._lock(upload_id):
+            try:
+                lock_file = open(data_path, 'rb')
+            except FileNotFoundError:
+                raise KeyError(upload_id)
+            # 關閉檔案時釋放 flock
+            with lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                yield
+
+    def _save_state(self, state):
+        _, state_path = self._paths(state['id'])
+        tmp_path = state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, state_path)
+
+    def create(self, filename, size, analyze=False):
+        """建立上傳，回傳上傳狀態；副檔名或大小不符時拋出 ValueError"""
+        ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+        if ext not in self.allowed_extensions:
+            raise ValueError('不支援的檔案格式')
+        if size <= 0:
+            raise ValueError('檔案大小不正確')
+        if size > self.max_size:
+            raise ValueError(f'檔案超過大小上限 {self.max_size // (1024 * 1024)}MB')
+
+        state = {
+            'id': uuid.uuid4().hex,
+            'filename': filename,
+            'ext': ext,
+            'size': size,
+            'analyze': bool(analyze),
+            'video_info': None,
+            'created_at': time.time()
+        }
+        data_path, _ = self._paths(state['id'])
+        open(data_path, 'wb').close()
+        self._save_state(state)
+        self.hashers[state['id']] = (0, hashlib.sha256())
+        return dict(state, offset=0)
+
+    def get(self, upload_id):
+        """回傳上傳狀態（含已收到的位元組數 offset），找不到回傳 None"""
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            return None
+        data_path, state_path = self._paths(upload_id)
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            state['offset'] = os.path.getsize(data_path)
+        except (OSError, ValueError):
+            return None
+        return state
+
+    def _hasher(self, upload_id, data_path, offset):
+        """取得已涵蓋前 offset 位元組的雜湊物件，記憶體中沒有對應狀態時重新計算已收到的部分"""
+        cached = self.hashers.get(upload_id)
+        if cached is not None and cached[0] == offset:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(data_path, 'rb') as f:
+            for block in iter(lambda: f.read(STREAM_BLOCK_SIZE), b''):
+                digest.update(block)
+        return digest
+
+    def append(self, upload_id, offset, stream):
+        """
+        從 offset 寫入一段資料，回傳更新後的上傳狀態；上傳完成時狀態包含 file_id 與 sha256
+        找不到上傳時拋出 KeyError，位置不符時拋出 UploadOffsetError，超過宣告大小時拋出 ValueError
+        """
+        with self._exclusive(upload_id):
+            # 等待檔案鎖期間其他行程可能已寫入或完成上傳，取得鎖後才讀取狀態
+            state = self.get(upload_id)
+            if state is None:
+                raise KeyError(upload_id)
+            if offset != state['offset']:
+                raise UploadOffsetError(state['offset'])
+
+            data_path, _ = self._paths(upload_id)
+            digest = self._hasher(upload_id, data_path, offset)
+            received = offset
+            try:
+                with open(data_path, 'ab') as f:
+                    for block in iter(lambda: stream.read(STREAM_BLOCK_SIZE), b''):
+                        if received + len(block) > state['size']:
+                            raise ValueError('上傳的資料超過宣告的檔案大小')
+                        digest.update(block)
+                        f.write(block)
+                        received += len(block)
+            except ValueError:
+                # 丟棄這一段，保留之前已確認的資料
+                with open(data_path, 'r+b') as f:
+                    f.truncate(offset)
+                self.hashers.pop(upload_id, None)
+                raise
+            except Exception:
+                # 連線中斷：已寫入的部分保留，可從中斷處續傳
+                if os.path.getsize(data_path) == received:
+                    self.hashers[upload_id] = (received, digest)
+                else:
+                    self.hashers.pop(upload_id, None)
+                raise
+            self.hashers[upload_id] = (received, digest)
+            state['offset'] = received
+
+            # 收到檔頭後立即讀取影片資訊，之後不再重讀
+            if state['video_info'] is None and MIN_PROBE_BYTES <= received < state['size']:
+                video_info = probe_partial(data_path)
+                if video_info is not None:
+                    state['video_info'] = video_info
+                    self._save_state(state)
+
+            if received == state['size']:
+                return self._finalize(state, data_path, digest.hexdigest())
+            return state
+
+    def _finalize(self, state, data_path, digest):
+        """上傳完成：移到上傳資料夾並保存雜湊，必要時（檔頭在檔尾）才在此讀取影片資訊"""
+        file_id = str(uuid.uuid4())
+        video_path = os.path.join(self.upload_folder, f"{file_id}.{state['ext']}")
+        os.replace(data_path, video_path)
+        write_digest(self.upload_folder, file_id, digest)
+        if state['video_info'] is None:
+            state['video_info'] = probe_video(video_path)
+        self.abort(state['id'])
+        return dict(state, file_id=file_id, sha256=digest, path=video_path)
+
+    def abort(self, upload_id):
+        """取消上傳並刪除暫存資料"""
+        for path in self._paths(upload_id):
+            if os.path.exists(path):
+                os.remove(path)
+        self.hashers.pop(upload_id, None)
+        with self.locks_guard:
+            self.locks.pop(upload_id, None)
+
+    def clean_expired(self):
+        """刪除超過保留時間仍未完成的上傳"""
+        now = time.time()
+        for name in os.listdir(self.partial_dir):
+            path = os.path.join(self.partial_dir, name)
+            try:
+                if now - os.path.getmtime(path) > self.partial_ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def create_upload_store(upload_folder, allowed_extensions):
+    """依環境變數建立分段上傳"""
+    max_size = int(float(os.getenv('UPLOAD_MAX_SIZE_MB', '4096')) * 1024 * 1024)
+    chunk_size = int(float(os.getenv('UPLOAD_CHUNK_SIZE_MB', '8')) * 1024 * 1024)
+    partial_ttl = float(os.getenv('UPLOAD_PARTIAL_TTL_HOURS', '24')) * 3600
+    return ChunkedUploadStore(upload_folder, allowed_extensions, max_size, chunk_size, partial_ttl)
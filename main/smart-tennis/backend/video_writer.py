@@ -0,0 +1,153 @@
+import os
+import shutil
+import subprocess
+import cv2
+import numpy as np
+
+
+def find_ffmpeg():
+    """尋找 ffmpeg 執行檔：優先使用 imageio-ffmpeg 內建版本，其次為系統 PATH，找不到回傳 None"""
+    try:
+        import imageio_ffmpeg as ioff
+        return ioff.get_ffmpeg_exe()
+    except Exception:
+        return shutil.which('ffmpeg')
+
+
+class H264PipeWriter:
+    """
+    將 BGR 原始幀直接以管線送入 ffmpeg，一次編碼為瀏覽器可播放的 H.264 MP4（+faststart）
+    介面與 cv2.VideoWriter 相同（write / release / isOpened）
+    """
+    codec = 'h264'
+
+    def __init__(self, ffmpeg_exe, output_path, fps, size, preset='veryfast'):
+        width, height = size
+        self.output_path = output_path
+        cmd = [
+            ffmpeg_exe,
+            '-y',
+            '-loglevel', 'error',
+            '-f', 'rawvideo',
+            '-pix_fmt', 'bgr24',
+            '-s', f'{width}x{height}',
+            '-r', f'{fps or 30.0}',
+            '-i', '-',
+            '-an',
+            '-c:v', 'libx264',
+            # yuv420p 需要偶數寬高
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+            '-pix_fmt', 'yuv420p',
+            '-preset', preset,
+            '-movflags', '+faststart',
+            output_path
+        ]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.PIPE)
+
+    def isOpened(self):
+        return self.process is not None and self.process.poll() is None
+
+    def write(self, frame):
+        try:
+            # 連續記憶體的幀直接以 buffer 寫入，不另外複製成 bytes
+            self.process.stdin.write(np.ascontiguousarray(frame))
+        except (BrokenPipeError, OSError):
+            self.release()
+            raise
+
+    def release(self):
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        stderr = process.stderr.read()
+        process.stderr.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg 編碼失敗: {stderr.decode('utf-8', errors='ignore').strip()}")
+
+
+class _OpenCVWriter:
+    """無 ffmpeg 時的備用輸出：cv2.VideoWriter（mp4v），之後可再轉碼"""
+    codec = 'mp4v'
+
+    def __init__(self, output_path, fps, size):
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self.writer = cv2.VideoWriter(output_path, fourcc, fps, size)
+
+    def isOpened(self):
+        return self.writer.isOpened()
+
+    def write(self, frame):
+        self.writer.write(frame)
+
+    def release(self):
+        self.writer.release()
+
+
+def open_video_writer(output_path, fps, size):
+    """
+    建立標註影片的輸出器
+    可用 ffmpeg 且未停用 H264_DIRECT 時直接編碼為 H.264，否則退回 OpenCV mp4v；
+    回傳物件的 codec 屬性標示實際輸出格式
+    """
+    if os.getenv('H264_DIRECT', '1') == '1':
+        ffmpeg_exe = find_ffmpeg()
+        if ffmpeg_exe:
+            try:
+                return H264PipeWriter(ffmpeg_exe, output_path, fps, size)
+            except Exception as e:
+                print(f"無法啟動 ffmpeg 編碼，改用 OpenCV 輸出: {e}")
+    return _OpenCVWriter(output_path, fps, size)
+
+
+# 確保處理後影片為瀏覽器可播放的 H.264 MP4 格式
+# 若系統未安裝 ffmpeg，會嘗試透過 imageio-ffmpeg 自動下載內建版本
+# 若未安裝 imageio-ffmpeg，將跳過轉碼（可能導致瀏覽器無法播放）
+
+def ensure_h264_mp4_safe(input_path: str):
+    """以非破壞方式轉碼：輸出到 *_h264.mp4，成功後再原子替換。避免 Windows 檔案佔用導致 500。"""
+    try:
+        try:
+            import imageio_ffmpeg as ioff
+        except Exception:
+            print("提示: 建議安裝 imageio-ffmpeg 以轉碼為 H.264，確保瀏覽器可播放。\n    安裝指令: pip install imageio-ffmpeg")
+            return None
+
+        ffmpeg_exe = ioff.get_ffmpeg_exe()
+        tmp_output = input_path.rsplit('.mp4', 1)[0] + '_h264.mp4'
+        # 若前次殘留，先嘗試刪除暫存輸出
+        try:
+            if os.path.exists(tmp_output):
+                os.remove(tmp_output)
+        except Exception:
+            pass
+        # 將 moov atom 前移（+faststart），並使用瀏覽器通用的像素格式
+        cmd = [
+            ffmpeg_exe,
+            '-y',
+            '-i', input_path,
+            '-c:v', 'libx264',
+            '-pix_fmt', 'yuv420p',
+            '-movflags', '+faststart',
+            '-preset', 'veryfast',
+            tmp_output
+        ]
+        try:
+            res = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            # 嘗試原子替換，若失敗則保留原檔與新檔並回傳新檔路徑讓呼叫者改用
+            try:
+                os.replace(tmp_output, input_path)
+                return input_path
+            except Exception as e:
+                print(f"原檔替換失敗，改用轉碼檔回傳：{e}")
+                return tmp_output if os.path.exists(tmp_output) else None
+        except Exception as e:
+            print(f"轉碼失敗（保留原檔）：{e}\n詳細: {getattr(e, 'stderr', b'').decode('utf-8', errors='ignore')}")
+            return None
+    except Exception as e:
+        print(f"轉碼流程發生異常（保留原檔）：{e}")
+        return None
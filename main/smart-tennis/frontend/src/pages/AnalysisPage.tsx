@@ -20,28 +20,30 @@ const AnalysisPage: React.FC = () => {
     setAnalyzing(true);
     setError(null);
 
-    // 模擬分析步驟
-    const steps = [
-      '初始化模型...',
-      '載入影片...',
-      '檢測網球...',
-      '追蹤軌跡...',
-      '分析姿態...',
-      '檢測擊球...',
-      '計算速度...',
-      '生成結果...'
-    ];
+    // 後端回報的分析階段
+    const stageLabels: Record<string, string> = {
+      queued: '排隊等待中...',
+      tracking: '檢測與追蹤網球...',
+      shots: '檢測擊球...',
+      speed: '計算速度...',
+      saving: '生成結果...',
+      done: '生成結果...'
+    };
 
     try {
-      for (let i = 0; i < steps.length; i++) {
-        setCurrentStep(steps[i]);
-        setProgress((i / steps.length) * 90); // 90% 為分析進度
-        await new Promise(resolve => setTimeout(resolve, 1000)); // 模擬處理時間
-      }
-
-      // 執行實際分析
-      setCurrentStep('正在處理影片...');
-      const result = await analyzeVideo(id);
+      setCurrentStep('提交分析工作...');
+      await analyzeVideo(id, (job) => {
+        let label = stageLabels[job.stage] || '正在處理影片...';
+        if (job.stage === 'tracking' && job.total_frames > 0) {
+          label = `${label}（${job.frames_done}/${job.total_frames} 幀`;
+          if (job.fps && job.eta != null) {
+            label = `${label}，${job.fps.toFixed(0)} fps，約剩 ${Math.ceil(job.eta)} 秒`;
+          }
+          label = `${label}）`;
+        }
+        setCurrentStep(label);
+        setProgress(job.progress * 100);
+      });
 
       setProgress(100);
       setCurrentStep('分析完成！');
@@ -40,7 +40,7 @@ const UploadPage: React.FC = () => {
     accept: {
       'video/*': ['.mp4', '.avi', '.mov', '.mkv']
     },
-    maxSize: 100 * 1024 * 1024, // 100MB
+    maxSize: 4 * 1024 * 1024 * 1024, // 4GB（分段上傳，可續傳）
     multiple: false
   });
 
@@ -51,7 +51,7 @@ const UploadPage: React.FC = () => {
           上傳網球影片
         </h1>
         <p className="text-lg text-gray-600">
-          支援 MP4、AVI、MOV、MKV 格式，檔案大小限制 100MB
+          支援 MP4、AVI、MOV、MKV 格式，檔案大小限制 4GB
         </p>
       </div>
 
@@ -75,7 +75,7 @@ const UploadPage: React.FC = () => {
                   拖拽影片檔案到此處，或點擊選擇檔案
                 </p>
                 <p className="text-sm text-gray-500">
-                  支援的格式：MP4, AVI, MOV, MKV（最大 100MB）
+                  支援的格式：MP4, AVI, MOV, MKV（最大 4GB）
                 </p>
               </div>
             )}
@@ -73,48 +73,204 @@ export interface TrajectorySpeed {
   avg_speed: number;
 }
 
-// 上傳影片
+const UPLOAD_RETRY_LIMIT = 5;
+const UPLOAD_CHUNK_TIMEOUT = 120000;
+
+interface UploadStatus {
+  upload_id: string;
+  offset: number;
+  size: number;
+  chunk_size: number;
+}
+
+// 同一個檔案（名稱、大小、修改時間相同）重新上傳時沿用未完成的上傳
+const uploadKey = (file: File) => `upload:${file.name}:${file.size}:${file.lastModified}`;
+
+const startOrResumeUpload = async (file: File): Promise<UploadStatus> => {
+  const savedId = localStorage.getItem(uploadKey(file));
+  if (savedId) {
+    try {
+      const response = await api.get(`/uploads/${savedId}`);
+      return response.data;
+    } catch (error) {
+      localStorage.removeItem(uploadKey(file));
+    }
+  }
+  // analyze: 上傳完成時立即排入分析
+  const response = await api.post('/uploads', { filename: file.name, size: file.size, analyze: true });
+  localStorage.setItem(uploadKey(file), response.data.upload_id);
+  return response.data;
+};
+
+// 上傳影片：分段上傳，中斷時從伺服器已收到的位置續傳
 export const uploadVideo = async (
   file: File,
   onProgress?: (progress: number) => void
 ): Promise<UploadResponse> => {
-  const formData = new FormData();
-  formData.append('video', file);
-
   try {
-    const response = await api.post('/upload', formData, {
-      headers: {
-        'Content-Type': 'multipart/form-data',
-      },
-      onUploadProgress: (progressEvent) => {
-        if (progressEvent.total && onProgress) {
-          const progress = (progressEvent.loaded / progressEvent.total) * 100;
-          onProgress(progress);
-        }
-      },
-    });
+    const status = await startOrResumeUpload(file);
+    let offset = status.offset;
+    let retries = 0;
+    onProgress?.((offset / file.size) * 100);
 
-    return response.data;
+    while (true) {
+      const chunk = file.slice(offset, offset + status.chunk_size);
+      try {
+        const response = await api.put(`/uploads/${status.upload_id}`, chunk, {
+          headers: {
+            'Content-Type': 'application/octet-stream',
+            'Upload-Offset': String(offset),
+          },
+          timeout: UPLOAD_CHUNK_TIMEOUT,
+          onUploadProgress: (progressEvent) => {
+            onProgress?.(((offset + progressEvent.loaded) / file.size) * 100);
+          },
+        });
+        retries = 0;
+        if (response.data.file_id) {
+          localStorage.removeItem(uploadKey(file));
+          return response.data;
+        }
+        offset = response.data.offset;
+      } catch (error: any) {
+        if (error.response?.status === 409) {
+          // 伺服器已收到的位置與本地不同，從伺服器的位置繼續
+          offset = error.response.data.offset;
+          continue;
+        }
+        if (error.response?.status === 404 || error.response?.status === 400 || retries >= UPLOAD_RETRY_LIMIT) {
+          localStorage.removeItem(uploadKey(file));
+          throw error;
+        }
+        // 連線中斷：稍候後查詢伺服器已收到的位置再續傳
+        retries += 1;
+        await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+        try {
+          offset = (await api.get(`/uploads/${status.upload_id}`)).data.offset;
+        } catch (statusError) {
+          // 仍無法連線，下一輪重試
+        }
+      }
+    }
   } catch (error: any) {
     throw new Error(error.response?.data?.error || '上傳失敗');
   }
 };
 
-// 開始分析
-export const analyzeVideo = async (fileId: string): Promise<AnalysisResults> => {
+export interface JobProgress {
+  status: 'queued' | 'running' | 'succeeded' | 'failed';
+  stage: string;
+  progress: number;
+  frames_done: number;
+  total_frames: number;
+  fps?: number | null;  // 追蹤階段的處理速度（幀/秒）
+  eta?: number | null;  // 預估剩餘秒數
+  error?: string | null;
+}
+
+const JOB_POLL_INTERVAL = 1000;
+
+// 提交背景分析工作，回傳工作 ID
+export const submitAnalysisJob = async (fileId: string): Promise<string> => {
   try {
-    // 分析可能耗時數分鐘，覆蓋預設 30 秒的逾時設定
-    const response = await api.post(`/analyze/${fileId}`, null, { timeout: 0 }); // 0 = 不逾時
-    return response.data.results;
+    const response = await api.post('/jobs', { file_id: fileId });
+    return response.data.job.id;
   } catch (error: any) {
-    throw new Error(error.response?.data?.error || '分析失敗');
+    if (error.response?.status === 429) {
+      throw new Error('伺服器忙碌中，請稍後再試');
+    }
+    throw new Error(error.response?.data?.error || '提交分析失敗');
+  }
+};
+
+// 查詢工作進度
+export const getJobProgress = async (jobId: string): Promise<JobProgress> => {
+  const response = await api.get(`/jobs/${jobId}/progress`);
+  return response.data;
+};
+
+// 結果頁只需要摘要、擊球與速度，不下載逐幀追蹤資料
+const RESULT_FIELDS = 'file_id,analysis_id,timestamp,summary,shots,speed,tracking.video_info';
+
+// 取得工作結果
+export const getJobResult = async (jobId: string): Promise<AnalysisResults> => {
+  try {
+    const response = await api.get(`/jobs/${jobId}/result`, { params: { fields: RESULT_FIELDS } });
+    return response.data;
+  } catch (error: any) {
+    throw new Error(error.response?.data?.error || '獲取結果失敗');
+  }
+};
+
+// 以 SSE 接收工作進度，直到工作結束；連線失敗時 resolve false 讓呼叫端改用輪詢
+const streamJobProgress = (
+  jobId: string,
+  onProgress?: (progress: JobProgress) => void
+): Promise<boolean> => new Promise((resolve, reject) => {
+  if (typeof EventSource === 'undefined') {
+    resolve(false);
+    return;
+  }
+  const source = new EventSource(`${API_BASE_URL}/jobs/${jobId}/events`);
+  let received = false;
+
+  source.addEventListener('progress', (event) => {
+    received = true;
+    onProgress?.(JSON.parse((event as MessageEvent).data));
+  });
+  source.addEventListener('done', (event) => {
+    source.close();
+    const progress: JobProgress = JSON.parse((event as MessageEvent).data);
+    onProgress?.(progress);
+    if (progress.status === 'failed') {
+      reject(new Error(progress.error || '分析失敗'));
+    } else {
+      resolve(true);
+    }
+  });
+  source.onerror = () => {
+    // 已開始接收事件時交由瀏覽器自動重新連線；一開始就連不上或伺服器拒絕重連則改用輪詢
+    if (!received || source.readyState === EventSource.CLOSED) {
+      source.close();
+      resolve(false);
+    }
+  };
+});
+
+// 開始分析：提交背景工作並接收進度（優先使用 SSE，否則輪詢），完成後回傳結果（不受請求逾時限制）
+export const analyzeVideo = async (
+  fileId: string,
+  onProgress?: (progress: JobProgress) => void
+): Promise<AnalysisResults> => {
+  const jobId = await submitAnalysisJob(fileId);
+
+  if (await streamJobProgress(jobId, onProgress)) {
+    return getJobResult(jobId);
+  }
+
+  while (true) {
+    let progress: JobProgress;
+    try {
+      progress = await getJobProgress(jobId);
+    } catch (error: any) {
+      throw new Error(error.response?.data?.error || '查詢分析進度失敗');
+    }
+    onProgress?.(progress);
+
+    if (progress.status === 'succeeded') {
+      return getJobResult(jobId);
+    }
+    if (progress.status === 'failed') {
+      throw new Error(progress.error || '分析失敗');
+    }
+    await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
   }
 };
 
 // 獲取分析結果
 export const getResults = async (fileId: string): Promise<AnalysisResults> => {
   try {
-    const response = await api.get(`/results/${fileId}`);
+    const response = await api.get(`/results/${fileId}`, { params: { fields: RESULT_FIELDS } });
     return response.data;
   } catch (error: any) {
     throw new Error(error.response?.data?.error || '獲取結果失敗');